@@ -1,168 +1,370 @@
-from flask import Flask, jsonify, request
+from flask import Flask, abort, jsonify, request
 from flask_cors import CORS
-import numpy as np
-import torch
-from utile import get_legal_moves, initialze_board
+import struct
+import threading
+from bitboard import INITIAL_BLACK, INITIAL_WHITE, legal_moves_mask, flip_mask, mask_to_moves, popcount
+from board_history import BoardHistory
+from difficulties import SEARCH_PLAYERS, SERVED_PLAYERS
+from game_store import make_game_store
+from zobrist import update_hashes
+
+# torch, the model registry and the inference batcher are imported on the
+# first AI move: serverless cold starts only pay for Flask and numpy until then
 
 BOARD_SIZE=8
 app = Flask(__name__)
 CORS(app)
+# Guards the lazy singletons below: concurrent first requests of the
+# request threads must not each build their own
+_singletons_lock = threading.Lock()
+_inference_batcher = None
+_position_cache = None
+_lstm_states = None
+# False once we know there is no opening book
+_opening_book = None
 
 
-def input_seq_generator(board_stats_seq,length_seq):
-    
-    board_stat_init=initialze_board()
-
-    if len(board_stats_seq) >= length_seq:
-        input_seq=board_stats_seq[-length_seq:]
-    else:
-        input_seq=[board_stat_init]
-        #Padding starting board state before first index of sequence
-        for i in range(length_seq-len(board_stats_seq)-1):
-            input_seq.append(board_stat_init)
-        #adding the inital of game as the end of sequence sample
-        for i in range(len(board_stats_seq)):
-            input_seq.append(board_stats_seq[i])
-            
-    return input_seq
-
-def find_best_move(move1_prob,legal_moves):
+def get_inference_batcher():
+    global _inference_batcher
+    if _inference_batcher is None:
+        with _singletons_lock:
+            if _inference_batcher is None:
+                from inference import InferenceBatcher
+                _inference_batcher = InferenceBatcher()
+    return _inference_batcher
+
+
+def get_position_cache():
+    global _position_cache
+    if _position_cache is None:
+        with _singletons_lock:
+            if _position_cache is None:
+                from position_cache import PositionCache
+                _position_cache = PositionCache()
+    return _position_cache
+
+
+def get_lstm_states():
+    global _lstm_states
+    if _lstm_states is None:
+        with _singletons_lock:
+            if _lstm_states is None:
+                from lstm_state import LSTMStateCache
+                _lstm_states = LSTMStateCache()
+    return _lstm_states
+
+
+def get_opening_book():
+    global _opening_book
+    if _opening_book is None:
+        with _singletons_lock:
+            if _opening_book is None:
+                from opening_book import load_opening_book
+                _opening_book = load_opening_book() or False
+    return _opening_book or None
+
+
+def find_best_move(move1_prob,legal_mask):
     """
     Finds the best move based on the provided move probabilities and legal moves.
 
     Parameters:
-    - move1_prob (numpy.ndarray): 2D array representing the probabilities of moves.
-    - legal_moves (list): List of legal moves.
+    - move1_prob (torch.Tensor): Probabilities of moves, shape (64,) or (8, 8).
+    - legal_mask (int): Bitboard of the legal moves (see bitboard.legal_moves_mask).
 
     Returns:
     - tuple: The best move coordinates (row, column).
     """
+    from inference import legal_mask_tensor, masked_argmax
 
-    # Initialize the best move with the first legal move
-    best_move=legal_moves[0]
-    
-    # Initialize the maximum score with the probability of the first legal move
-    max_score=move1_prob[legal_moves[0][0],legal_moves[0][1]]
-    
-    # Iterate through all legal moves to find the one with the maximum probability
-    for i in range(len(legal_moves)):
-        # Update the best move if the current move has a higher probability
-        if move1_prob[legal_moves[i][0],legal_moves[i][1]]>max_score:
-            max_score=move1_prob[legal_moves[i][0],legal_moves[i][1]]
-            best_move=legal_moves[i]
-    return best_move
+    square = int(masked_argmax(move1_prob, legal_mask_tensor(legal_mask, move1_prob.device)))
+    return (square // BOARD_SIZE, square % BOARD_SIZE)
 
 class ReversiGrid:
+    """
+    Reversi game played through the API, stored as two bitboards.
+
+    The disc counts and the legal moves of the current player are kept up to
+    date by make_move, so that legal moves, scores and the end of the game
+    are read without scanning the board.
+    """
+
     def __init__(self):
-        self.board = [[0 for _ in range(8)] for _ in range(8)]
         self.current_player = -1
         self.place_initial_pieces()
+        self.history = BoardHistory()
+        self.history.append_bitboards(self.black, self.white)
 
     def place_initial_pieces(self):
-        self.board[3][3] = 1
-        self.board[4][4] = 1
-        self.board[3][4] = -1
-        self.board[4][3] = -1
+        self.black = INITIAL_BLACK
+        self.white = INITIAL_WHITE
+        self.black_count = 2
+        self.white_count = 2
+        self.legal = legal_moves_mask(self.black, self.white)
 
-    def is_valid_move(self, row, col):
-        if self.board[row][col] != 0:
-            return False  # La case est déjà occupée, le mouvement est donc invalide
+    @property
+    def board(self):
+        board = [[0 for _ in range(8)] for _ in range(8)]
+        for r, c in mask_to_moves(self.black):
+            board[r][c] = -1
+        for r, c in mask_to_moves(self.white):
+            board[r][c] = 1
+        return board
 
-        directions = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-        valid_move = False
+    def own_opp(self):
+        if self.current_player == -1:
+            return self.black, self.white
+        return self.white, self.black
+
+    def set_own_opp(self, own, opp):
+        if self.current_player == -1:
+            self.black, self.white = own, opp
+        else:
+            self.white, self.black = own, opp
 
-        for dx, dy in directions:
-            r, c = row + dx, col + dy
-            to_flip = []
-            while 0 <= r < 8 and 0 <= c < 8 and self.board[r][c] != 0 and self.board[r][c] != self.current_player:
-                to_flip.append((r, c))
-                r += dx
-                c += dy
-            if 0 <= r < 8 and 0 <= c < 8 and self.board[r][c] == self.current_player and to_flip:
-                valid_move = True
-                break
+    # black bitboard, white bitboard, current player, legal moves of the
+    # current player, followed by the history
+    STATE_FORMAT = '<QQbQ'
 
-        return valid_move
+    def to_bytes(self):
+        return struct.pack(self.STATE_FORMAT, self.black, self.white, self.current_player, self.legal) + self.history.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, state):
+        game = cls.__new__(cls)
+        game.black, game.white, game.current_player, game.legal = struct.unpack_from(cls.STATE_FORMAT, state)
+        game.black_count = popcount(game.black)
+        game.white_count = popcount(game.white)
+        game.history = BoardHistory.from_bytes(state[struct.calcsize(cls.STATE_FORMAT):])
+        return game
+
+    def is_valid_move(self, row, col):
+        return bool(self.legal >> (row*BOARD_SIZE + col) & 1)
 
     def flip_pieces(self, row, col):
-        directions = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-        for dx, dy in directions:
-            r, c = row + dx, col + dy
-            to_flip = []
-            while 0 <= r < 8 and 0 <= c < 8 and self.board[r][c] != 0 and self.board[r][c] != self.current_player:
-                to_flip.append((r, c))
-                r += dx
-                c += dy
-            if 0 <= r < 8 and 0 <= c < 8 and self.board[r][c] == self.current_player:
-                for r, c in to_flip:
-                    self.board[r][c] = self.current_player
+        own, opp = self.own_opp()
+        flips = flip_mask(own, opp, row*BOARD_SIZE + col)
+        self.set_own_opp(own | flips, opp & ~flips)
+        return flips
+
+    def is_game_over(self):
+        return self.legal == 0
+
+    def winner(self):
+        if self.black_count > self.white_count:
+            return "Black"
+        if self.white_count > self.black_count:
+            return "White"
+        return "Draw"
 
     def make_move(self, row, col):
-        if self.is_valid_move(row, col):
-            self.board[row][col] = self.current_player
-            self.current_player = -1 if self.current_player == 1 else 1
-            black_count, white_count = self.count_pieces()
+        if not self.is_valid_move(row, col):
+            return {"success": True}
 
-            if not any(self.is_valid_move(row, col) for row in range(8) for col in range(8)):
-                black_count, white_count = self.count_pieces()
-                winner = "Black" if black_count > white_count else "White" if white_count < black_count else "Draw"
-                return {"success": True, "winner": winner}
+        square = row*BOARD_SIZE + col
+        own, opp = self.own_opp()
+        self.set_own_opp(own | 1 << square, opp)
+        flips = self.flip_pieces(row, col)
+        nb_flips = popcount(flips)
+        if self.current_player == -1:
+            self.black_count += 1 + nb_flips
+            self.white_count -= nb_flips
+        else:
+            self.white_count += 1 + nb_flips
+            self.black_count -= nb_flips
+        hashes = update_hashes(self.history.last_hashes(), self.current_player, square, flips)
+        self.history.append_bitboards(self.black, self.white, hashes)
+
+        # Only the discs of this move changed, the legal moves of the next
+        # player are recomputed from the two bitboards
+        own, opp = self.own_opp()
+        self.legal = legal_moves_mask(opp, own)
+        if self.legal:
+            self.current_player = -self.current_player
+            return {"success": True}
 
-        return {"success": True}
+        # The opponent has to pass: the same player moves again, and the board
+        # is recorded a second time as launch_game does for a pass
+        self.legal = legal_moves_mask(own, opp)
+        if self.legal:
+            self.history.append_bitboards(self.black, self.white, hashes)
+            return {"success": True, "pass": "White" if self.current_player == -1 else "Black"}
 
-    def make_one_move(self, playerDisc, player): # player = difficulty (type of AI)
+        return {"success": True, "winner": self.winner()}
+
+    def make_one_move(self, playerDisc, player, game_id=None): # player = difficulty (type of AI)
     # player: model description
     # board_stat: current 8x8 board status
     # turn: 1 or -1 - black or white turn
+    # game_id: keys the LSTM state of the game (see lstm_state), None runs the whole window
         # if current move is for player, skip
         if ((self.current_player == -1 and playerDisc == 'Black') or (self.current_player == 1 and playerDisc == 'White')):
             return -1, -1
-        device = torch.device("cpu")
-
-        conf = {}
-        if (player == 'Easy'):
-            conf['player']= 'server\\api\\Easy.pt'
-        elif (player == 'Medium'):
-            conf['player']= 'server\\api\\Medium.pt'
-        elif (player == 'Hard'):
-            conf['player']= 'server\\api\\Hard.pt'
-        
-        model = torch.load(conf['player'],map_location=torch.device('cpu'))
-        model.eval()
-        input_seq_boards = input_seq_generator(self.board,model.len_inpout_seq)
-        
-        
-        #if black is the current player the board should be multiplay by -1
-        if (self.current_player == -1):
-            model_input=np.array([input_seq_boards])*-1
-        else:
-            model_input = np.array([input_seq_boards])
-        move1_prob = model(torch.tensor(model_input).float().to(device))
-        move1_prob = move1_prob.cpu().detach().numpy().reshape(8,8)
-        legal_moves = get_legal_moves(self.board, self.current_player)
-        if len(legal_moves) > 0:
-            best_move = find_best_move(move1_prob,legal_moves)
+        if self.is_game_over():
+            return -1, -1
+        # Book moves in the opening, without the models
+        book = get_opening_book()
+        if book is not None:
+            book_move = book.lookup(player, self.black, self.white, self.current_player)
+            if book_move is not None:
+                best_move = (book_move // BOARD_SIZE, book_move % BOARD_SIZE)
+                color = "Black" if self.current_player == -1 else "White"
+                print(f"{color}: {best_move} < from the opening book")
+                return best_move
+        # Exact play once few squares are empty, the network if the solve runs out of time
+        from endgame import endgame_move
+
+        solved = endgame_move(self.black, self.white, self.current_player)
+        if solved is not None and solved["move"] is not None:
+            best_move = (solved["move"] // BOARD_SIZE, solved["move"] % BOARD_SIZE)
+            color = "Black" if self.current_player == -1 else "White"
+            print(f"{color}: {best_move} < endgame solved, final score {solved['score']:+d} "
+                  f"({solved['nodes']} nodes in {solved['seconds']:.2f}s)")
+            return best_move
+
+        if player in SEARCH_PLAYERS:
+            return self.search_move(player)
+
+        import torch
+        from model_registry import get_model
+
+        model = get_model(player)
+        # Openings repeat across games: their outputs come from the cache
+        position_cache = get_position_cache()
+        key, symmetry = position_cache.key(self.history.hash_window(model.len_inpout_seq), self.current_player)
+        move1_prob = position_cache.get(player, key, symmetry)
+        if move1_prob is None:
+            model_input = torch.from_numpy(self.history.window(model.len_inpout_seq))
+
+            #if black is the current player the board should be multiplay by -1
             if (self.current_player == -1):
-                print(f"Black: {best_move} < from possible move {legal_moves}")
+                model_input = -model_input
+            prediction = None
+            if game_id is not None:
+                prediction = get_lstm_states().predict_drift((game_id, player, self.current_player), model,
+                                                             model_input, self.history.nb_boards)
+            if prediction is None:
+                move1_prob = get_inference_batcher().predict(player, model_input)
+                position_cache.put(player, key, symmetry, move1_prob)
             else:
-                print(f"White: {best_move} < from possible move {legal_moves}")
-            return best_move
+                move1_prob, drift = prediction
+                # An advanced state only approximates the window: it stays with its game
+                if drift == 0:
+                    position_cache.put(player, key, symmetry, move1_prob)
+        best_move = find_best_move(move1_prob,self.legal)
+        legal_moves = mask_to_moves(self.legal)
+        if (self.current_player == -1):
+            print(f"Black: {best_move} < from possible move {legal_moves}")
+        else:
+            print(f"White: {best_move} < from possible move {legal_moves}")
+        return best_move
     
+    def search_move(self, player):
+        # Search difficulties (see search.py): tree search guided by a network
+        from search import search_move
+
+        report = search_move(player, self.black, self.white, self.current_player,
+                             self.history.window(self.history.capacity))
+        best_move = (report["move"] // BOARD_SIZE, report["move"] % BOARD_SIZE)
+        color = "Black" if self.current_player == -1 else "White"
+        print(f"{color}: {best_move} < searched {report['nodes']} positions in {report['seconds']:.2f}s "
+              f"({report['nodes_per_sec']:.0f} nodes/s, depth {report['depth']})")
+        return best_move
+
     def count_pieces(self):
-        black_count = sum(row.count(-1) for row in self.board)
-        white_count = sum(row.count(1) for row in self.board)
-        return black_count, white_count 
+        return self.black_count, self.white_count
+
+game_store = make_game_store()
+
+# Requests without a game_id all play on this game, as the single global
+# board used to
+DEFAULT_GAME_ID = 'default'
+
+
+def request_game_id():
+    data = request.get_json(silent=True) or {}
+    return data.get('game_id') or request.args.get('game_id') or DEFAULT_GAME_ID
+
+def load_game(game_id):
+    reversi_game, _ = load_game_version(game_id)
+    return reversi_game
+
+def load_game_version(game_id):
+    # The version goes back to save_game, which refuses the save if another
+    # request changed the game meanwhile
+    entry = game_store.load_version(game_id)
+    if entry is None:
+        if game_id != DEFAULT_GAME_ID:
+            abort(404, description=f"Unknown game {game_id}")
+        return ReversiGrid(), None
+    return ReversiGrid.from_bytes(entry[0]), entry[1]
+
+def save_game(game_id, reversi_game, version):
+    if not game_store.save(game_id, reversi_game.to_bytes(), version):
+        abort(409, description=f"Game {game_id} was changed by another request")
+
+def game_response(result, winner=None):
+    response = jsonify(result)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    if winner:
+        response.headers.add('winner', winner)
+    return response
+
 
-reversi_game = ReversiGrid()
+@app.route('/games', methods=['POST'])
+def create_game():
+    reversi_game = ReversiGrid()
+    game_id = game_store.create(reversi_game.to_bytes())
+    return jsonify({"game_id": game_id, "board": reversi_game.board,
+                    "current_player": reversi_game.current_player}), 201
 
+@app.route('/games/<game_id>', methods=['GET'])
+def get_game(game_id):
+    reversi_game = load_game(game_id)
+    return jsonify({"game_id": game_id, "board": reversi_game.board,
+                    "current_player": reversi_game.current_player})
+
+@app.route('/games/<game_id>', methods=['DELETE'])
+def delete_game(game_id):
+    if not game_store.delete(game_id):
+        abort(404, description=f"Unknown game {game_id}")
+    if _lstm_states is not None:
+        _lstm_states.forget(game_id)
+    return jsonify({"success": True})
+
+@app.route('/inference_metrics', methods=['GET'])
+def inference_metrics():
+    if _inference_batcher is None:
+        return jsonify({})
+    return jsonify(_inference_batcher.metrics())
+
+@app.route('/position_cache_metrics', methods=['GET'])
+def position_cache_metrics():
+    if _position_cache is None:
+        return jsonify({})
+    return jsonify(_position_cache.metrics())
+
+@app.route('/lstm_state_metrics', methods=['GET'])
+def lstm_state_metrics():
+    if _lstm_states is None:
+        return jsonify({})
+    return jsonify(_lstm_states.metrics())
+
+@app.route('/opening_book_metrics', methods=['GET'])
+def opening_book_metrics():
+    if not _opening_book:
+        return jsonify({})
+    return jsonify(_opening_book.metrics())
 
 @app.route('/get_board', methods=['GET'])
 def get_board():
+    reversi_game = load_game(request_game_id())
     return jsonify(reversi_game.board)
 
 @app.route('/get_possible_moves', methods=['GET'])
 def get_possible_moves():
-    return jsonify(get_legal_moves(reversi_game.board, reversi_game.current_player))
+    reversi_game = load_game(request_game_id())
+    return jsonify(mask_to_moves(reversi_game.legal))
 
 @app.route('/make_move', methods=['POST'])
 def make_move():
@@ -170,32 +372,28 @@ def make_move():
     row = data['row']
     col = data['col']
 
+    game_id = request_game_id()
+    reversi_game, version = load_game_version(game_id)
     result = reversi_game.make_move(row, col)
-    winner = result.get("winner")
-    
-    response = jsonify(result)
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    if winner:
-        response.headers.add('winner', winner)
+    save_game(game_id, reversi_game, version)
 
-    return response
+    return game_response(result, result.get("winner"))
 
 @app.route('/make_one_move', methods=['POST'])
 def make_one_move():
     data = request.get_json()
     difficulty = data['difficulty']
+    # Only the served difficulties: the name picks the model to load
+    if difficulty not in SERVED_PLAYERS:
+        abort(400, description=f"Unknown difficulty {difficulty}")
     player_disc = data['playerDisc']
-    row, col = reversi_game.make_one_move(player_disc, difficulty)
+    game_id = request_game_id()
+    reversi_game, version = load_game_version(game_id)
+    row, col = reversi_game.make_one_move(player_disc, difficulty, game_id)
     if row == -1 or col == -1:
         row = data['row']
         col = data['col']
     result = reversi_game.make_move(row, col)
-    winner = result.get("winner")
-    
-    response = jsonify(result)
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    if winner:
-        response.headers.add('winner', winner)
-
-    return response
+    save_game(game_id, reversi_game, version)
 
+    return game_response(result, result.get("winner"))
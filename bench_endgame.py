@@ -0,0 +1,64 @@
+import argparse
+
+import numpy as np
+
+from bitboard import legal_moves_mask, popcount
+from endgame import EndgameSolver, Timeout
+from game_log import random_games, read_games, replay
+
+
+def position_suite(empties, nb_positions, log_path=None, seed=0):
+    ''' Method: position_suite
+        Parameters: empties (int), nb_positions (int), log_path (str, binary game log,
+                    random games by default), seed (int)
+        Returns: list of (own, opp) bitboards, positions with `empties` empty squares
+                 and a legal move for the side to move, at most one per game
+    '''
+    if log_path is not None:
+        _, records = read_games(log_path)
+        moves, nb_moves = records['moves'], records['nb_moves']
+    else:
+        moves, nb_moves = random_games(4*nb_positions, seed)
+    replayed = replay(moves, nb_moves)
+    suite = []
+    for game in range(len(moves)):
+        for ply in range(replayed["players"].shape[1]):
+            side = int(replayed["players"][game, ply])
+            if side == 0:
+                break
+            black, white = int(replayed["black"][game, ply]), int(replayed["white"][game, ply])
+            own, opp = (black, white) if side == -1 else (white, black)
+            if 64-popcount(own | opp) == empties and legal_moves_mask(own, opp):
+                suite.append((own, opp))
+                break
+        if len(suite) == nb_positions:
+            break
+    return suite
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve time of the endgame solver against the number of empty squares")
+    parser.add_argument("--empties", default="8,10,12,14", help="Empty square counts of the suites")
+    parser.add_argument("--positions", type=int, default=10, help="Positions per empty count")
+    parser.add_argument("--log", help="Binary game log to draw the positions from (random games by default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-cap", type=float, default=60000, help="Time cap of one solve in ms")
+    args = parser.parse_args()
+
+    print(f"{'empties':>7s} {'solved':>7s} {'mean s':>8s} {'median s':>8s} {'max s':>8s} {'nodes':>9s} {'nodes/s':>8s}")
+    for empties in [int(value) for value in args.empties.split(",")]:
+        suite = position_suite(empties, args.positions, args.log, args.seed+empties)
+        seconds, nodes, timeouts = [], [], 0
+        for own, opp in suite:
+            try:
+                report = EndgameSolver(args.time_cap).solve(own, opp)
+            except Timeout:
+                timeouts += 1
+                continue
+            seconds.append(report["seconds"])
+            nodes.append(report["nodes"])
+        if not seconds:
+            print(f"{empties:7d} {0:3d}/{len(suite):<3d} every solve ran out of time")
+            continue
+        print(f"{empties:7d} {len(seconds):3d}/{len(suite):<3d} {np.mean(seconds):8.3f} {np.median(seconds):8.3f} "
+              f"{np.max(seconds):8.3f} {np.mean(nodes):9.0f} {np.sum(nodes)/np.sum(seconds):8.0f}")
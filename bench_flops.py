@@ -0,0 +1,110 @@
+import argparse
+import os
+
+import torch
+from torch import nn
+
+from difficulties import MODEL_FILES
+from model_registry import MODEL_DIR
+from networks_e2205046 import BOARD_CNN_DEFAULTS, CNN, BoardCNN, layer_dims
+
+
+def model_conf(len_inpout_seq, **layers):
+    ''' Method: model_conf
+        Parameters: len_inpout_seq (int), layers (BoardCNN_conf, CNN_conf... entries)
+        Returns: dict, a model conf with ReLU activations
+    '''
+    conf = {"board_size": 8, "path_save": "bench_flops", "earlyStopping": 5, "len_inpout_seq": len_inpout_seq,
+            "dropout": 0.1}
+    conf.update({f"activation_function{i}": "ReLU" for i in range(1, 6)})
+    conf.update(layers)
+    return conf
+
+
+def layer_conf(*dims):
+    return {f"hidden_dim_{i}": dims[i-1] if i <= len(dims) else "" for i in range(1, 6)}
+
+
+def count_flops(run, modules):
+    """
+    Counts the floating point operations of the Conv2d, Linear and LSTM layers
+    of one forward pass (a multiply-add is 2 FLOPs; activations, softmax and
+    the input encoding are left out).
+
+    Parameters:
+    - run (callable): Runs the forward pass of one board sequence.
+    - modules (nn.Module): Model whose layers are counted.
+
+    Returns:
+    - int: FLOPs of the forward pass.
+    """
+    flops = [0]
+
+    def conv(module, inputs, output):
+        per_output = module.in_channels//module.groups*module.kernel_size[0]*module.kernel_size[1]
+        flops[0] += 2*output.numel()*per_output
+
+    def linear(module, inputs, output):
+        flops[0] += 2*output.numel()*module.in_features
+
+    def lstm(module, inputs, output):
+        steps = output[0].numel()//module.hidden_size
+        for layer in range(module.num_layers):
+            input_size = module.input_size if layer == 0 else module.hidden_size
+            flops[0] += 2*steps*4*module.hidden_size*(input_size+module.hidden_size)
+
+    hooks = {nn.Conv2d: conv, nn.Linear: linear, nn.LSTM: lstm}
+    handles = [module.register_forward_hook(hooks[type(module)])
+               for module in modules.modules() if type(module) in hooks]
+    try:
+        with torch.no_grad():
+            run()
+    finally:
+        for handle in handles:
+            handle.remove()
+    return flops[0]
+
+
+def cnn_layers(model):
+    ''' Method: cnn_layers
+        Parameters: model (CNN)
+        Returns: callable running the layers of CNN on its smallest input
+        Does: CNN.forward flattens the boards before its Conv2d and fails, so its
+              layers are run on the input their sizes imply: 64 planes of 4x4
+              (one output per channel after the 3x3 convolution and the pooling).
+    '''
+    def run():
+        x = model.maxpool1(model.lin1(torch.zeros(1, model.lin1.in_channels, 4, 4)))
+        return model.head(x.flatten(start_dim=1))
+    return run
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FLOPs per move of the model architectures")
+    parser.add_argument("--len", type=int, default=5, help="Boards of history of the convolutional models")
+    parser.add_argument("--cnn", default="64,64", help="CNN_conf channels and hidden sizes")
+    args = parser.parse_args()
+
+    board = torch.zeros(args.len, 8, 8)
+    # (name, model, forward pass, sequences in the pass)
+    rows = []
+    channels = layer_dims(BOARD_CNN_DEFAULTS)
+    board_cnn = BoardCNN(model_conf(args.len))
+    rows.append((f"BoardCNN {len(channels)}x{channels[0]} (default)", board_cnn, lambda: board_cnn(board), 1))
+    wide = BoardCNN(model_conf(args.len, BoardCNN_conf=layer_conf(32, 32, 32)))
+    rows.append(("BoardCNN 3x32", wide, lambda: wide(board), 1))
+    cnn = CNN(model_conf(1, CNN_conf=layer_conf(*[int(dim) for dim in args.cnn.split(",")])))
+    rows.append((f"CNN {args.cnn}", cnn, cnn_layers(cnn), 1))
+    for player, file in MODEL_FILES.items():
+        path = os.path.join(MODEL_DIR, file)
+        if not os.path.exists(path):
+            continue
+        model = torch.load(path, map_location="cpu", weights_only=False).eval()
+        # A batch of two takes the batched branch of the models, counted per sequence
+        history = torch.zeros(2, model.len_inpout_seq, 8, 8)
+        rows.append((f"{player} ({type(model).__name__})", model, lambda model=model, history=history: model(history), 2))
+
+    print(f"{'model':28s} {'params':>9s} {'MFLOPs/move':>12s}")
+    for name, model, run, nb_sequences in rows:
+        flops = count_flops(run, model)/nb_sequences
+        print(f"{name:28s} {sum(p.numel() for p in model.parameters()):9d} {flops/1e6:12.3f}")
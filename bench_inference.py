@@ -0,0 +1,57 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+import torch
+
+from inference import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_LATENCY_MS, InferenceBatcher
+from model_registry import get_checkpoint_model
+from utile import initialze_board
+
+
+def random_inputs(len_inpout_seq, nb_inputs, seed=0):
+    # Random positions are enough to time the forward passes
+    rng = np.random.default_rng(seed)
+    boards = rng.integers(-1, 2, size=(nb_inputs, len_inpout_seq, 8, 8))
+    boards[:, 0] = initialze_board()
+    return [torch.tensor(board).float() for board in boards]
+
+
+def run_clients(predict, inputs, nb_clients):
+    ''' Method: run_clients
+        Parameters: predict (callable), inputs (list), nb_clients (int)
+        Returns: float, the number of moves per second
+        Does: Sends the inputs from nb_clients concurrent threads.
+    '''
+    chunks = [inputs[i::nb_clients] for i in range(nb_clients)]
+    threads = [threading.Thread(target=lambda chunk=chunk: [predict(x) for x in chunk]) for chunk in chunks]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(inputs)/(time.perf_counter()-start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Moves/sec of one forward pass per request vs micro-batching")
+    parser.add_argument("--player", default="Hard")
+    parser.add_argument("--moves", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-latency-ms", type=float, default=DEFAULT_MAX_LATENCY_MS)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    model = get_checkpoint_model(args.player)
+    inputs = random_inputs(model.len_inpout_seq, args.moves)
+
+    def predict_one(model_input):
+        with torch.no_grad():
+            return model(model_input.unsqueeze(0))
+
+    batcher = InferenceBatcher(max_batch_size=args.max_batch, max_latency_ms=args.max_latency_ms)
+    print(f"batch of one: {run_clients(predict_one, inputs, args.clients):.0f} moves/sec")
+    print(f"micro-batched: {run_clients(lambda x: batcher.predict(args.player, x), inputs, args.clients):.0f} moves/sec")
+    print(batcher.metrics())
@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from bitboard import legal_moves_mask
+from board_history import BoardHistory
+from game_log import random_games, read_games, replay
+from inference import legal_mask_tensor, masked_argmax
+from lstm_state import LSTMStateCache
+from model_registry import get_checkpoint_model, input_dtype
+
+
+def game_windows(black, white, players, len_inpout_seq):
+    ''' Method: game_windows
+        Parameters: black, white (numpy.ndarray, bitboards before every ply of one game),
+                    players (numpy.ndarray, side to move, 0 after the last move), len_inpout_seq (int)
+        Returns: list of (side, model input, nb_boards, own, opp) for every ply of the game
+        Does: Builds the inputs make_one_move would send, from a BoardHistory.
+    '''
+    history=BoardHistory(max(len_inpout_seq, 16))
+    windows=[]
+    for ply in range(len(players)):
+        if players[ply] == 0:
+            break
+        history.append_bitboards(int(black[ply]), int(white[ply]))
+        side=int(players[ply])
+        model_input=torch.from_numpy(history.window(len_inpout_seq).copy())
+        if side == -1:
+            model_input=-model_input
+        own, opp=(black[ply], white[ply]) if side == -1 else (white[ply], black[ply])
+        windows.append((side, model_input, history.nb_boards, int(own), int(opp)))
+    return windows
+
+
+def run(model, games, refresh_every):
+    ''' Method: run
+        Parameters: model (torch.nn.Module), games (list of game_windows), refresh_every (int,
+                    0: every move runs the whole window through the model's forward pass)
+        Returns: tuple (moves chosen, ms per move, LSTMStateCache metrics)
+    '''
+    states=LSTMStateCache(refresh_every)
+    choices, elapsed=[], 0.0
+    for game_id, windows in enumerate(games):
+        for side, model_input, nb_boards, own, opp in windows:
+            start=time.perf_counter()
+            move_prob=states.predict((game_id, side), model, model_input, nb_boards)
+            if move_prob is None:
+                with torch.no_grad():
+                    move_prob=model(model_input[None].to(input_dtype(model))).reshape(-1).float()
+            elapsed+=time.perf_counter()-start
+            choices.append(int(masked_argmax(move_prob, legal_mask_tensor(legal_moves_mask(own, opp)))))
+    return np.array(choices), 1000*elapsed/len(choices), states.metrics()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move agreement and latency of the stateful LSTM inference")
+    parser.add_argument("--player", default="Hard")
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--log", help="Binary game log to replay (random games by default)")
+    parser.add_argument("--refresh", default="4,8,16,32", help="refresh_every values to compare with the full window")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = get_checkpoint_model(args.player, precision='fp32')
+    if args.log:
+        _, records = read_games(args.log)
+        moves, nb_moves = records['moves'][:args.games], records['nb_moves'][:args.games]
+    else:
+        moves, nb_moves = random_games(args.games, seed=0)
+    replayed = replay(moves, nb_moves)
+    games = [game_windows(replayed["black"][i], replayed["white"][i], replayed["players"][i], model.len_inpout_seq)
+             for i in range(len(moves))]
+
+    expected, reference_ms, _ = run(model, games, 0)
+    print(f"{'mode':18s} {'agreement':>9s} {'steps/move':>10s} {'ms/move':>8s}")
+    print(f"{'full window':18s} {100.0:8.2f}% {model.len_inpout_seq:10.2f} {reference_ms:8.3f}")
+    for refresh_every in [int(value) for value in args.refresh.split(",")]:
+        choices, ms, metrics = run(model, games, refresh_every)
+        print(f"{f'refresh_every={refresh_every}':18s} {100*(choices == expected).mean():8.2f}% "
+              f"{metrics['steps_per_move']:10.2f} {ms:8.3f}")
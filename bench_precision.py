@@ -0,0 +1,82 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from game_log import random_games, read_games, sample_positions
+from inference import legal_mask_tensor, masked_argmax
+from model_registry import PRECISIONS, get_checkpoint_model, input_dtype
+
+
+def held_out_positions(len_inpout_seq, nb_positions, log_path=None, seed=0):
+    ''' Method: held_out_positions
+        Parameters: len_inpout_seq (int), nb_positions (int), log_path (str, binary
+                    game log, random games by default), seed (int)
+        Returns: dict of sample_positions
+        Does: Draws the positions the precisions are compared on.
+    '''
+    if log_path is not None:
+        _, records = read_games(log_path)
+        moves, nb_moves = records['moves'], records['nb_moves']
+    else:
+        moves, nb_moves = random_games(max(nb_positions//30, 1), seed)
+    return sample_positions(moves, nb_moves, nb_positions, len_inpout_seq, seed)
+
+
+def move_choices(model, inputs, legal, batch_size=256):
+    ''' Method: move_choices
+        Parameters: model (torch.nn.Module), inputs (numpy.ndarray int8 sequences),
+                    legal (numpy.ndarray of numpy.uint64 legal moves), batch_size (int)
+        Returns: numpy.ndarray, the square the model picks for every position
+    '''
+    choices = []
+    for start in range(0, len(inputs), batch_size):
+        model_input = torch.from_numpy(inputs[start:start+batch_size]).to(input_dtype(model))
+        with torch.no_grad():
+            move_prob = model(model_input).reshape(len(model_input), -1).float()
+        choices.append(masked_argmax(move_prob, legal_mask_tensor(legal[start:start+batch_size])).numpy())
+    return np.concatenate(choices)
+
+
+def forward_latency(model, inputs, batch_size, repeat=200):
+    ''' Method: forward_latency
+        Parameters: model (torch.nn.Module), inputs (numpy.ndarray int8 sequences),
+                    batch_size (int), repeat (int)
+        Returns: float, median time of one forward pass in milliseconds
+    '''
+    batches = [torch.from_numpy(inputs[start:start+batch_size]).to(input_dtype(model))
+               for start in range(0, len(inputs)-batch_size+1, batch_size)]
+    timings = []
+    with torch.no_grad():
+        for i in range(repeat+10):
+            batch = batches[i % len(batches)]
+            start = time.perf_counter()
+            model(batch)
+            if i >= 10:
+                timings.append(time.perf_counter()-start)
+    return 1000*float(np.median(timings))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move agreement with fp32 and latency of the serving precisions")
+    parser.add_argument("players", nargs="*", default=["Hard"], help="Difficulties or checkpoint paths")
+    parser.add_argument("--precisions", default=",".join(PRECISIONS))
+    parser.add_argument("--positions", type=int, default=2000)
+    parser.add_argument("--log", help="Binary game log to draw the positions from (random games by default)")
+    parser.add_argument("--batch-sizes", default="1,32")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    print(f"{'player':20s} {'precision':9s} {'agreement':>9s} "+" ".join(f"{f'ms@{size}':>9s}" for size in batch_sizes))
+    for player in args.players:
+        reference = get_checkpoint_model(player, precision='fp32')
+        positions = held_out_positions(reference.len_inpout_seq, args.positions, args.log)
+        expected = move_choices(reference, positions["inputs"], positions["legal"])
+        for precision in args.precisions.split(","):
+            model = get_checkpoint_model(player, precision=precision)
+            agreement = (move_choices(model, positions["inputs"], positions["legal"]) == expected).mean()
+            latencies = [forward_latency(model, positions["inputs"], size) for size in batch_sizes]
+            print(f"{player:20s} {precision:9s} {100*agreement:8.2f}% "+" ".join(f"{latency:9.3f}" for latency in latencies))
@@ -0,0 +1,87 @@
+import argparse
+
+import numpy as np
+import torch
+
+from bitboard import FULL_MASK, INITIAL_BLACK, INITIAL_WHITE, legal_moves_mask, flip_mask, popcount
+from board_history import BoardHistory
+from inference import legal_mask_tensor, masked_argmax
+from model_registry import get_checkpoint_model, input_dtype
+from search import Search
+
+
+def network_move(model, history, side, legal):
+    ''' Method: network_move
+        Parameters: model (torch.nn.Module), history (BoardHistory), side (int), legal (int)
+        Returns: int, the square of the policy's argmax over the legal moves
+    '''
+    model_input=torch.from_numpy(history.window(model.len_inpout_seq).copy())
+    if side == -1:
+        model_input=-model_input
+    with torch.no_grad():
+        move_prob=model(model_input[None].to(input_dtype(model))).reshape(-1).float()
+    return int(masked_argmax(move_prob, legal_mask_tensor(legal)))
+
+
+def play_game(model, search, search_side, rng, random_plies=4):
+    ''' Method: play_game
+        Parameters: model (torch.nn.Module, the network alone), search (Search, same network),
+                    search_side (int, side of the search), rng (numpy.random.Generator),
+                    random_plies (int, random opening moves)
+        Returns: tuple (disc difference for the search side, list of Search.run reports)
+    '''
+    bitboards={-1: INITIAL_BLACK, 1: INITIAL_WHITE}
+    history=BoardHistory()
+    history.append_bitboards(INITIAL_BLACK, INITIAL_WHITE)
+    side, passes, plies, reports=-1, 0, 0, []
+    while passes < 2 and (bitboards[-1] | bitboards[1]) != FULL_MASK:
+        own, opp=bitboards[side], bitboards[-side]
+        legal=legal_moves_mask(own, opp)
+        if legal:
+            passes=0
+            if plies < random_plies:
+                squares=[square for square in range(64) if legal >> square & 1]
+                square=int(rng.choice(squares))
+            elif side == search_side:
+                report=search.run(bitboards[-1], bitboards[1], side, history.window(history.capacity))
+                reports.append(report)
+                square=report["move"]
+            else:
+                square=network_move(model, history, side, legal)
+            flips=flip_mask(own, opp, square)
+            bitboards[side]=own | (1 << square) | flips
+            bitboards[-side]=opp & ~flips & FULL_MASK
+            plies+=1
+        else:
+            passes+=1
+        side=-side
+        history.append_bitboards(bitboards[-1], bitboards[1])
+    return (popcount(bitboards[search_side])-popcount(bitboards[-search_side])), reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Strength and nodes/sec of the search against its own network")
+    parser.add_argument("--player", default="Hard", help="Network guiding the search and playing against it")
+    parser.add_argument("--budgets", default="50,200,1000", help="Time budgets per move in ms")
+    parser.add_argument("--games", type=int, default=10, help="Games per budget, half of them with each color")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = get_checkpoint_model(args.player)
+    print(f"{'budget':>8s} {'wins':>5s} {'draws':>5s} {'losses':>6s} {'disc diff':>9s} {'nodes/s':>8s} {'sims/move':>9s} {'depth':>5s}")
+    for budget in [float(value) for value in args.budgets.split(",")]:
+        search = Search(model, budget, args.batch_size)
+        rng = np.random.default_rng(0)
+        diffs, reports = [], []
+        for game in range(args.games):
+            diff, game_reports = play_game(model, search, -1 if game % 2 == 0 else 1, rng)
+            diffs.append(diff)
+            reports.extend(game_reports)
+        diffs = np.array(diffs)
+        nodes_per_sec = np.mean([report["nodes_per_sec"] for report in reports])
+        simulations = np.mean([report["simulations"] for report in reports])
+        depth = np.mean([report["depth"] for report in reports])
+        print(f"{budget:6.0f}ms {(diffs > 0).sum():5d} {(diffs == 0).sum():5d} {(diffs < 0).sum():6d} "
+              f"{diffs.mean():+9.1f} {nodes_per_sec:8.0f} {simulations:9.0f} {depth:5.1f}")
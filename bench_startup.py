@@ -0,0 +1,39 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Runs in a fresh interpreter: import the serving app and answer one request,
+# as a serverless cold start does
+COLD_START = """
+import sys, time
+start = time.perf_counter()
+import app
+response = app.app.test_client().get('/get_board')
+assert response.status_code == 200
+print(time.perf_counter() - start, 'torch' in sys.modules)
+"""
+
+
+def cold_start():
+    ''' Method: cold_start
+        Returns: tuple (seconds until /get_board answered in process, total process seconds, torch imported)
+        Does: Starts a new Python process that imports app and serves /get_board.
+    '''
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", COLD_START], check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+    return float(output[0]), time.perf_counter()-start, output[1] == "True"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cold start time of the serving app up to the first /get_board")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [cold_start() for _ in range(args.runs)]
+    print(f"import + first /get_board: median {statistics.median(r[0] for r in runs)*1000:.0f} ms")
+    print(f"whole process (interpreter start included): median {statistics.median(r[1] for r in runs)*1000:.0f} ms")
+    print(f"torch imported: {any(r[2] for r in runs)}")
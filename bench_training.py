@@ -0,0 +1,71 @@
+import argparse
+import copy
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from bench_precision import held_out_positions
+from networks_e2205046 import train_model
+
+
+def position_loader(len_inpout_seq, nb_positions, batch_size, log_path=None, seed=0):
+    ''' Method: position_loader
+        Parameters: len_inpout_seq (int), nb_positions (int), batch_size (int),
+                    log_path (str, binary game log, random games by default), seed (int)
+        Returns: DataLoader of (batch, one-hot labels, lengths) triples, like the training loaders
+    '''
+    positions = held_out_positions(len_inpout_seq, nb_positions, log_path, seed)
+    labels = torch.nn.functional.one_hot(torch.from_numpy(positions["moves"].astype(np.int64)), 64)
+    dataset = TensorDataset(torch.from_numpy(positions["inputs"]), labels,
+                            torch.full((len(labels),), len_inpout_seq))
+    return DataLoader(dataset, batch_size=batch_size, shuffle=True)
+
+
+def epoch_time(model, train, dev, device, nb_epochs=1, **training):
+    ''' Method: epoch_time
+        Parameters: model (nn.Module, left untouched), train and dev (DataLoader),
+                    device (torch.device), nb_epochs (int), training (conf["training"] options)
+        Returns: float, mean time of one epoch of train_model in seconds
+        Does: Trains a copy of the model, checkpoints and logs in a temporary directory.
+    '''
+    model = copy.deepcopy(model).to(device)
+    model.train()
+    model.training_conf = training
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model.path_save = os.path.join(tmp_dir, "run")
+        start = time.perf_counter()
+        train_model(model, train, dev, nb_epochs, device, optimizer)
+        return (time.perf_counter()-start)/nb_epochs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time of one training epoch with and without anomaly detection")
+    parser.add_argument("checkpoint", nargs="?", default="Hard.pt", help="Checkpoint whose architecture is trained")
+    parser.add_argument("--positions", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--log", help="Binary game log to draw the positions from (random games by default)")
+    parser.add_argument("--grad-clip", type=float, help="Also time gradient clipping at this max norm")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = torch.load(args.checkpoint, map_location=device, weights_only=False)
+    train = position_loader(model.len_inpout_seq, args.positions, args.batch_size, args.log, seed=0)
+    dev = position_loader(model.len_inpout_seq, args.batch_size, args.batch_size, args.log, seed=1)
+
+    runs = [("detect_anomaly=True (previous default)", {"detect_anomaly": True}),
+            ("detect_anomaly=False", {"detect_anomaly": False})]
+    if args.grad_clip is not None:
+        runs.append((f"detect_anomaly=False, grad_clip={args.grad_clip}", {"grad_clip": args.grad_clip}))
+    reference = None
+    for name, training in runs:
+        seconds = epoch_time(model, train, dev, device, args.epochs, **training)
+        reference = reference or seconds
+        print(f"{name:45s} {seconds:7.2f} s/epoch ({reference/seconds:.2f}x)")
@@ -0,0 +1,213 @@
+import numpy as np
+
+BOARD_SIZE=8
+
+# Square (row, col) is stored in bit row*8+col of a 64-bit integer mask.
+FULL_MASK=0xFFFFFFFFFFFFFFFF
+NOT_A_FILE=0xFEFEFEFEFEFEFEFE  # every square except column 0
+NOT_H_FILE=0x7F7F7F7F7F7F7F7F  # every square except column 7
+
+INITIAL_BLACK=0x0000000810000000  # (3, 4) and (4, 3)
+INITIAL_WHITE=0x0000001008000000  # (3, 3) and (4, 4)
+
+# (shift, mask applied after the shift) for the 8 directions.
+# A positive shift moves towards higher bit indices (down/right).
+SHIFT_DIRS = [(-9, NOT_H_FILE), (-8, FULL_MASK), (-7, NOT_A_FILE),
+              (-1, NOT_H_FILE),                  (+1, NOT_A_FILE),
+              (+7, NOT_H_FILE), (+8, FULL_MASK), (+9, NOT_A_FILE)]
+
+# (shift, mask of the inner squares a line of flipped tiles can cross) used by
+# the unrolled fills of legal_moves_mask.
+INNER_COLUMNS=0x7E7E7E7E7E7E7E7E
+FILL_DIRS = [(-9, INNER_COLUMNS), (-8, FULL_MASK), (-7, INNER_COLUMNS),
+             (-1, INNER_COLUMNS),                  (+1, INNER_COLUMNS),
+             (+7, INNER_COLUMNS), (+8, FULL_MASK), (+9, INNER_COLUMNS)]
+
+
+def shift(mask, direction):
+    ''' Method: shift
+        Parameters: mask (int), direction (tuple from SHIFT_DIRS)
+        Returns: int
+        Does: Moves every square of the mask one step in the given
+              direction, dropping the squares that fall off the board.
+    '''
+    amount, wrap_mask = direction
+    if amount > 0:
+        return (mask << amount) & wrap_mask & FULL_MASK
+    return (mask >> -amount) & wrap_mask
+
+
+def board_to_bitboards(board_stat, NgBlackPsWhith):
+    """
+    Converts an 8x8 board into a pair of bitboards.
+
+    Parameters:
+    - board_stat (numpy.ndarray or list): 8x8 board (-1 black, 1 white, 0 empty).
+    - NgBlackPsWhith (int): Indicator for the current player (Black: -1, White: 1).
+
+    Returns:
+    - tuple: (own, opp) masks of the current player and of the adversary.
+    """
+    flat = np.asarray(board_stat).reshape(-1)
+    own = np.packbits(flat == NgBlackPsWhith, bitorder='little').view('<u8')[0]
+    opp = np.packbits(flat == -NgBlackPsWhith, bitorder='little').view('<u8')[0]
+    return int(own), int(opp)
+
+
+def legal_moves_mask(own, opp):
+    """
+    Computes every legal move of the player owning `own` with shift-and-mask fills.
+
+    Works on Python ints and, unchanged, on numpy.uint64 arrays of N positions.
+
+    Parameters:
+    - own (int or numpy.ndarray): Bitboard of the current player.
+    - opp (int or numpy.ndarray): Bitboard of the adversary.
+
+    Returns:
+    - int or numpy.ndarray: Bitboard of the empty squares where the current player can play.
+    """
+    empty = ~(own | opp) & FULL_MASK
+    moves = 0
+    for amount, inner_mask in FILL_DIRS:
+        # Masking the adversary's tiles once stops the fill from wrapping around
+        # the board edge, a line of adversary's tiles is at most 6 squares long.
+        o = opp & inner_mask
+        if amount > 0:
+            x = (own << amount) & o
+            x |= (x << amount) & o
+            x |= (x << amount) & o
+            x |= (x << amount) & o
+            x |= (x << amount) & o
+            x |= (x << amount) & o
+            moves |= (x << amount) & empty
+        else:
+            amount = -amount
+            x = (own >> amount) & o
+            x |= (x >> amount) & o
+            x |= (x >> amount) & o
+            x |= (x >> amount) & o
+            x |= (x >> amount) & o
+            x |= (x >> amount) & o
+            moves |= (x >> amount) & empty
+    return moves
+
+
+def flip_mask(own, opp, square):
+    """
+    Computes the adversary's tiles flipped by playing on `square`.
+
+    Parameters:
+    - own (int): Bitboard of the current player.
+    - opp (int): Bitboard of the adversary.
+    - square (int): Bit index (row*8+col) of the move.
+
+    Returns:
+    - int: Bitboard of the tiles to flip (0 if the move flips nothing).
+    """
+    move = 1 << square
+    flips = 0
+    for direction in SHIFT_DIRS:
+        line = 0
+        x = shift(move, direction)
+        while x & opp:
+            line |= x
+            x = shift(x, direction)
+        if x & own:
+            flips |= line
+    return flips
+
+
+def flip_mask_batch(own, opp, move):
+    """
+    Computes the flipped tiles of N positions at once with shift-and-mask fills.
+
+    Parameters:
+    - own (numpy.ndarray): numpy.uint64 bitboards of the players to move.
+    - opp (numpy.ndarray): numpy.uint64 bitboards of the adversaries.
+    - move (numpy.ndarray): numpy.uint64 bitboards holding the square played in each position.
+
+    Returns:
+    - numpy.ndarray: numpy.uint64 bitboards of the tiles to flip.
+    """
+    flips = np.zeros_like(own)
+    for amount, inner_mask in FILL_DIRS:
+        o = opp & inner_mask
+        if amount > 0:
+            x = (move << amount) & o
+            for _ in range(5):
+                x |= (x << amount) & o
+            bounded = (x << amount) & own
+        else:
+            amount = -amount
+            x = (move >> amount) & o
+            for _ in range(5):
+                x |= (x >> amount) & o
+            bounded = (x >> amount) & own
+        flips |= np.where(bounded != 0, x, 0).astype(np.uint64)
+    return flips
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def mask_to_moves(mask):
+    ''' Method: mask_to_moves
+        Parameters: mask (int)
+        Returns: a list of (row, col) tuples, in row-major order
+        Does: Lists the squares set in a bitboard.
+    '''
+    moves = []
+    while mask:
+        lowest = mask & -mask
+        square = lowest.bit_length() - 1
+        moves.append((square >> 3, square & 7))
+        mask ^= lowest
+    return moves
+
+
+def mask_to_array(mask):
+    ''' Method: mask_to_array
+        Parameters: mask (int)
+        Returns: numpy.ndarray of booleans with shape (8, 8)
+        Does: Expands a bitboard into a boolean board.
+    '''
+    packed = np.array([mask], dtype='<u8').view(np.uint8)
+    return np.unpackbits(packed, bitorder='little').astype(bool).reshape(BOARD_SIZE, BOARD_SIZE)
+
+
+def masks_to_array(masks):
+    ''' Method: masks_to_array
+        Parameters: masks (numpy.ndarray of N numpy.uint64 bitboards)
+        Returns: numpy.ndarray of booleans with shape (N, 8, 8)
+        Does: Expands N bitboards into boolean boards.
+    '''
+    packed = np.ascontiguousarray(masks, dtype='<u8').view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(packed, axis=1, bitorder='little').astype(bool).reshape(-1, BOARD_SIZE, BOARD_SIZE)
+
+
+def _square_maps():
+    rows, cols = np.divmod(np.arange(BOARD_SIZE*BOARD_SIZE), BOARD_SIZE)
+    last = BOARD_SIZE-1
+    # Square each square (row, col) is sent to by the 8 symmetries of the board
+    images = [(rows, cols),              # identity
+              (cols, last-rows),         # rotation by 90 degrees
+              (last-rows, last-cols),    # rotation by 180 degrees
+              (last-cols, rows),         # rotation by 270 degrees
+              (rows, last-cols),         # left-right reflection
+              (last-rows, cols),         # up-down reflection
+              (cols, rows),              # transpose
+              (last-cols, last-rows)]    # anti-transpose
+    return np.stack([r*BOARD_SIZE+c for r, c in images])
+
+
+NB_SYMMETRIES = 8
+# SQUARE_MAPS[k, i]: square that symmetry k sends square i to
+SQUARE_MAPS = _square_maps()
+# GATHER_INDEX[k, j]: square that symmetry k brings to square j, so that
+# x[..., GATHER_INDEX[k]] is x transformed by symmetry k
+GATHER_INDEX = np.argsort(SQUARE_MAPS, axis=1)
+# INVERSE[k]: symmetry undoing symmetry k
+INVERSE = np.array([int(np.flatnonzero((GATHER_INDEX[:, GATHER_INDEX[k]] == np.arange(64)).all(axis=1))[0])
+                    for k in range(NB_SYMMETRIES)])
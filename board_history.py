@@ -0,0 +1,116 @@
+import os
+import struct
+
+import numpy as np
+
+from bitboard import mask_to_array
+from utile import INITIAL_BOARD
+from zobrist import board_hashes
+
+BOARD_SIZE=8
+# Number of board states kept per game, it must cover the longest
+# len_inpout_seq of the served models
+HISTORY_LEN=int(os.environ.get("REVERSI_HISTORY_LEN", 16))
+INITIAL_HASHES=board_hashes(INITIAL_BOARD)
+
+
+class BoardHistory:
+    """
+    Ring buffer of the last board states of a game, oldest first.
+
+    The buffer is preallocated with 2*capacity int8 boards filled with the
+    initial board, which is also the padding input_seq_generator uses before
+    the first state of a game. Every state is written twice, at slot i and
+    i+capacity, so the last `length` states are always a contiguous slice:
+    window() returns a view that torch.from_numpy turns into a tensor
+    without any copy. The Zobrist hashes of every state under the 8
+    symmetries (see zobrist) are kept the same way, for the position cache.
+    """
+
+    def __init__(self, capacity=HISTORY_LEN):
+        self.capacity=capacity
+        self.buffer=np.empty((2*capacity, BOARD_SIZE, BOARD_SIZE), dtype=np.int8)
+        self.buffer[:]=INITIAL_BOARD
+        self.hashes=np.empty((2*capacity, len(INITIAL_HASHES)), dtype=np.uint64)
+        self.hashes[:]=INITIAL_HASHES
+        self.next_slot=0
+        self.nb_boards=0
+
+    def append(self, board_stat, hashes=None):
+        ''' Method: append
+            Parameters: board_stat (8x8 list or numpy.ndarray), hashes (numpy.ndarray,
+                        zobrist hashes of the state, computed when not given)
+            Returns: None
+            Does: Adds a board state at the end of the history.
+        '''
+        if hashes is None:
+            hashes=board_hashes(board_stat)
+        self.buffer[self.next_slot]=board_stat
+        self.buffer[self.next_slot+self.capacity]=board_stat
+        self.hashes[self.next_slot]=hashes
+        self.hashes[self.next_slot+self.capacity]=hashes
+        self.next_slot=(self.next_slot+1) % self.capacity
+        self.nb_boards+=1
+
+    def append_bitboards(self, black, white, hashes=None):
+        ''' Method: append_bitboards
+            Parameters: black (int), white (int), hashes (numpy.ndarray)
+            Returns: None
+            Does: Adds the board state given by two bitboards.
+        '''
+        self.append(mask_to_array(white).astype(np.int8)-mask_to_array(black).astype(np.int8), hashes)
+
+    def last_hashes(self):
+        return self.hashes[self.next_slot+self.capacity-1]
+
+    def window(self, length):
+        """
+        Returns the input sequence of a model: the last `length` board states,
+        padded with the initial board at the start of the game.
+
+        Parameters:
+        - length (int): Length of the sequence (the model's len_inpout_seq).
+
+        Returns:
+        - numpy.ndarray: int8 view of shape (length, 8, 8), to be treated as read-only.
+        """
+        if length > self.capacity:
+            raise ValueError(f"Sequences of {length} boards need a history of at least {length} (REVERSI_HISTORY_LEN)")
+        end=self.next_slot+self.capacity
+        return self.buffer[end-length:end]
+
+    def hash_window(self, length):
+        ''' Method: hash_window
+            Parameters: length (int)
+            Returns: numpy.ndarray view of shape (length, 8)
+            Does: Returns the hashes of the states of window(length).
+        '''
+        if length > self.capacity:
+            raise ValueError(f"Sequences of {length} boards need a history of at least {length} (REVERSI_HISTORY_LEN)")
+        end=self.next_slot+self.capacity
+        return self.hashes[end-length:end]
+
+    def to_bytes(self):
+        ''' Method: to_bytes
+            Returns: bytes
+            Does: Serializes the stored states as two bit planes per board
+                  (black, white). Padding boards are not stored.
+        '''
+        nb_stored=min(self.nb_boards, self.capacity)
+        boards=self.window(self.capacity)[self.capacity-nb_stored:].reshape(nb_stored, -1)
+        black=np.packbits(boards == -1, axis=1, bitorder='little')
+        white=np.packbits(boards == 1, axis=1, bitorder='little')
+        return struct.pack('<IH', self.nb_boards, nb_stored)+black.tobytes()+white.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, capacity=HISTORY_LEN):
+        history=cls(capacity)
+        nb_boards, nb_stored=struct.unpack_from('<IH', data)
+        planes=np.frombuffer(data, dtype=np.uint8, offset=struct.calcsize('<IH')).reshape(2, nb_stored, 8)
+        black=np.unpackbits(planes[0], axis=1, bitorder='little').astype(np.int8)
+        white=np.unpackbits(planes[1], axis=1, bitorder='little').astype(np.int8)
+        boards=(white-black).reshape(nb_stored, BOARD_SIZE, BOARD_SIZE)[-capacity:]
+        for board, hashes in zip(boards, board_hashes(boards)):
+            history.append(board, hashes)
+        history.nb_boards=nb_boards
+        return history
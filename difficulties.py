@@ -0,0 +1,15 @@
+import os
+
+# Checkpoint of every difficulty played by a network (see model_registry)
+MODEL_FILES = {
+    'Easy': 'Easy.pt',
+    'Medium': 'Medium.pt',
+    'Hard': 'Hard.pt',
+}
+
+# Search difficulties and the network guiding their search (see search)
+SEARCH_PLAYERS={'Expert': os.environ.get("REVERSI_EXPERT_MODEL", 'Hard')}
+
+# Difficulties a client may ask for. Kept free of torch so that the app can
+# check requests before the first AI move imports it
+SERVED_PLAYERS=tuple(MODEL_FILES)+tuple(SEARCH_PLAYERS)
@@ -0,0 +1,213 @@
+import os
+import time
+
+from bitboard import legal_moves_mask, popcount
+
+# Positions with at most this many empty squares are solved exactly (0 never)
+DEFAULT_ENDGAME_EMPTIES=int(os.environ.get("REVERSI_ENDGAME_EMPTIES", 12))
+# Time cap of one solve, the move comes from the network when it runs out
+DEFAULT_ENDGAME_TIME_MS=float(os.environ.get("REVERSI_ENDGAME_TIME_MS", 1000))
+
+# Below this many empties, moves are ordered by parity only: counting the
+# replies of every move costs more than it saves near the leaves
+FASTEST_FIRST_EMPTIES=7
+# Positions with at least this many empties go to the transposition table
+TABLE_EMPTIES=6
+# Nodes between two checks of the clock
+CLOCK_CHECK=1024
+
+
+def _rays():
+    # RAYS[square]: for every direction, the bits of the squares met going
+    # away from square, nearest first
+    rays=[]
+    for square in range(64):
+        row, col=divmod(square, 8)
+        square_rays=[]
+        for d_row, d_col in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]:
+            ray=[]
+            r, c=row+d_row, col+d_col
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray.append(1 << (r*8+c))
+                r, c=r+d_row, c+d_col
+            if len(ray) >= 2:
+                square_rays.append(ray)
+        rays.append(square_rays)
+    return rays
+
+
+RAYS=_rays()
+# Quadrant of every square, for the parity ordering
+QUADRANT=[(square // 32)*2+(square % 8) // 4 for square in range(64)]
+
+
+class Timeout(Exception):
+    pass
+
+
+def flips(own, opp, square):
+    ''' Method: flips
+        Parameters: own, opp (int bitboards), square (int)
+        Returns: int, bitboard of the discs flipped by playing square (0 for an illegal move)
+    '''
+    flipped=0
+    for ray in RAYS[square]:
+        line=0
+        for bit in ray:
+            if opp & bit:
+                line|=bit
+            else:
+                if own & bit:
+                    flipped|=line
+                break
+    return flipped
+
+
+def final_score(own, opp):
+    # Disc difference of an ended game, the empty squares going to the winner
+    diff=popcount(own)-popcount(opp)
+    empties=64-popcount(own | opp)
+    if diff > 0:
+        return diff+empties
+    if diff < 0:
+        return diff-empties
+    return 0
+
+
+class EndgameSolver:
+    """
+    Exact solver of the end of a game: negamax alpha-beta on bitboards.
+
+    Moves are tried in the regions (board quadrants) holding an odd number
+    of empty squares first (parity), and, far enough from the leaves, in
+    increasing order of the opponent's replies (fastest first). Positions
+    with TABLE_EMPTIES empty squares or more keep their bounds and best
+    move in a transposition table keyed by the bitboards. The solve raises
+    Timeout once its deadline has passed.
+    """
+
+    def __init__(self, time_cap_ms=DEFAULT_ENDGAME_TIME_MS):
+        self.time_cap=time_cap_ms/1000
+        self.table={}
+        self.nodes=0
+        self.deadline=None
+
+    def solve(self, own, opp):
+        """
+        Computes the best move of the side to move and the final score under perfect play.
+
+        Parameters:
+        - own (int): Bitboard of the side to move.
+        - opp (int): Bitboard of the adversary.
+
+        Returns:
+        - dict: "move" (square, None when the side to move has to pass),
+          "score" (final disc difference for the side to move), "nodes" and "seconds".
+
+        Raises:
+        - Timeout: When the solve takes longer than the time cap.
+        """
+        start=time.perf_counter()
+        self.table={}
+        self.nodes=0
+        self.deadline=start+self.time_cap
+        empties=[square for square in range(64) if not (own | opp) >> square & 1]
+        score, move=self._negamax(own, opp, empties, -65, 65, False)
+        return {"move": move, "score": score, "nodes": self.nodes, "seconds": time.perf_counter()-start}
+
+    def _ordered_moves(self, own, opp, empties):
+        parity=[0]*4
+        for square in empties:
+            parity[QUADRANT[square]]^=1
+        moves=[]
+        for square in empties:
+            flipped=flips(own, opp, square)
+            if flipped:
+                moves.append((square, flipped))
+        if len(empties) >= FASTEST_FIRST_EMPTIES:
+            def replies(move):
+                square, flipped=move
+                return (popcount(legal_moves_mask(opp & ~flipped, own | flipped | (1 << square))),
+                        -parity[QUADRANT[square]])
+            moves.sort(key=replies)
+        else:
+            moves.sort(key=lambda move: -parity[QUADRANT[move[0]]])
+        return moves
+
+    def _negamax(self, own, opp, empties, alpha, beta, passed):
+        self.nodes+=1
+        if self.nodes % CLOCK_CHECK == 0 and time.perf_counter() > self.deadline:
+            raise Timeout()
+        if not empties:
+            return final_score(own, opp), None
+
+        key=None
+        if len(empties) >= TABLE_EMPTIES:
+            key=(own, opp)
+            entry=self.table.get(key)
+            if entry is not None:
+                lower, upper, move=entry
+                if lower >= beta:
+                    return lower, move
+                if upper <= alpha:
+                    return upper, move
+                if lower == upper:
+                    return lower, move
+                alpha, beta=max(alpha, lower), min(beta, upper)
+
+        moves=self._ordered_moves(own, opp, empties)
+        if not moves:
+            if passed:
+                return final_score(own, opp), None
+            score, _=self._negamax(opp, own, empties, -beta, -alpha, True)
+            return -score, None
+
+        original_alpha=alpha
+        best_score, best_move=-65, None
+        for square, flipped in moves:
+            remaining=[empty for empty in empties if empty != square]
+            score, _=self._negamax(opp & ~flipped, own | flipped | (1 << square), remaining, -beta, -alpha, False)
+            score=-score
+            if score > best_score:
+                best_score, best_move=score, square
+                if score > alpha:
+                    alpha=score
+                    if alpha >= beta:
+                        break
+
+        if key is not None:
+            lower, upper=-65, 65
+            if best_score <= original_alpha:
+                upper=best_score
+            elif best_score >= beta:
+                lower=best_score
+            else:
+                lower=upper=best_score
+            self.table[key]=(lower, upper, best_move)
+        return best_score, best_move
+
+
+def solve_position(own, opp, max_empties=DEFAULT_ENDGAME_EMPTIES, time_cap_ms=DEFAULT_ENDGAME_TIME_MS):
+    ''' Method: solve_position
+        Parameters: own, opp (int bitboards of the side to move and of the adversary),
+                    max_empties (int), time_cap_ms (float)
+        Returns: dict of EndgameSolver.solve, or None when the position has more
+                 than max_empties empty squares or the solve ran out of time
+    '''
+    if 64-popcount(own | opp) > max_empties:
+        return None
+    try:
+        return EndgameSolver(time_cap_ms).solve(own, opp)
+    except Timeout:
+        return None
+
+
+def endgame_move(black, white, side, max_empties=DEFAULT_ENDGAME_EMPTIES, time_cap_ms=DEFAULT_ENDGAME_TIME_MS):
+    ''' Method: endgame_move
+        Parameters: black, white (int bitboards), side (int, -1 Black, 1 White),
+                    max_empties (int), time_cap_ms (float)
+        Returns: dict of EndgameSolver.solve or None (see solve_position)
+        Does: Solves the end of a game for the side to move.
+    '''
+    own, opp=(black, white) if side == -1 else (white, black)
+    return solve_position(own, opp, max_empties, time_cap_ms)
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import warnings
+
+import numpy as np
+import torch
+
+from model_registry import CONFIG_FILE, BatchedPolicy, convert_precision, input_dtype, scripted_path
+
+
+def export_model(checkpoint, output=None, check_batches=(1, 2, 7), precision='fp32',
+                 quantized_modules=(torch.nn.Linear,)):
+    """
+    Exports a pickled checkpoint (torch.save(self, ...)) to TorchScript.
+
+    The artifact carries the model's len_inpout_seq in an extra config.json
+    file, so serving loads it with torch.jit.load alone, without importing
+    networks_e2205046 and its training dependencies.
+
+    Parameters:
+    - checkpoint (str): Path of the .pt checkpoint.
+    - output (str): Path of the artifact (model_registry.scripted_path by default).
+    - check_batches (tuple): Batch sizes on which the artifact must match the checkpoint.
+    - precision (str): Precision of the artifact (see model_registry.convert_precision).
+    - quantized_modules (tuple): Layer types quantized in int8.
+
+    Returns:
+    - str: Path of the artifact.
+    """
+    if output is None:
+        output=scripted_path(checkpoint, precision)
+    model=torch.load(checkpoint, map_location=torch.device('cpu'), weights_only=False)
+    model.eval()
+    model_class=type(model).__name__
+    len_inpout_seq=model.len_inpout_seq
+    wrapper=BatchedPolicy(convert_precision(model, precision, quantized_modules)).eval()
+    dtype=input_dtype(wrapper)
+
+    example=torch.zeros(2, len_inpout_seq, 8, 8, dtype=dtype)
+    with torch.no_grad(), warnings.catch_warnings():
+        # The shape checks of the training forward passes are frozen in the trace on purpose
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced=torch.jit.trace(wrapper, example)
+    traced=torch.jit.freeze(traced)
+
+    rng=np.random.default_rng(0)
+    for batch_size in check_batches:
+        sample=torch.from_numpy(rng.integers(-1, 2, size=(batch_size, len_inpout_seq, 8, 8))).to(dtype)
+        with torch.no_grad():
+            expected=wrapper(sample).float()
+            actual=traced(sample).float()
+        if not torch.allclose(expected, actual, atol=1e-2 if precision == 'bf16' else 1e-5):
+            raise ValueError(f"Traced {checkpoint} differs from the checkpoint on a batch of {batch_size}")
+
+    config={"len_inpout_seq": len_inpout_seq,
+            "model": model_class,
+            "checkpoint": os.path.basename(checkpoint),
+            "precision": precision}
+    torch.jit.save(traced, output, _extra_files={CONFIG_FILE: json.dumps(config)})
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export pickled checkpoints to TorchScript serving artifacts")
+    parser.add_argument("checkpoints", nargs="+")
+    parser.add_argument("--out-dir", help="Directory of the artifacts (next to each checkpoint by default)")
+    args = parser.parse_args()
+
+    for checkpoint in args.checkpoints:
+        output=None
+        if args.out_dir:
+            output=os.path.join(args.out_dir, os.path.basename(scripted_path(checkpoint)))
+        output=export_model(checkpoint, output)
+        print(f"{checkpoint} -> {output} ({os.path.getsize(output)/1024:.0f} KB)")
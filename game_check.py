@@ -1,19 +1,23 @@
 
 import numpy as np
-import copy
-import time
 
 
 import torch
 
-from utile import get_legal_moves, is_legal_move, has_tile_to_flip, initialze_board
+from utile import initialze_board, INITIAL_BOARD
+from bitboard import board_to_bitboards, legal_moves_mask, flip_mask, mask_to_moves, mask_to_array
+from model_registry import get_checkpoint_model, input_dtype
+from board_history import BoardHistory
+from endgame import solve_position
+from game_log import GAME_LOG, GameLogWriter, parse_text_log
+from inference import legal_mask_tensor, masked_argmax
 
 BOARD_SIZE=8
 
 
 def input_seq_generator(board_stats_seq,length_seq):
     
-    board_stat_init=initialze_board()
+    board_stat_init=INITIAL_BOARD
 
     if len(board_stats_seq) >= length_seq:
         input_seq=board_stats_seq[-length_seq:]
@@ -28,31 +32,19 @@ def input_seq_generator(board_stats_seq,length_seq):
             
     return input_seq
 
-def find_best_move(move1_prob,legal_moves):
+def find_best_move(move1_prob,legal_mask):
     """
     Finds the best move based on the provided move probabilities and legal moves.
 
     Parameters:
-    - move1_prob (numpy.ndarray): 2D array representing the probabilities of moves.
-    - legal_moves (list): List of legal moves.
+    - move1_prob (torch.Tensor): Probabilities of moves, shape (64,) or (8, 8).
+    - legal_mask (int): Bitboard of the legal moves (see bitboard.legal_moves_mask).
 
     Returns:
     - tuple: The best move coordinates (row, column).
     """
-
-    # Initialize the best move with the first legal move
-    best_move=legal_moves[0]
-    
-    # Initialize the maximum score with the probability of the first legal move
-    max_score=move1_prob[legal_moves[0][0],legal_moves[0][1]]
-    
-    # Iterate through all legal moves to find the one with the maximum probability
-    for i in range(len(legal_moves)):
-        # Update the best move if the current move has a higher probability
-        if move1_prob[legal_moves[i][0],legal_moves[i][1]]>max_score:
-            max_score=move1_prob[legal_moves[i][0],legal_moves[i][1]]
-            best_move=legal_moves[i]
-    return best_move
+    square = int(masked_argmax(move1_prob, legal_mask_tensor(legal_mask, move1_prob.device)))
+    return (square // BOARD_SIZE, square % BOARD_SIZE)
 
 def apply_flip(best_move,board_stat,NgBlackPsWhith):
     """
@@ -66,26 +58,45 @@ def apply_flip(best_move,board_stat,NgBlackPsWhith):
     Returns:
     - numpy.ndarray: Updated Othello board after applying tile flipping.
     """
-    
-    MOVE_DIRS = [(-1, -1), (-1, 0), (-1, +1),
-             (0, -1),           (0, +1),
-             (+1, -1), (+1, 0), (+1, +1)]
-
-    for direction in MOVE_DIRS:
-        if has_tile_to_flip(best_move, direction,board_stat,NgBlackPsWhith):
-            i = 1
-            while True:
-                row = best_move[0] + direction[0] * i
-                col = best_move[1] + direction[1] * i
-                if board_stat[row][col] == board_stat[best_move[0], best_move[1]]:
-                    break
-                else:
-                    board_stat[row][col] = board_stat[best_move[0], best_move[1]]
-                    i += 1
+    own, opp = board_to_bitboards(board_stat, NgBlackPsWhith)
+    flips = flip_mask(own, opp, best_move[0]*BOARD_SIZE + best_move[1])
+    board_stat[mask_to_array(flips)] = NgBlackPsWhith
                     
     return board_stat
 
 
+def select_move(model, input_seq_boards, board_stat, turn, device):
+    ''' Method: select_move
+        Parameters: model (torch.nn.Module), input_seq_boards (list or numpy.ndarray, boards of
+                    the model input as seen by White), board_stat (numpy.ndarray), turn (int, -1 Black, 1 White),
+                    device (torch.device)
+        Returns: tuple (row, column) of the move, None when the side to move has to pass
+        Does: Plays the move of the exact endgame solver once few squares are empty
+              (see endgame.py), the move of the model otherwise or when the solve runs out of time.
+    '''
+    own, opp = board_to_bitboards(board_stat, turn)
+    legal_mask = legal_moves_mask(own, opp)
+    if not legal_mask:
+        return None
+    color = "Black" if turn == -1 else "White"
+    solved = solve_position(own, opp)
+    if solved is not None and solved["move"] is not None:
+        best_move = (solved["move"] // BOARD_SIZE, solved["move"] % BOARD_SIZE)
+        print(f"{color}: {best_move} < endgame solved, final score {solved['score']:+d} "
+              f"({solved['nodes']} nodes in {solved['seconds']:.2f}s)")
+        return best_move
+
+    model_input=torch.from_numpy(np.array([input_seq_boards], dtype=np.int8))
+    #if black is the current player the board should be multiplay by -1
+    if (turn == -1):
+        model_input=-model_input
+    with torch.no_grad():
+        move1_prob = model(model_input.to(device, input_dtype(model)))
+    best_move = find_best_move(move1_prob,legal_mask)
+    print(f"{color}: {best_move} < from possible move {mask_to_moves(legal_mask)}")
+    return best_move
+
+
 def launch_game(player1, player2):
     # Two rounds of game would be played
     # First player1 starts game, and then Player2 starts the other game
@@ -95,43 +106,30 @@ def launch_game(player1, player2):
         device = torch.device("cpu")
 
     conf={}
-    if (player1 == 'Easy'):
-        conf['player1']= 'model_e2205046.pt'
-    if (player2 == 'Easy'):
-        conf['player2']= 'model_e2205046.pt'
+    conf['player1']=player1
+    conf['player2']=player2
+    model1=get_checkpoint_model(conf['player1'],device)
+    model2=get_checkpoint_model(conf['player2'],device)
 
     board_stat=initialze_board()
 
     moves_log=""
-    board_stats_seq=[]
+    board_stats_seq=BoardHistory(max(model1.len_inpout_seq, model2.len_inpout_seq))
     pass2player=False
 
     while not np.all(board_stat) and not pass2player:
 
         NgBlackPsWhith=-1
-        board_stats_seq.append(copy.copy(board_stat))
-        if torch.cuda.is_available():
-            model = torch.load(conf['player1'])
-        else:
-            model = torch.load(conf['player1'],map_location=torch.device('cpu'))
-        model.eval()
-
-        input_seq_boards=input_seq_generator(board_stats_seq,model.len_inpout_seq)
-    	#if black is the current player the board should be multiplay by -1
-        model_input=np.array([input_seq_boards])*-1
-        move1_prob = model(torch.tensor(model_input).float().to(device))
-        move1_prob=move1_prob.cpu().detach().numpy().reshape(8,8)
+        board_stats_seq.append(board_stat)
+        model=model1
 
-        legal_moves=get_legal_moves(board_stat,NgBlackPsWhith)
+        best_move=select_move(model, board_stats_seq.window(model.len_inpout_seq), board_stat, NgBlackPsWhith, device)
 
-        if len(legal_moves)>0:
-            
-            best_move=find_best_move(move1_prob,legal_moves)
-            print(f"Black: {best_move} < from possible move {legal_moves}")
+        if best_move is not None:
 
             board_stat[best_move[0],best_move[1]]=NgBlackPsWhith
             moves_log+=str(best_move[0]+1)+str(best_move[1]+1)
-            
+
             board_stat=apply_flip(best_move,board_stat,NgBlackPsWhith)
 
         else:
@@ -142,30 +140,16 @@ def launch_game(player1, player2):
 
 
         NgBlackPsWhith=+1
-        board_stats_seq.append(copy.copy(board_stat))
-        if torch.cuda.is_available():
-            model = torch.load(conf['player2'])
-        else:
-            model = torch.load(conf['player2'],map_location=torch.device('cpu'))
-        model.eval()
+        board_stats_seq.append(board_stat)
+        model=model2
 
-        input_seq_boards=input_seq_generator(board_stats_seq,model.len_inpout_seq)
-        #if black is the current player the board should be multiplay by -1
-        model_input=np.array([input_seq_boards])
-        move1_prob = model(torch.tensor(model_input).float().to(device))
-        move1_prob=move1_prob.cpu().detach().numpy().reshape(8,8)
+        best_move=select_move(model, board_stats_seq.window(model.len_inpout_seq), board_stat, NgBlackPsWhith, device)
 
-        legal_moves=get_legal_moves(board_stat,NgBlackPsWhith)
+        if best_move is not None:
 
-
-        if len(legal_moves)>0:
-            
-            best_move = find_best_move(move1_prob,legal_moves)
-            print(f"White: {best_move} < from possible move {legal_moves}")
-            
             board_stat[best_move[0],best_move[1]]=NgBlackPsWhith
             moves_log+=str(best_move[0]+1)+str(best_move[1]+1)
-            
+
             board_stat=apply_flip(best_move,board_stat,NgBlackPsWhith)
 
         else:
@@ -174,15 +158,11 @@ def launch_game(player1, player2):
                 pass2player=True
             moves_log+="__"
 
-    board_stats_seq.append(copy.copy(board_stat))
+    board_stats_seq.append(board_stat)
     print("Moves log:",moves_log)
 
-    try:
-        with open ('moves.txt', 'w') as f:
-            f.write(moves_log)
-    except:
-        with open ('moves.txt', 'a') as f:
-            f.write(moves_log)
+    with GameLogWriter(GAME_LOG) as game_log:
+        game_log.write(conf['player1'], conf['player2'], parse_text_log(moves_log), -int(np.sum(board_stat)))
 
     if np.sum(board_stat)<0:
         print(f"Black {conf['player1']} is winner (with {-1*int(np.sum(board_stat))} points)")
@@ -200,32 +180,10 @@ def make_one_move(player, board_stat, turn):
     else:
         device = torch.device("cpu")
 
-    conf={}
-    if (player == 'Easy'):
-        conf['player'] = 'server\\api\\model_e2205046.pt'
-
-    if torch.cuda.is_available():
-        model = torch.load(conf['player'])
-    else:
-        model = torch.load(conf['player'], map_location=torch.device('cpu'))
-    model.eval()
-    input_seq_boards = input_seq_generator(board_stat,model.len_inpout_seq)
-    
-    #if black is the current player the board should be multiplay by -1
-    if (turn == -1):
-        model_input=np.array([input_seq_boards])*-1
-    else:
-        model_input=np.array([input_seq_boards])
-    move1_prob = model(torch.tensor(model_input).float().to(device))
-    move1_prob = move1_prob.cpu().detach().numpy().reshape(8,8)
-    legal_moves = get_legal_moves(board_stat,turn)
-    if len(legal_moves)>0:
-        best_move = find_best_move(move1_prob,legal_moves)
-        if (turn == -1):
-            print(f"Black: {best_move} < from possible move {legal_moves}")
-        else:
-            print(f"White: {best_move} < from possible move {legal_moves}")
-        
+    model = get_checkpoint_model(player, device)
+    input_seq_boards = input_seq_generator([board_stat],model.len_inpout_seq)
+    best_move = select_move(model, input_seq_boards, board_stat, turn, device)
+    if best_move is not None:
         board_stat[best_move[0],best_move[1]]=turn
         board_stat=apply_flip(best_move,board_stat,turn)
-    return best_move
\ No newline at end of file
+    return best_move
@@ -0,0 +1,432 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from bitboard import INITIAL_BLACK, INITIAL_WHITE, legal_moves_mask, flip_mask_batch, masks_to_array
+
+BOARD_SIZE=8
+# Log the games of launch_game are appended to
+GAME_LOG=os.environ.get("REVERSI_GAME_LOG", "games.rgl")
+# A game has at most 60 moves. Passes are forced in Othello, so they are not
+# stored: replay() finds them again.
+MAX_MOVES=60
+# Board states of a replayed game: its moves and the passes between them
+MAX_PLIES=128
+NO_MOVE=0xFF
+
+MAGIC=b'RVGL'
+VERSION=1
+# The header holds the player names and is rewritten in place when a new
+# player shows up, the records are only ever appended after it.
+HEADER_SIZE=4096
+HEADER_FORMAT='<4sHHI'
+
+# One record per game: player ids (indexes in the header's names), disc
+# difference at the end (Black minus White), number of moves and the squares
+# played (row*8+col, NO_MOVE after the last move).
+RECORD_DTYPE=np.dtype([('black', '<u2'),
+                       ('white', '<u2'),
+                       ('result', 'i1'),
+                       ('nb_moves', 'u1'),
+                       ('moves', 'u1', (MAX_MOVES,))])
+
+
+class GameLogWriter:
+    """
+    Append-only writer of a binary game log.
+
+    A log is a 4 KB header (magic, version, record size and the JSON list of
+    player names) followed by fixed-size records (RECORD_DTYPE), so that
+    read_games maps millions of games into one numpy array. Only one writer
+    must have a file open at a time.
+    """
+
+    def __init__(self, path):
+        self.path=path
+        if os.path.exists(path):
+            self.names=read_header(path)
+            self.file=open(path, 'r+b')
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.names=[]
+            self.file=open(path, 'w+b')
+            self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def player_id(self, name):
+        ''' Method: player_id
+            Parameters: name (str)
+            Returns: int
+            Does: Returns the id of a player, adding it to the header if needed.
+        '''
+        if name not in self.names:
+            self.names.append(name)
+            self._write_header()
+        return self.names.index(name)
+
+    def write(self, black, white, moves, result):
+        """
+        Appends one game.
+
+        Parameters:
+        - black (str): Player of Black.
+        - white (str): Player of White.
+        - moves (list): Squares played, as row*8+col or (row, col), passes excluded.
+        - result (int): Final disc difference, Black minus White.
+        """
+        squares=[move[0]*BOARD_SIZE+move[1] if isinstance(move, tuple) else move for move in moves]
+        record=np.zeros(1, dtype=RECORD_DTYPE)
+        record['moves']=NO_MOVE
+        record['moves'][0, :len(squares)]=squares
+        self.write_batch(black, white, record['moves'], [len(squares)], [result])
+
+    def write_batch(self, black, white, moves, nb_moves, results):
+        """
+        Appends games played by the same two players.
+
+        Parameters:
+        - black (str): Player of Black.
+        - white (str): Player of White.
+        - moves (numpy.ndarray): Squares played, shape (N, MAX_MOVES), NO_MOVE after the last one.
+        - nb_moves (array-like): Number of moves of every game.
+        - results (array-like): Final disc difference of every game, Black minus White.
+        """
+        records=np.zeros(len(moves), dtype=RECORD_DTYPE)
+        records['black']=self.player_id(black)
+        records['white']=self.player_id(white)
+        records['result']=results
+        records['nb_moves']=nb_moves
+        records['moves']=moves
+        self.file.write(records.tobytes())
+        self.file.flush()
+
+    def _write_header(self):
+        names=json.dumps(self.names).encode('utf-8')
+        header=struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_DTYPE.itemsize, len(names))+names
+        if len(header) > HEADER_SIZE:
+            raise ValueError(f"Too many player names for the header of {self.path}")
+        position=self.file.tell()
+        self.file.seek(0)
+        self.file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self.file.seek(max(position, HEADER_SIZE))
+
+
+def read_header(path):
+    ''' Method: read_header
+        Parameters: path (str)
+        Returns: list of the player names
+        Does: Reads and checks the header of a binary game log.
+    '''
+    with open(path, 'rb') as f:
+        header=f.read(HEADER_SIZE)
+    magic, version, record_size, names_size=struct.unpack_from(HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a version {VERSION} game log")
+    offset=struct.calcsize(HEADER_FORMAT)
+    return json.loads(header[offset:offset+names_size].decode('utf-8'))
+
+
+def read_games(path):
+    """
+    Maps a binary game log into memory.
+
+    Parameters:
+    - path (str): Path of the log.
+
+    Returns:
+    - tuple: (player names, read-only numpy.memmap of RECORD_DTYPE records).
+      records['black'] and records['white'] index the names.
+    """
+    names=read_header(path)
+    nb_games=(os.path.getsize(path)-HEADER_SIZE)//RECORD_DTYPE.itemsize
+    if nb_games == 0:
+        return names, np.zeros(0, dtype=RECORD_DTYPE)
+    return names, np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(nb_games,))
+
+
+def replay(moves, nb_moves):
+    """
+    Replays games in lockstep on numpy.uint64 bitboards.
+
+    Every ply is a move or a forced pass, like the board histories of
+    launch_game and tournament.play_match.
+
+    Parameters:
+    - moves (numpy.ndarray): Squares played, shape (N, MAX_MOVES).
+    - nb_moves (numpy.ndarray): Number of moves of every game.
+
+    Returns:
+    - dict: Bitboards before every ply ("black", "white", shape (N, nb_plies)),
+      side to move ("players", -1 Black, 1 White, 0 after the last move),
+      square played ("moves", -1 for a pass and after the last move) and
+      final disc difference ("results", Black minus White).
+    """
+    nb_games=len(moves)
+    moves=np.asarray(moves)
+    nb_moves=np.asarray(nb_moves, dtype=np.int64)
+    bitboards={-1: np.full(nb_games, INITIAL_BLACK, dtype=np.uint64),
+               1: np.full(nb_games, INITIAL_WHITE, dtype=np.uint64)}
+    color=np.full(nb_games, -1, dtype=np.int8)
+    played=np.zeros(nb_games, dtype=np.int64)
+    passes=np.zeros(nb_games, dtype=np.int8)
+    plies={"black": np.zeros((nb_games, MAX_PLIES), dtype=np.uint64),
+           "white": np.zeros((nb_games, MAX_PLIES), dtype=np.uint64),
+           "players": np.zeros((nb_games, MAX_PLIES), dtype=np.int8),
+           "moves": np.full((nb_games, MAX_PLIES), -1, dtype=np.int16)}
+
+    nb_plies=0
+    while nb_plies < MAX_PLIES:
+        active=np.flatnonzero(played < nb_moves)
+        if len(active) == 0:
+            break
+        plies["black"][active, nb_plies]=bitboards[-1][active]
+        plies["white"][active, nb_plies]=bitboards[1][active]
+        plies["players"][active, nb_plies]=color[active]
+
+        for side in (-1, 1):
+            group=active[color[active] == side]
+            if len(group) == 0:
+                continue
+            own, opp=bitboards[side][group], bitboards[-side][group]
+            legal=legal_moves_mask(own, opp)
+            has_move=legal != 0
+            passes[group[~has_move]]+=1
+            passes[group[has_move]]=0
+            group, own, opp, legal=group[has_move], own[has_move], opp[has_move], legal[has_move]
+            squares=moves[group, played[group]].astype(np.uint64)
+            move=np.left_shift(np.uint64(1), squares % np.uint64(64))
+            illegal=(squares >= 64) | ((legal & move) == 0)
+            if illegal.any():
+                raise ValueError(f"Illegal move {int(squares[illegal][0])} in game {group[illegal][0]}")
+            flips=flip_mask_batch(own, opp, move)
+            bitboards[side][group]=own | move | flips
+            bitboards[-side][group]=opp & ~flips
+            plies["moves"][group, nb_plies]=squares.astype(np.int16)
+            played[group]+=1
+
+        if (passes >= 2).any():
+            raise ValueError(f"Game {np.flatnonzero(passes >= 2)[0]} has moves after the end of the game")
+        color[active]=-color[active]
+        nb_plies+=1
+
+    results=masks_to_array(bitboards[-1]).sum(axis=(1, 2))-masks_to_array(bitboards[1]).sum(axis=(1, 2))
+    replayed={key: value[:, :nb_plies] for key, value in plies.items()}
+    replayed["results"]=results.astype(np.int8)
+    return replayed
+
+
+def random_games(nb_games, seed=0):
+    """
+    Plays games of uniformly random legal moves, all of them in lockstep.
+
+    Parameters:
+    - nb_games (int): Number of games.
+    - seed (int): Seed of the moves.
+
+    Returns:
+    - tuple: (moves, nb_moves) in the format of GameLogWriter.write_batch.
+    """
+    rng=np.random.default_rng(seed)
+    bitboards={-1: np.full(nb_games, INITIAL_BLACK, dtype=np.uint64),
+               1: np.full(nb_games, INITIAL_WHITE, dtype=np.uint64)}
+    color=np.full(nb_games, -1, dtype=np.int8)
+    passes=np.zeros(nb_games, dtype=np.int8)
+    moves=np.full((nb_games, MAX_MOVES), NO_MOVE, dtype=np.uint8)
+    nb_moves=np.zeros(nb_games, dtype=np.int64)
+    for _ in range(MAX_PLIES):
+        active=np.flatnonzero(passes < 2)
+        if len(active) == 0:
+            break
+        for side in (-1, 1):
+            group=active[color[active] == side]
+            if len(group) == 0:
+                continue
+            own, opp=bitboards[side][group], bitboards[-side][group]
+            legal=legal_moves_mask(own, opp)
+            has_move=legal != 0
+            passes[group[~has_move]]+=1
+            passes[group[has_move]]=0
+            group, own, opp, legal=group[has_move], own[has_move], opp[has_move], legal[has_move]
+            scores=np.where(masks_to_array(legal).reshape(-1, 64), rng.random((len(group), 64)), -1)
+            squares=scores.argmax(axis=1)
+            move=np.left_shift(np.uint64(1), squares.astype(np.uint64))
+            flips=flip_mask_batch(own, opp, move)
+            bitboards[side][group]=own | move | flips
+            bitboards[-side][group]=opp & ~flips
+            moves[group, nb_moves[group]]=squares
+            nb_moves[group]+=1
+        color[active]=-color[active]
+    return moves, nb_moves
+
+
+def sample_positions(moves, nb_moves, nb_positions, length, seed=0):
+    """
+    Samples model inputs from games, e.g. a held-out position set.
+
+    Parameters:
+    - moves (numpy.ndarray): Squares played, shape (N, MAX_MOVES) (see read_games or random_games).
+    - nb_moves (numpy.ndarray): Number of moves of every game.
+    - nb_positions (int): Number of positions, drawn among the moves of the games.
+    - length (int): Length of the input sequences (the model's len_inpout_seq).
+    - seed (int): Seed of the draw.
+
+    Returns:
+    - dict: "inputs" (int8, shape (nb_positions, length, 8, 8), negated for
+      Black as the models expect), "legal" (numpy.uint64 legal moves),
+      "moves" (square played) and "players" (side to move) of every position.
+    """
+    replayed=replay(moves, nb_moves)
+    games, plies=np.nonzero(replayed["moves"] >= 0)
+    rng=np.random.default_rng(seed)
+    picked=rng.choice(len(games), size=min(nb_positions, len(games)), replace=False)
+    games, plies=games[picked], plies[picked]
+
+    window=plies[:, None]-length+1+np.arange(length)
+    padding=window < 0
+    window=np.maximum(window, 0)
+    black=np.where(padding, np.uint64(INITIAL_BLACK), replayed["black"][games[:, None], window])
+    white=np.where(padding, np.uint64(INITIAL_WHITE), replayed["white"][games[:, None], window])
+    boards=(masks_to_array(white.reshape(-1)).astype(np.int8)
+            -masks_to_array(black.reshape(-1)).astype(np.int8)).reshape(len(games), length, BOARD_SIZE, BOARD_SIZE)
+    players=replayed["players"][games, plies]
+    #if black is the current player the board should be multiplay by -1
+    boards*=players[:, None, None, None]
+
+    own=np.where(players == -1, black[:, -1], white[:, -1])
+    opp=np.where(players == -1, white[:, -1], black[:, -1])
+    return {"inputs": boards,
+            "legal": legal_moves_mask(own, opp),
+            "moves": replayed["moves"][games, plies],
+            "players": players}
+
+
+def parse_text_log(moves_log):
+    ''' Method: parse_text_log
+        Parameters: moves_log (str)
+        Returns: list of the squares played (row*8+col)
+        Does: Decodes a moves.txt log: two digits (row and column, from 1)
+              per move, "__" for a pass.
+    '''
+    moves_log=moves_log.strip()
+    squares=[]
+    for i in range(0, len(moves_log), 2):
+        move=moves_log[i:i+2]
+        if move == "__":
+            continue
+        squares.append((int(move[0])-1)*BOARD_SIZE+int(move[1])-1)
+    return squares
+
+
+def convert_text_logs(paths, output, black="unknown", white="unknown"):
+    """
+    Appends text logs (one game per non-empty line) to a binary game log.
+
+    The games are replayed, which checks every move and gives the results.
+
+    Parameters:
+    - paths (list): Text logs, like the moves.txt written by launch_game.
+    - output (str): Binary game log, created if needed.
+    - black (str): Player of Black in these games.
+    - white (str): Player of White in these games.
+
+    Returns:
+    - int: Number of games converted.
+    """
+    moves, nb_moves=read_text_logs(paths)
+    if len(moves) == 0:
+        return 0
+    results=replay(moves, nb_moves)["results"]
+    with GameLogWriter(output) as writer:
+        writer.write_batch(black, white, moves, nb_moves, results)
+    return len(moves)
+
+
+def read_text_logs(paths):
+    ''' Method: read_text_logs
+        Parameters: paths (list of text logs, one game per non-empty line)
+        Returns: tuple (moves, nb_moves) in the layout of the binary records
+    '''
+    games=[]
+    for path in paths:
+        with open(path) as f:
+            games.extend(parse_text_log(line) for line in f if line.strip())
+    moves=np.full((len(games), MAX_MOVES), NO_MOVE, dtype=np.uint8)
+    for i, squares in enumerate(games):
+        moves[i, :len(squares)]=squares
+    return moves, np.array([len(squares) for squares in games], dtype=np.int64)
+
+
+def to_hdf5(path, output, chunk_games=16384):
+    """
+    Builds the HDF5 training file of networks_e2205046.GameSequenceDataset
+    from a binary game log.
+
+    Parameters:
+    - path (str): Binary game log.
+    - output (str): HDF5 file to write.
+    - chunk_games (int): Games replayed at once.
+
+    Returns:
+    - int: Number of games written.
+    """
+    import h5py
+
+    _, records=read_games(path)
+    nb_games=len(records)
+    with h5py.File(output, 'w') as f:
+        boards=f.create_dataset('boards', (nb_games, MAX_PLIES, BOARD_SIZE, BOARD_SIZE), dtype=np.int8,
+                                chunks=(1, MAX_PLIES, BOARD_SIZE, BOARD_SIZE), compression='gzip')
+        players=f.create_dataset('players', (nb_games, MAX_PLIES), dtype=np.int8, chunks=(1, MAX_PLIES))
+        moves=f.create_dataset('moves', (nb_games, MAX_PLIES), dtype=np.int16,
+                               chunks=(1, MAX_PLIES), fillvalue=-1)
+        for start in range(0, nb_games, chunk_games):
+            chunk=records[start:start+chunk_games]
+            replayed=replay(chunk['moves'], chunk['nb_moves'])
+            nb_plies=replayed["moves"].shape[1]
+            end=start+len(chunk)
+            plies=(masks_to_array(replayed["white"].reshape(-1)).astype(np.int8)
+                   -masks_to_array(replayed["black"].reshape(-1)).astype(np.int8))
+            boards[start:end, :nb_plies]=plies.reshape(len(chunk), nb_plies, BOARD_SIZE, BOARD_SIZE)
+            players[start:end, :nb_plies]=replayed["players"]
+            moves[start:end, :nb_plies]=replayed["moves"]
+    return nb_games
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Binary game logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Append moves.txt text logs to a binary log")
+    convert.add_argument("logs", nargs="+")
+    convert.add_argument("-o", "--output", required=True)
+    convert.add_argument("--black", default="unknown")
+    convert.add_argument("--white", default="unknown")
+    hdf5 = commands.add_parser("hdf5", help="Build the HDF5 training file of a binary log")
+    hdf5.add_argument("log")
+    hdf5.add_argument("-o", "--output", required=True)
+    info = commands.add_parser("info", help="Summarize a binary log")
+    info.add_argument("log")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print(f"{convert_text_logs(args.logs, args.output, args.black, args.white)} games appended to {args.output}")
+    elif args.command == "hdf5":
+        print(f"{to_hdf5(args.log, args.output)} games written to {args.output}")
+    else:
+        names, records = read_games(args.log)
+        print(f"{len(records)} games, {len(names)} players")
+        for player_id, name in enumerate(names):
+            as_black = records['black'] == player_id
+            as_white = records['white'] == player_id
+            wins = int((records['result'][as_black] > 0).sum()+(records['result'][as_white] < 0).sum())
+            print(f"{name:40s} {int(as_black.sum()+as_white.sum()):8d} games {wins:8d} wins")
@@ -0,0 +1,205 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Games that have not been touched for this many seconds are evicted
+DEFAULT_TTL=3600
+# Above this many games the least recently used ones are evicted
+DEFAULT_MAX_GAMES=10000
+
+
+def new_game_id():
+    return uuid.uuid4().hex
+
+
+class MemoryGameStore:
+    """
+    In-process game store: an LRU of serialized games with idle-time eviction.
+
+    Games are stored as the compact bytes of ReversiGrid.to_bytes, every
+    backend of this module shares the same create/load/save/delete interface.
+    Every save bumps the version of the game: a save given the version its
+    load returned fails when another request saved the game in between.
+    """
+
+    def __init__(self, max_games=DEFAULT_MAX_GAMES, ttl=DEFAULT_TTL):
+        self.max_games=max_games
+        self.ttl=ttl
+        self.games=OrderedDict()  # game_id -> (last access time, state bytes, version)
+        self.lock=threading.Lock()
+
+    def create(self, state):
+        game_id=new_game_id()
+        self.save(game_id, state)
+        return game_id
+
+    def load(self, game_id):
+        entry=self.load_version(game_id)
+        return None if entry is None else entry[0]
+
+    def load_version(self, game_id):
+        ''' Method: load_version
+            Parameters: game_id (str)
+            Returns: tuple (state bytes, version to pass to save), None for an unknown game
+        '''
+        now=time.time()
+        with self.lock:
+            self._evict(now)
+            entry=self.games.get(game_id)
+            if entry is None:
+                return None
+            self.games[game_id]=(now, entry[1], entry[2])
+            self.games.move_to_end(game_id)
+            return entry[1], entry[2]
+
+    def save(self, game_id, state, version=None):
+        ''' Method: save
+            Parameters: game_id (str), state (bytes), version (int, from load_version,
+                        None for a game that must not exist yet)
+            Returns: bool, False when the game changed since that version (nothing is written)
+        '''
+        now=time.time()
+        with self.lock:
+            entry=self.games.get(game_id)
+            current=None if entry is None else entry[2]
+            if current != version:
+                return False
+            self.games[game_id]=(now, state, 0 if version is None else version+1)
+            self.games.move_to_end(game_id)
+            self._evict(now)
+            return True
+
+    def delete(self, game_id):
+        with self.lock:
+            return self.games.pop(game_id, None) is not None
+
+    def __len__(self):
+        return len(self.games)
+
+    def _evict(self, now):
+        # The dict is ordered by last access, so idle games are at the front
+        while self.games:
+            game_id, (last_access, _, _) = next(iter(self.games.items()))
+            if len(self.games) <= self.max_games and now-last_access <= self.ttl:
+                break
+            del self.games[game_id]
+
+
+class SQLiteGameStore:
+    """
+    Game store backed by a local SQLite file, shared by every worker of a node.
+
+    Same interface and eviction rules as MemoryGameStore. Eviction runs every
+    `purge_every` writes so that it stays off the common path.
+    """
+
+    def __init__(self, path, max_games=DEFAULT_MAX_GAMES, ttl=DEFAULT_TTL, purge_every=100):
+        self.path=path
+        self.max_games=max_games
+        self.ttl=ttl
+        self.purge_every=purge_every
+        self.nb_writes=0
+        self.local=threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS games ("
+                         "game_id TEXT PRIMARY KEY, state BLOB NOT NULL, last_access REAL NOT NULL, "
+                         "version INTEGER NOT NULL DEFAULT 0)")
+            columns=[row[1] for row in conn.execute("PRAGMA table_info(games)")]
+            if "version" not in columns:
+                # Files written before games had versions
+                conn.execute("ALTER TABLE games ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS games_last_access ON games (last_access)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn=getattr(self.local, "conn", None)
+        if conn is None:
+            conn=sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn=conn
+        return conn
+
+    def create(self, state):
+        game_id=new_game_id()
+        self.save(game_id, state)
+        return game_id
+
+    def load(self, game_id):
+        entry=self.load_version(game_id)
+        return None if entry is None else entry[0]
+
+    def load_version(self, game_id):
+        now=time.time()
+        with self._connection() as conn:
+            row=conn.execute("SELECT state, last_access, version FROM games WHERE game_id = ?",
+                             (game_id,)).fetchone()
+            if row is None:
+                return None
+            if now-row[1] > self.ttl:
+                conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+                return None
+            conn.execute("UPDATE games SET last_access = ? WHERE game_id = ?", (now, game_id))
+        return bytes(row[0]), row[2]
+
+    def save(self, game_id, state, version=None):
+        now=time.time()
+        with self._connection() as conn:
+            # Compare and swap on the version, shared by the workers through the file
+            if version is None:
+                saved=conn.execute("INSERT OR IGNORE INTO games (game_id, state, last_access, version) "
+                                   "VALUES (?, ?, ?, 0)", (game_id, state, now)).rowcount > 0
+            else:
+                saved=conn.execute("UPDATE games SET state = ?, last_access = ?, version = version + 1 "
+                                   "WHERE game_id = ? AND version = ?", (state, now, game_id, version)).rowcount > 0
+        self.nb_writes+=1
+        if self.nb_writes % self.purge_every == 0:
+            self.purge(now)
+        return saved
+
+    def delete(self, game_id):
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,)).rowcount > 0
+
+    def purge(self, now=None):
+        ''' Method: purge
+            Parameters: now (float)
+            Returns: None
+            Does: Deletes the games idle for more than ttl seconds, then the
+                  least recently used ones above max_games.
+        '''
+        if now is None:
+            now=time.time()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM games WHERE last_access < ?", (now-self.ttl,))
+            conn.execute("DELETE FROM games WHERE game_id IN ("
+                         "SELECT game_id FROM games ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                         (self.max_games,))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+
+def make_game_store(spec=None):
+    """
+    Builds the game store described by `spec`.
+
+    Parameters:
+    - spec (str): 'memory' (default) or 'sqlite:<path>'. Read from the
+      REVERSI_GAME_STORE environment variable when not given.
+
+    Returns:
+    - MemoryGameStore or SQLiteGameStore: The game store.
+    """
+    if spec is None:
+        spec=os.environ.get("REVERSI_GAME_STORE", "memory")
+    max_games=int(os.environ.get("REVERSI_MAX_GAMES", DEFAULT_MAX_GAMES))
+    ttl=float(os.environ.get("REVERSI_GAME_TTL", DEFAULT_TTL))
+    if spec == "memory":
+        return MemoryGameStore(max_games=max_games, ttl=ttl)
+    if spec.startswith("sqlite:"):
+        return SQLiteGameStore(spec[len("sqlite:"):], max_games=max_games, ttl=ttl)
+    raise ValueError(f"Unknown game store: {spec}")
@@ -0,0 +1,12 @@
+import os
+
+# Threads let concurrent games of a worker share the micro-batches of
+# inference.InferenceBatcher
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+
+def post_worker_init(worker):
+    # Load every difficulty once per worker so that the first /make_one_move
+    # does not pay for torch.load
+    from model_registry import preload
+    preload()
@@ -0,0 +1,195 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from bitboard import masks_to_array
+from difficulties import MODEL_FILES
+from model_registry import get_model, input_dtype
+
+# A batch is run as soon as it holds this many requests (by default the
+# request threads of a gunicorn worker, more can never be waiting)...
+DEFAULT_MAX_BATCH_SIZE=int(os.environ.get("REVERSI_MAX_BATCH", os.environ.get("GUNICORN_THREADS", 8)))
+# ...as soon as no other request is waiting, or when its oldest request has
+# waited this long
+DEFAULT_MAX_LATENCY_MS=float(os.environ.get("REVERSI_MAX_LATENCY_MS", 5))
+
+
+class InferenceBatcher:
+    """
+    Micro-batching scheduler for the AI moves of concurrent games.
+
+    Requests are queued per difficulty. A worker thread per difficulty takes
+    the first pending request and the ones already queued behind it. It only
+    waits (up to `max_latency_ms`, or until `max_batch_size` requests are
+    pending) while callers that submitted a request are not in the batch
+    yet, so a lone request runs at once. It then stacks their input
+    sequences, runs one forward pass and hands every caller its own row of
+    the output. Only the difficulties of MODEL_FILES get a queue and a thread.
+    """
+
+    def __init__(self, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_latency_ms=DEFAULT_MAX_LATENCY_MS, device=None):
+        self.max_batch_size=max_batch_size
+        self.max_latency=max_latency_ms/1000
+        self.device=device if device is not None else torch.device("cpu")
+        self.queues={}
+        self.stats={}
+        # Requests submitted and not answered yet, per difficulty
+        self.waiting={}
+        self.lock=threading.Lock()
+
+    def submit(self, player, model_input):
+        """
+        Queues one input sequence for the model of `player`.
+
+        Parameters:
+        - player (str): Difficulty of MODEL_FILES.
+        - model_input (torch.Tensor): Input sequence of one game, shape (len_inpout_seq, 8, 8),
+          of any dtype (int8 boards are cast to the model's input dtype with the whole batch).
+
+        Returns:
+        - concurrent.futures.Future: Resolves to the 64 move probabilities.
+
+        Raises:
+        - ValueError: When player is not a difficulty of MODEL_FILES.
+        """
+        future=Future()
+        pending=self._queue(player)
+        with self.lock:
+            self.waiting[player]+=1
+        pending.put((model_input, future))
+        return future
+
+    def predict(self, player, model_input):
+        ''' Method: predict
+            Parameters: player (str), model_input (torch.Tensor)
+            Returns: torch.Tensor of the 64 move probabilities
+            Does: Blocking version of submit.
+        '''
+        return self.submit(player, model_input).result()
+
+    def metrics(self):
+        """
+        Returns the batching counters of every difficulty.
+
+        Returns:
+        - dict: For each difficulty, the number of requests and batches, the
+          mean batch size and the fill rate (mean batch size / max_batch_size).
+        """
+        with self.lock:
+            report={}
+            for player, stats in self.stats.items():
+                mean_batch=stats["requests"]/stats["batches"] if stats["batches"] else 0.0
+                report[player]=dict(stats,
+                                    mean_batch_size=mean_batch,
+                                    fill_rate=mean_batch/self.max_batch_size)
+            return report
+
+    def _queue(self, player):
+        if player not in MODEL_FILES:
+            raise ValueError(f"Unknown difficulty {player!r}, expected one of {tuple(MODEL_FILES)}")
+        pending=self.queues.get(player)
+        if pending is None:
+            with self.lock:
+                pending=self.queues.get(player)
+                if pending is None:
+                    pending=queue.Queue()
+                    self.stats[player]={"requests": 0, "batches": 0}
+                    self.waiting[player]=0
+                    worker=threading.Thread(target=self._run, args=(player, pending),
+                                            name=f"inference-{player}", daemon=True)
+                    worker.start()
+                    self.queues[player]=pending
+        return pending
+
+    def _collect(self, player, pending):
+        batch=[pending.get()]
+        deadline=time.perf_counter()+self.max_latency
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(pending.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            # Every caller waiting for an answer is in the batch: nothing to wait for
+            with self.lock:
+                if len(batch) >= self.waiting[player]:
+                    break
+            remaining=deadline-time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, player, pending):
+        while True:
+            batch=self._collect(player, pending)
+            futures=[future for _, future in batch]
+            try:
+                model=get_model(player, self.device)
+                inputs=torch.stack([model_input for model_input, _ in batch]).to(self.device, input_dtype(model))
+                with torch.no_grad():
+                    outputs=model(inputs).reshape(len(batch), -1).float().cpu()
+            except Exception as e:
+                with self.lock:
+                    self.waiting[player]-=len(batch)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            with self.lock:
+                self.waiting[player]-=len(batch)
+                self.stats[player]["requests"]+=len(batch)
+                self.stats[player]["batches"]+=1
+            for i, future in enumerate(futures):
+                future.set_result(outputs[i])
+
+
+SQUARE_BITS=torch.arange(64)
+
+
+def legal_mask_tensor(masks, device=None):
+    """
+    Expands legal-move bitboards into boolean tensors.
+
+    Parameters:
+    - masks (int, list or numpy.ndarray): One bitboard (see bitboard.legal_moves_mask),
+      a list of N bitboards or a numpy.uint64 array of N bitboards.
+    - device (torch.device): Device of the returned tensor.
+
+    Returns:
+    - torch.Tensor: Boolean tensor of shape (64,) or (N, 64), square row*8+col at index row*8+col.
+    """
+    if isinstance(masks, np.ndarray):
+        return torch.from_numpy(masks_to_array(masks).reshape(-1, 64)).to(device)
+    # Bitboards are unsigned, int64 tensors are signed
+    if isinstance(masks, int):
+        signed=masks-(1 << 64) if masks >> 63 else masks
+    else:
+        signed=[mask-(1 << 64) if mask >> 63 else mask for mask in masks]
+    bits=torch.tensor(signed, dtype=torch.int64, device=device)
+    return ((bits.unsqueeze(-1) >> SQUARE_BITS.to(bits.device)) & 1).bool()
+
+
+def masked_argmax(move_prob, legal_mask):
+    """
+    Picks the most probable legal move of one board or of a batch of boards.
+
+    Parameters:
+    - move_prob (torch.Tensor): Model output of shape (64,), (8, 8), (N, 64) or (N, 8, 8).
+    - legal_mask (torch.Tensor): Boolean mask of shape (64,) or (N, 64) (see legal_mask_tensor).
+
+    Returns:
+    - torch.Tensor: Square index (row*8+col) of the best move for every board,
+      -1 for the boards without any legal move. Ties go to the first square.
+    """
+    scores=move_prob.reshape(legal_mask.shape)
+    scores=torch.where(legal_mask, scores, torch.full_like(scores, float('-inf')))
+    best=scores.argmax(dim=-1)
+    return torch.where(legal_mask.any(dim=-1), best, torch.full_like(best, -1))
@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+
+from model_registry import input_dtype
+
+# Boards a session's state may be advanced by after its last full-window
+# pass before the window is run again from a zero state (0 disables the
+# stateful mode: every move runs the whole window, as in training)
+DEFAULT_REFRESH_EVERY=int(os.environ.get("REVERSI_LSTM_REFRESH", 0))
+# Sessions (game, difficulty, side) whose state is kept
+DEFAULT_MAX_SESSIONS=int(os.environ.get("REVERSI_LSTM_SESSIONS", 10000))
+
+
+def recurrent_parts(model):
+    ''' Method: recurrent_parts
+        Parameters: model (torch.nn.Module from get_model)
+        Returns: the eager LSTMs model (lstm and head layers) behind a served
+                 model, None for the other models and the TorchScript artifacts
+    '''
+    model=getattr(model, "model", model) # BatchedPolicy
+    if isinstance(model, torch.jit.ScriptModule):
+        return None
+    if not (hasattr(model, "lstm") and hasattr(model, "head")):
+        return None
+    return model
+
+
+class LSTMStateCache:
+    """
+    Stateful inference of the LSTM models, one (hn, cn) per game session.
+
+    The models are trained on windows of the last len_inpout_seq boards run
+    from a zero state. Here a session runs that full window once, then
+    advances its state with only the boards played since its last move (two
+    per turn, the opponent's move and its own) and feeds the head with the
+    last output. The state then covers more history than the window the model
+    was trained on: the outputs approximate the sliding window, and the
+    drift is bounded by running the full window again once the state has
+    been advanced by refresh_every boards. The window is also run again when
+    the session is unknown, when the game went back (new game, undo) or when
+    more boards than the window holds were played since its last move.
+
+    Every session is keyed by (game id, difficulty, side): the inputs of
+    Black are the negated boards, so the two sides of a game have their own
+    state.
+    """
+
+    def __init__(self, refresh_every=DEFAULT_REFRESH_EVERY, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.refresh_every=refresh_every
+        self.max_sessions=max_sessions
+        self.sessions=OrderedDict()
+        self.stats={"full": 0, "incremental": 0, "lstm_steps": 0}
+        self.lock=threading.Lock()
+
+    def predict(self, session, model, window, nb_boards):
+        """
+        Move probabilities of a session's current position.
+
+        Parameters:
+        - session (tuple): (game id, difficulty, side to move).
+        - model (torch.nn.Module): Model of the difficulty (see model_registry.get_model).
+        - window (torch.Tensor): Model input, shape (len_inpout_seq, 8, 8), negated for Black.
+        - nb_boards (int): Number of boards of the game so far (BoardHistory.nb_boards).
+
+        Returns:
+        - torch.Tensor: The 64 move probabilities, or None when the model is
+          not an eager LSTM model (the caller runs the whole window).
+        """
+        prediction=self.predict_drift(session, model, window, nb_boards)
+        return None if prediction is None else prediction[0]
+
+    def predict_drift(self, session, model, window, nb_boards):
+        ''' Method: predict_drift
+            Parameters: see predict
+            Returns: tuple (64 move probabilities, drift), None when the model is not
+                     an eager LSTM model. drift is the number of boards the state was
+                     advanced by since its last full-window pass: 0 when the output is
+                     the model's output on the window, approximate otherwise.
+        '''
+        network=recurrent_parts(model)
+        if network is None or self.refresh_every <= 0:
+            return None
+        with self.lock:
+            entry=self.sessions.pop(session, None)
+        new_boards=nb_boards-entry["nb_boards"] if entry is not None else 0
+        if entry is None or not 0 < new_boards <= len(window) or entry["drift"]+new_boards > self.refresh_every:
+            boards, state, drift=window, None, 0
+        else:
+            boards, state, drift=window[-new_boards:], entry["state"], entry["drift"]+new_boards
+
+        parameter=next(network.parameters(), None)
+        device=parameter.device if parameter is not None else torch.device("cpu")
+        seq=boards.to(device, input_dtype(model)).reshape(1, len(boards), -1)
+        with torch.no_grad():
+            x, state=network.lstm(seq, state)
+            move_prob=F.softmax(network.head(x[:, -1, :]), dim=-1).reshape(-1).float().cpu()
+
+        with self.lock:
+            self.sessions[session]={"nb_boards": nb_boards, "drift": drift, "state": state}
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            self.stats["incremental" if drift else "full"]+=1
+            self.stats["lstm_steps"]+=len(boards)
+        return move_prob, drift
+
+    def forget(self, game_id):
+        ''' Method: forget
+            Parameters: game_id (str)
+            Returns: None
+            Does: Drops the states of every session of a game.
+        '''
+        with self.lock:
+            for session in [session for session in self.sessions if session[0] == game_id]:
+                del self.sessions[session]
+
+    def metrics(self):
+        """
+        Returns the counters of the stateful inference.
+
+        Returns:
+        - dict: Moves run on the full window and incrementally, LSTM steps
+          per move and number of sessions.
+        """
+        with self.lock:
+            moves=self.stats["full"]+self.stats["incremental"]
+            return dict(self.stats,
+                        steps_per_move=self.stats["lstm_steps"]/moves if moves else 0.0,
+                        sessions=len(self.sessions))
@@ -0,0 +1,265 @@
+import json
+import os
+import threading
+
+import numpy as np
+import torch
+
+from difficulties import MODEL_FILES
+from utile import INITIAL_BOARD
+
+# Models are looked up next to this file unless REVERSI_MODEL_DIR says otherwise,
+# so the same code works from the repository root, server/api or a container.
+MODEL_DIR = os.environ.get("REVERSI_MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+# TorchScript artifacts written by export_models.py, preferred over the
+# pickled checkpoints because they load without the training module
+SCRIPTED_EXTENSION = '.ts'
+CONFIG_FILE = 'config.json'
+
+# Serving precision of the models: 'fp32', 'bf16' (weights and activations in
+# bfloat16) or 'int8' (dynamic int8 quantization of the nn.Linear layers).
+# REVERSI_PRECISION is one precision for every difficulty or a list such as
+# "Hard:bf16,Medium:int8", the difficulties it does not name stay in fp32.
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+
+def parse_precisions(spec):
+    ''' Method: parse_precisions
+        Parameters: spec (str), value of REVERSI_PRECISION
+        Returns: dict of the precision of every named difficulty ('*' for all)
+        Does: Parses and checks a precision setting.
+    '''
+    precisions = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        player, _, precision = item.rpartition(':')
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r} in REVERSI_PRECISION, expected one of {PRECISIONS}")
+        precisions[player or '*'] = precision
+    return precisions
+
+
+PRECISION_BY_PLAYER = parse_precisions(os.environ.get("REVERSI_PRECISION", ""))
+
+
+def precision_of(player):
+    return PRECISION_BY_PLAYER.get(player, PRECISION_BY_PLAYER.get('*', 'fp32'))
+
+
+_models = {}
+_lock = threading.Lock()
+
+
+class BatchedPolicy(torch.nn.Module):
+    """
+    Wrapper of a model that always runs batches of at least two sequences.
+
+    The training models np.squeeze their input, so a batch of one board
+    sequence takes another branch than larger batches: traced graphs and
+    quantized layers only support the batched one. The wrapper appends a copy
+    of the last sequence to every batch and drops its output, so it serves
+    any batch size, including one.
+    """
+
+    def __init__(self, model):
+        super(BatchedPolicy, self).__init__()
+        self.model=model
+        self.len_inpout_seq=model.len_inpout_seq
+        self.input_dtype=input_dtype(model)
+
+    def forward(self, seq):
+        padded=torch.cat([seq, seq[-1:]], dim=0)
+        return self.model(padded).reshape(padded.shape[0], -1)[:-1]
+
+
+def resolve_model_path(player, precision='fp32'):
+    """
+    Resolves a difficulty name to a file path.
+
+    A difficulty resolves to its TorchScript artifact in the serving
+    precision when one was exported (Hard.ts in fp32, Hard.int8.ts in int8,
+    see export_models.py and quantize_model.py), to its pickled checkpoint
+    otherwise.
+
+    Parameters:
+    - player (str): 'Easy', 'Medium' or 'Hard'.
+    - precision (str): Serving precision (see PRECISIONS).
+
+    Returns:
+    - str: Path of the checkpoint file.
+
+    Raises:
+    - ValueError: When player is not a difficulty of MODEL_FILES.
+    """
+    if player not in MODEL_FILES:
+        raise ValueError(f"Unknown difficulty {player!r}, expected one of {tuple(MODEL_FILES)}")
+    path = os.path.join(MODEL_DIR, MODEL_FILES[player])
+    scripted = scripted_path(path, precision)
+    return scripted if os.path.exists(scripted) else path
+
+
+def resolve_checkpoint_path(player, precision='fp32'):
+    ''' Method: resolve_checkpoint_path
+        Parameters: player (str, difficulty or path of a checkpoint), precision (str)
+        Returns: str, path of the checkpoint file
+        Does: resolve_model_path, also taking checkpoint paths (relative paths
+              that do not exist are looked up in MODEL_DIR). Checkpoints are
+              unpickled, so this is for the command-line tools only, never for
+              names coming from a request.
+    '''
+    if player in MODEL_FILES:
+        return resolve_model_path(player, precision)
+    if os.path.isabs(player) or os.path.exists(player):
+        return os.path.abspath(player)
+    return os.path.join(MODEL_DIR, player)
+
+
+def scripted_path(checkpoint, precision='fp32'):
+    ''' Method: scripted_path
+        Parameters: checkpoint (str), precision (str)
+        Returns: str, path of the TorchScript artifact of a checkpoint in a precision
+    '''
+    suffix = '' if precision == 'fp32' else '.' + precision
+    return os.path.splitext(checkpoint)[0] + suffix + SCRIPTED_EXTENSION
+
+
+def get_model(player, device=None, precision=None):
+    """
+    Returns the model of a difficulty, loading it on first use.
+
+    Every caller of the process gets the same instance, already in eval mode.
+
+    Parameters:
+    - player (str): 'Easy', 'Medium' or 'Hard'.
+    - device (torch.device): Device to load the model on (CPU by default).
+    - precision (str): Serving precision (REVERSI_PRECISION of the difficulty by default).
+
+    Returns:
+    - torch.nn.Module: The loaded model, its inputs must be cast to input_dtype(model).
+
+    Raises:
+    - ValueError: When player is not a difficulty of MODEL_FILES.
+    """
+    if precision is None:
+        precision = precision_of(player)
+    return _cached_model(resolve_model_path(player, precision), device, precision)
+
+
+def get_checkpoint_model(player, device=None, precision=None):
+    ''' Method: get_checkpoint_model
+        Parameters: player (str, difficulty or path of a checkpoint), device (torch.device), precision (str)
+        Returns: torch.nn.Module, see get_model
+        Does: get_model for the command-line tools, which also load checkpoint
+              paths (see resolve_checkpoint_path).
+    '''
+    if precision is None:
+        precision = precision_of(player)
+    return _cached_model(resolve_checkpoint_path(player, precision), device, precision)
+
+
+def _cached_model(path, device, precision):
+    if device is None:
+        device = torch.device("cpu")
+    key = (path, str(device), precision)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = load_model(path, device, precision)
+                _models[key] = model
+    return model
+
+
+def load_model(path, device, precision='fp32'):
+    ''' Method: load_model
+        Parameters: path (str), device (torch.device), precision (str)
+        Returns: torch.nn.Module in eval mode, with its len_inpout_seq attribute
+        Does: Loads a TorchScript artifact or a pickled checkpoint, and
+              converts a checkpoint to the serving precision.
+    '''
+    if path.endswith(SCRIPTED_EXTENSION):
+        extra_files = {CONFIG_FILE: ""}
+        model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        config = json.loads(extra_files[CONFIG_FILE])
+        model.len_inpout_seq = config["len_inpout_seq"]
+        if precision != config.get("precision", 'fp32'):
+            raise ValueError(f"{path} is a {config.get('precision', 'fp32')} artifact, not {precision}")
+        if precision == 'bf16':
+            model.input_dtype = torch.bfloat16
+    else:
+        # Checkpoints are whole pickled modules (torch.save(self, ...)),
+        # not plain weights.
+        model = torch.load(path, map_location=device, weights_only=False)
+        model = convert_precision(model, precision)
+        if precision == 'int8':
+            model = BatchedPolicy(model)
+    model.eval()
+    return model
+
+
+def convert_precision(model, precision, quantized_modules=(torch.nn.Linear,)):
+    """
+    Converts an eager model to a serving precision.
+
+    Parameters:
+    - model (torch.nn.Module): Model in fp32.
+    - precision (str): 'fp32', 'bf16' or 'int8' (int8 runs on CPU only).
+    - quantized_modules (tuple): Layer types quantized in int8.
+
+    Returns:
+    - torch.nn.Module: The converted model, with an input_dtype attribute.
+      Quantized layers only take batches of two sequences or more (see BatchedPolicy).
+    """
+    if precision == 'bf16':
+        model = model.to(torch.bfloat16)
+        model.input_dtype = torch.bfloat16
+    elif precision == 'int8':
+        model = torch.ao.quantization.quantize_dynamic(model, set(quantized_modules), dtype=torch.qint8)
+        model.input_dtype = torch.float32
+    elif precision != 'fp32':
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+    return model
+
+
+def input_dtype(model):
+    ''' Method: input_dtype
+        Parameters: model (torch.nn.Module from get_model)
+        Returns: torch.dtype the inputs of the model must be cast to
+    '''
+    return getattr(model, 'input_dtype', torch.float32)
+
+
+def warm_up(model, device=None):
+    ''' Method: warm_up
+        Parameters: model (torch.nn.Module), device (torch.device)
+        Returns: None
+        Does: Runs one forward pass on the initial board so that lazy
+              allocations happen before the first request.
+    '''
+    if device is None:
+        device = torch.device("cpu")
+    model_input = torch.from_numpy(np.array([[INITIAL_BOARD] * model.len_inpout_seq]))
+    with torch.no_grad():
+        model(model_input.to(device, input_dtype(model)))
+
+
+def preload(players=None, device=None):
+    """
+    Loads and warms up the models of every difficulty.
+
+    Meant to run at worker start (see gunicorn.conf.py). Missing checkpoints
+    are reported and skipped so that a partial deploy still boots.
+
+    Parameters:
+    - players (list): Difficulties (all difficulties by default).
+    - device (torch.device): Device to load the models on (CPU by default).
+    """
+    if players is None:
+        players = list(MODEL_FILES)
+    for player in players:
+        path = resolve_model_path(player, precision_of(player))
+        if not os.path.exists(path):
+            print(f"Model {player} not found at {path}, skipping preload")
+            continue
+        warm_up(get_model(player, device), device)
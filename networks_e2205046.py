@@ -3,29 +3,484 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 from torch.autograd import Variable
-from torch.utils.data import Dataset,DataLoader
+from torch.utils.data import Dataset,DataLoader,IterableDataset,get_worker_info
 from torch.nn.utils.rnn import pad_sequence
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
-from scipy.ndimage import gaussian_filter1d
-from sklearn.metrics import f1_score
-from sklearn.metrics import classification_report
 
-from tqdm import tqdm
-import pandas as pd
 import numpy as np
 import os
 import sys
-import h5py
 import json
 import copy
 import time
 from datetime import datetime
 
+from utile import INITIAL_BOARD
+
 
 def loss_fnc(predictions, targets):
     return nn.CrossEntropyLoss()(input=predictions,target=targets) # Could be improved?
 
 
+def classification_metrics(confusion, zero_division=1.0):
+    """
+    Computes the metrics of sklearn's classification_report from a confusion matrix.
+
+    Parameters:
+    - confusion (torch.Tensor): Confusion matrix, confusion[target, prediction].
+    - zero_division (float): Value of the undefined precisions and recalls.
+
+    Returns:
+    - dict: Same layout as classification_report(..., output_dict=True): one
+      entry per class seen in the targets or the predictions, "accuracy",
+      "macro avg" and "weighted avg".
+    """
+    confusion=confusion.double()
+    true_positive=confusion.diagonal()
+    support=confusion.sum(dim=1)
+    predicted=confusion.sum(dim=0)
+    seen=(support+predicted) > 0
+
+    precision=torch.where(predicted > 0, true_positive/predicted.clamp(min=1), torch.full_like(predicted, zero_division))
+    recall=torch.where(support > 0, true_positive/support.clamp(min=1), torch.full_like(support, zero_division))
+    f1=2*true_positive/(2*true_positive+(predicted-true_positive)+(support-true_positive)).clamp(min=1)
+    precision, recall, f1, support=precision[seen], recall[seen], f1[seen], support[seen]
+    total=support.sum()
+
+    report={}
+    for label, p, r, f, n in zip(torch.nonzero(seen).flatten().tolist(), precision.tolist(),
+                                 recall.tolist(), f1.tolist(), support.tolist()):
+        report[str(label)]={"precision": p, "recall": r, "f1-score": f, "support": n}
+    report["accuracy"]=(true_positive.sum()/total).item()
+    report["macro avg"]={"precision": precision.mean().item(),
+                         "recall": recall.mean().item(),
+                         "f1-score": f1.mean().item(),
+                         "support": total.item()}
+    report["weighted avg"]={"precision": (precision*support).sum().item()/total.item(),
+                            "recall": (recall*support).sum().item()/total.item(),
+                            "f1-score": (f1*support).sum().item()/total.item(),
+                            "support": total.item()}
+    return report
+
+
+def evaluate_model(model, test_loader, device, nb_classes=64):
+    """
+    Evaluates a model on a loader of (batch, labels, _) triples.
+
+    Runs in inference mode, keeps the predictions and targets on the device
+    in preallocated tensors and computes every metric from one confusion
+    matrix at the end.
+
+    Parameters:
+    - model (nn.Module): Model to evaluate.
+    - test_loader (DataLoader): Loader of one-hot targets.
+    - device (torch.device): Device of the model.
+    - nb_classes (int): Number of moves.
+
+    Returns:
+    - dict: The classification_report dict of the predictions (see classification_metrics).
+    """
+    from tqdm import tqdm
+
+    try:
+        nb_samples=len(test_loader.dataset)
+    except (AttributeError, TypeError):
+        nb_samples=None
+    if nb_samples is not None:
+        predictions=torch.empty(nb_samples, dtype=torch.long, device=device)
+        targets=torch.empty(nb_samples, dtype=torch.long, device=device)
+    else:
+        predictions, targets=[], []
+
+    filled=0
+    with torch.inference_mode():
+        for data, target, _ in tqdm(test_loader):
+            output=model(data.float().to(device)).reshape(len(target), -1)
+            predicted=output.argmax(dim=-1)
+            target=target.to(device).reshape(len(target), -1).argmax(dim=-1)
+            if nb_samples is not None:
+                predictions[filled:filled+len(target)]=predicted
+                targets[filled:filled+len(target)]=target
+            else:
+                predictions.append(predicted)
+                targets.append(target)
+            filled+=len(target)
+
+    if nb_samples is None:
+        predictions, targets=torch.cat(predictions), torch.cat(targets)
+    predictions, targets=predictions[:filled], targets[:filled]
+    confusion=torch.bincount(targets*nb_classes+predictions, minlength=nb_classes*nb_classes)
+    return classification_metrics(confusion.reshape(nb_classes, nb_classes))
+
+
+# Options of train_model, set with conf["training"] in the model constructors
+TRAINING_DEFAULTS={
+    # 0: train accuracy from the predictions of the training pass itself (dropout
+    # active), N: accuracy of an evaluation on the first N samples of the train loader
+    "train_eval_samples": 0,
+    # Dev evaluation (checkpointing and early stopping) every dev_every epochs,
+    # and always after the last one
+    "dev_every": 1,
+    # torch.autograd anomaly detection (NaN origin, debug only: much slower backward passes)
+    "detect_anomaly": False,
+    # Max norm of the gradients (torch.nn.utils.clip_grad_norm_), None: no clipping
+    "grad_clip": None,
+    # Loss logged every log_every batches, 0: once per epoch only
+    "log_every": 0,
+    # Number of batches of the first epoch run under torch.profiler, the table of
+    # the most expensive operators goes to "<path_save> profile.txt", 0: no profiling
+    "profile": 0,
+}
+
+
+def training_conf(model):
+    ''' Method: training_conf
+        Parameters: model (nn.Module)
+        Returns: dict, TRAINING_DEFAULTS updated with the model's conf["training"]
+    '''
+    return dict(TRAINING_DEFAULTS, **getattr(model, "training_conf", {}))
+
+
+class _FirstSamples:
+    # The first nb_samples samples of a loader, in whole batches
+    def __init__(self, loader, nb_samples):
+        self.loader=loader
+        self.nb_samples=nb_samples
+
+    def __iter__(self):
+        seen=0
+        for batch in self.loader:
+            if seen >= self.nb_samples:
+                break
+            yield batch
+            seen+=len(batch[1])
+
+
+def train_model(model, train, dev, num_epoch, device, optimizer):
+    """
+    Training loop shared by the train_all methods of MLP, LSTMs and CNN.
+
+    Every epoch logs the loss, the train and dev accuracies and the timings to
+    "<path_save> logs.txt", keeps the best checkpoint on dev in path_save and
+    stops after earlyStopping dev evaluations without improvement. The
+    options of the loop (TRAINING_DEFAULTS) come from conf["training"].
+
+    Parameters:
+    - model (nn.Module): Model to train, with path_save and earlyStopping attributes.
+    - train (DataLoader): Training loader of (batch, labels, _) triples.
+    - dev (DataLoader): Dev loader.
+    - num_epoch (int): Maximum number of epochs.
+    - device (torch.device): Device of the model.
+    - optimizer (torch.optim.Optimizer): Optimizer of the model's parameters.
+
+    Returns:
+    - int: Epoch of the best dev accuracy.
+    """
+    # Training-only dependencies, not installed by the serving deploy
+    from tqdm import tqdm
+
+    options=training_conf(model)
+
+    def write_log(message):
+        with open(f'{model.path_save} logs.txt', 'a', encoding='utf-8') as f:
+            f.write(message)
+            f.write("\n")
+
+    def write_profile(profiler):
+        profiler.stop()
+        with open(f'{model.path_save} profile.txt', 'w', encoding='utf-8') as f:
+            f.write(profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=30))
+        return None
+
+    if not os.path.exists(f"{model.path_save}"):
+        os.mkdir(f"{model.path_save}")
+    best_dev = 0.0
+    best_epoch = None
+    notchange=0 # to manage earlystopping
+    train_acc_list=[]
+    dev_acc_list=[]
+    profiler=None
+    if options["profile"]:
+        profiler=torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]+
+                                        ([torch.profiler.ProfilerActivity.CUDA] if device.type == 'cuda' else []))
+        profiler.start()
+    init_time=time.time()
+    for epoch in range(1, num_epoch+1):
+        start_time=time.time()
+        nb_batch =  0
+        loss_batch = 0
+        # Running counts stay on the device, read once per epoch
+        correct = torch.zeros((), dtype=torch.long, device=device)
+        nb_samples = 0
+        with torch.autograd.set_detect_anomaly(options["detect_anomaly"]):
+            for batch, labels, _ in tqdm(train):
+                labels = labels.clone().detach().float().to(device)
+                outputs =model(batch.float().to(device))
+                loss = loss_fnc(outputs,labels)
+                loss.backward()
+                if options["grad_clip"] is not None:
+                    nn.utils.clip_grad_norm_(model.parameters(), options["grad_clip"])
+                optimizer.step()
+                optimizer.zero_grad()
+                nb_batch += 1
+                loss_batch += loss.item()
+                correct += (outputs.detach().reshape(len(labels), -1).argmax(dim=-1) == labels.argmax(dim=-1)).sum()
+                nb_samples += len(labels)
+                if options["log_every"] and nb_batch % options["log_every"] == 0:
+                    write_log(f"epoch: {epoch}/{num_epoch} batch: {nb_batch} - loss = {loss_batch/nb_batch}")
+                if profiler is not None and nb_batch == options["profile"]:
+                    profiler=write_profile(profiler)
+        if profiler is not None:
+            # First epoch shorter than the profiled batches
+            profiler=write_profile(profiler)
+        print("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
+              str(loss_batch/nb_batch))
+        write_log("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
+                  str(loss_batch/nb_batch))
+        last_training=time.time()-start_time
+
+        model.eval()
+
+        if options["train_eval_samples"]:
+            train_clas_rep=model.evalulate(_FirstSamples(train, options["train_eval_samples"]), device)
+            acc_train=train_clas_rep["weighted avg"]["recall"]
+        else:
+            # The weighted average recall is the accuracy
+            acc_train=correct.item()/nb_samples
+        train_acc_list.append(acc_train)
+
+        evaluate_dev = epoch % options["dev_every"] == 0 or epoch == num_epoch
+        if evaluate_dev:
+            dev_clas_rep=model.evalulate(dev, device)
+            acc_dev=dev_clas_rep["weighted avg"]["recall"]
+            dev_acc_list.append(acc_dev)
+            dev_message=f"{round(100*acc_dev,2)}%"
+        else:
+            dev_message="not evaluated"
+
+        last_prediction=time.time()-last_training-start_time
+
+        print(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {dev_message} ;",
+              f"Time: {round(time.time()-init_time)}",
+              f"(last_train: {round(last_training)}sec, last_pred: {round(last_prediction)}sec)")
+        write_log(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {dev_message} ;" +
+                  f" Time: {round(time.time()-init_time)}" +
+                  f" (last_train: {round(last_training)}sec, last_pred: {round(last_prediction)}sec)")
+
+        if evaluate_dev:
+            if acc_dev > best_dev or best_dev == 0.0:
+                notchange=0
+                for filename in os.listdir(model.path_save):
+                    os.remove(model.path_save+'/'+filename)
+                torch.save(model, model.path_save + '/model_' + str(epoch) + '.pt')
+                best_dev = acc_dev
+                best_epoch = epoch
+            else:
+                notchange+=1
+                if notchange>model.earlyStopping:
+                    break
+
+        model.train()
+
+        if best_epoch is not None:
+            print("*"*15,f"The best score on DEV {best_epoch}: {round(100*best_dev,3)}%")
+            write_log("*"*15 + f" The best score on DEV {best_epoch}: {round(100*best_dev,3)}%")
+
+    best_model = torch.load(model.path_save + '/model_' + str(best_epoch) + '.pt', weights_only=False)
+    best_model.eval()
+    _clas_rep = best_model.evalulate(dev, device)
+    print(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
+    write_log(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
+    with open(f'{model.path_save} description.txt', 'a', encoding='utf-8') as f:
+        f.write(f"{100*_clas_rep['weighted avg']['recall']}%")
+
+    return best_epoch
+
+
+# Rows of the one-hot move labels, a label is a view of its row
+MOVE_LABELS=np.eye(64, dtype=np.float32)
+
+
+class GameSequenceDataset(IterableDataset):
+    """
+    Streams training samples from chunked HDF5 game files.
+
+    Every file holds one row per game, padded after the end of the game:
+    - boards (int8, nb_games x nb_plies x 8 x 8): board before every ply,
+      -1 Black, 1 White, 0 empty.
+    - players (int8, nb_games x nb_plies): side to move at every ply,
+      -1 Black, 1 White.
+    - moves (int, nb_games x nb_plies): square played at every ply
+      (row*8+col), -1 for a pass and after the end of the game.
+    Chunking the datasets by game (chunks=(1, nb_plies, ...)) makes every
+    game a single read.
+
+    Games are read one at a time: the game is padded with len_inpout_seq-1
+    initial boards (as input_seq_generator does) and negated once for the
+    moves of Black, so every input sequence is a view of one of the two
+    arrays. Each sample is (input sequence (len_inpout_seq, 8, 8) int8,
+    one-hot move (64,) float32, number of real boards in the sequence), the
+    (batch, labels, _) triples train_all and evalulate expect once collated.
+
+    With several DataLoader workers, worker i reads the games i, i+n, i+2n...
+    so every game is read exactly once per epoch.
+    """
+
+    def __init__(self, paths, len_inpout_seq, shuffle=False, block_games=64):
+        """
+        Parameters:
+        - paths (str or list): HDF5 file(s).
+        - len_inpout_seq (int): Length of the input sequences.
+        - shuffle (bool): Shuffles the games of every worker, and the samples
+          across blocks of block_games games (seeded by the torch RNG, so
+          every epoch and every worker gets its own order).
+        - block_games (int): Games whose samples are mixed together when shuffling.
+        """
+        import h5py
+
+        self.paths=[paths] if isinstance(paths, str) else list(paths)
+        self.len_inpout_seq=len_inpout_seq
+        self.shuffle=shuffle
+        self.block_games=block_games
+
+        # Only the move labels are read here, one slab at a time
+        files=[]
+        games=[]
+        self.nb_samples=0
+        for file_index, path in enumerate(self.paths):
+            with h5py.File(path, 'r') as f:
+                moves=f['moves']
+                for start in range(0, moves.shape[0], 65536):
+                    played=moves[start:start+65536] >= 0
+                    games.append(start+np.flatnonzero(played.any(axis=1)))
+                    files.append(np.full(len(games[-1]), file_index, dtype=np.int32))
+                    self.nb_samples+=int(played.sum())
+        self.game_files=np.concatenate(files) if files else np.empty(0, dtype=np.int32)
+        self.game_indexes=np.concatenate(games) if games else np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.nb_samples
+
+    def __iter__(self):
+        import h5py
+
+        order=np.arange(len(self.game_indexes))
+        worker=get_worker_info()
+        if worker is not None:
+            order=order[worker.id::worker.num_workers]
+        rng=None
+        if self.shuffle:
+            rng=np.random.default_rng(int(torch.empty((), dtype=torch.int64).random_()))
+            rng.shuffle(order)
+
+        files={}
+        try:
+            for start in range(0, len(order), self.block_games):
+                samples=[]
+                for game in order[start:start+self.block_games]:
+                    file_index=self.game_files[game]
+                    if file_index not in files:
+                        files[file_index]=h5py.File(self.paths[file_index], 'r')
+                    samples.extend(self._game_samples(files[file_index], self.game_indexes[game]))
+                if rng is not None:
+                    samples=[samples[i] for i in rng.permutation(len(samples))]
+                yield from samples
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _game_samples(self, f, game):
+        pad=self.len_inpout_seq-1
+        boards=f['boards'][game]
+        players=f['players'][game]
+        moves=f['moves'][game]
+
+        padded=np.empty((pad+len(boards),)+boards.shape[1:], dtype=np.int8)
+        padded[:pad]=INITIAL_BOARD
+        padded[pad:]=boards
+        #if black is the current player the board should be multiplay by -1
+        perspectives={1: padded, -1: -padded}
+
+        samples=[]
+        for ply in np.flatnonzero(moves >= 0):
+            input_seq=perspectives[int(players[ply])][ply:ply+self.len_inpout_seq]
+            samples.append((input_seq, MOVE_LABELS[moves[ply]], min(ply+1, self.len_inpout_seq)))
+        return samples
+
+
+# Activations of the conf by name, "Linear" is no activation
+ACTIVATIONS={
+    "ReLU": nn.ReLU,
+    "Sigmoid": nn.Sigmoid,
+    "Tanh": nn.Tanh,
+    "Leaky ReLU": nn.LeakyReLU,
+}
+
+
+def layer_dims(layer_conf):
+    ''' Method: layer_dims
+        Parameters: layer_conf (dict, hidden_dim_1..hidden_dim_5, "" after the last layer)
+        Returns: list of int, the sizes of the hidden layers
+    '''
+    dims=[]
+    for i in range(1, 6):
+        if layer_conf[f"hidden_dim_{i}"] == "":
+            break
+        dims.append(int(layer_conf[f"hidden_dim_{i}"]))
+    return dims
+
+
+class MoveHead(nn.Sequential):
+    """
+    Fully connected stack from the features of a trunk to the 64 move scores.
+
+    With trunk features of size hidden_dims[0], the stack is
+    activation 1, lin2 (hidden_dims[0] -> hidden_dims[1]), activation 2, ...
+    and a last linear layer to board_size*board_size, the layers and
+    activations of the conf, resolved once here: "Linear" activations are
+    left out of the stack. Layers keep the names lin2, lin3... of the
+    checkpoints (act1, act2... for the activations).
+    """
+
+    def __init__(self, hidden_dims, activations, nb_outputs=64):
+        super(MoveHead, self).__init__()
+        dims=list(hidden_dims)+[nb_outputs]
+        for i in range(1, len(dims)):
+            activation=activations[i-1]
+            if activation != "Linear":
+                if activation not in ACTIVATIONS:
+                    raise ValueError(f"Unknown activation function {activation!r} (layer {i})")
+                self.add_module(f"act{i}", ACTIVATIONS[activation]())
+            self.add_module(f"lin{i+1}", nn.Linear(dims[i-1], dims[i]))
+
+    @classmethod
+    def from_modules(cls, model):
+        ''' Method: from_modules
+            Parameters: model (nn.Module with lin2.. and act_function1.. attributes,
+                        pickled before the head existed)
+            Returns: MoveHead made of the model's own layers, same weights and outputs
+        '''
+        head=cls.__new__(cls)
+        nn.Sequential.__init__(head)
+        i=1
+        while f"lin{i+1}" in model._modules:
+            activation=model.activation_function1 if i == 1 else getattr(model, f"activation_function{i}")
+            if activation != "Linear":
+                head.add_module(f"act{i}", model._modules[f"act_function{i}"])
+            head.add_module(f"lin{i+1}", model._modules.pop(f"lin{i+1}"))
+            i+=1
+        for name in [name for name in model._modules if name.startswith("act_function")]:
+            del model._modules[name]
+        return head
+
+
+def _upgrade_head(model, state):
+    # Checkpoints pickled with the lin2.. layers directly on the model
+    nn.Module.__setstate__(model, state)
+    if "head" not in model._modules:
+        model.head=MoveHead.from_modules(model)
+
+
 class MLP(nn.Module):
     def __init__(self, conf):
         """
@@ -41,94 +496,16 @@ class MLP(nn.Module):
         self.path_save=conf["path_save"]
         self.earlyStopping=conf["earlyStopping"]
         self.len_inpout_seq=conf["len_inpout_seq"]
-        self.hidden_dim_1=conf["MLP_conf"]["hidden_dim_1"]
-        self.hidden_dim_2=conf["MLP_conf"]["hidden_dim_2"]
-        self.hidden_dim_3=conf["MLP_conf"]["hidden_dim_3"]
-        self.hidden_dim_4=conf["MLP_conf"]["hidden_dim_4"]
-        self.hidden_dim_5=conf["MLP_conf"]["hidden_dim_5"]
-        self.activation_function1=conf["activation_function1"]
-        self.activation_function2=conf["activation_function2"]
-        self.activation_function3=conf["activation_function3"]
-        self.activation_function4=conf["activation_function4"]
-        self.activation_function5=conf["activation_function5"]
-
-
-
-        # Define the layers of the MLP
-        if (self.activation_function1 == "ReLU"):
-            self.act_function1 = nn.ReLU()
-        elif (self.activation_function1 == "Sigmoid"):
-            self.act_function1 = nn.Sigmoid()
-        elif (self.activation_function1 == "Tanh"):
-            self.act_function1 = nn.Tanh()
-        elif (self.activation_function1 == "Leaky ReLU"):
-            self.act_function1 = nn.LeakyReLU()
-        if (self.activation_function2 == "ReLU"):
-            self.act_function2 = nn.ReLU()
-        elif (self.activation_function2 == "Sigmoid"):
-            self.act_function2 = nn.Sigmoid()
-        elif (self.activation_function2 == "Tanh"):
-            self.act_function2 = nn.Tanh()
-        elif (self.activation_function2 == "Leaky ReLU"):
-            self.act_function2 = nn.LeakyReLU()
-        if (self.activation_function3 == "ReLU"):
-            self.act_function3 = nn.ReLU()
-        elif (self.activation_function3 == "Sigmoid"):
-            self.act_function3 = nn.Sigmoid()
-        elif (self.activation_function3 == "Tanh"):
-            self.act_function3 = nn.Tanh()
-        elif (self.activation_function3 == "Leaky ReLU"):
-            self.act_function3 = nn.LeakyReLU()
-        if (self.activation_function4 == "ReLU"):
-            self.act_function4 = nn.ReLU()
-        elif (self.activation_function4 == "Sigmoid"):
-            self.act_function4 = nn.Sigmoid()
-        elif (self.activation_function4 == "Tanh"):
-            self.act_function4 = nn.Tanh()
-        elif (self.activation_function4 == "Leaky ReLU"):
-            self.act_function4 = nn.LeakyReLU()
-        if (self.activation_function5 == "ReLU"):
-            self.act_function5 = nn.ReLU()
-        elif (self.activation_function5 == "Sigmoid"):
-            self.act_function5 = nn.Sigmoid()
-        elif (self.activation_function5 == "Tanh"):
-            self.act_function5 = nn.Tanh()
-        elif (self.activation_function5 == "Leaky ReLU"):
-            self.act_function5 = nn.LeakyReLU()
-
-        self.hidden_dim_1 = int(self.hidden_dim_1)
-        self.lin1 = nn.Linear(self.board_size*self.board_size, self.hidden_dim_1)
-        if (self.hidden_dim_2 == ""):
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.board_size*self.board_size)
-        elif (self.hidden_dim_3 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.board_size*self.board_size)
-        elif (self.hidden_dim_4 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.board_size*self.board_size)
-        elif (self.hidden_dim_5 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.hidden_dim_4 = int(self.hidden_dim_4)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.hidden_dim_4)
-            self.lin5 = nn.Linear(self.hidden_dim_4, self.board_size*self.board_size)
-        else:
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.hidden_dim_4 = int(self.hidden_dim_4)
-            self.hidden_dim_5 = int(self.hidden_dim_5)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.hidden_dim_4)
-            self.lin5 = nn.Linear(self.hidden_dim_4, self.hidden_dim_5)
-            self.lin6 = nn.Linear(self.hidden_dim_5, self.board_size*self.board_size)
+        self.training_conf=conf.get("training", {})
+        hidden_dims=layer_dims(conf["MLP_conf"])
+        activations=[conf[f"activation_function{i}"] for i in range(1, 6)]
+
+        self.lin1 = nn.Linear(self.board_size*self.board_size, hidden_dims[0])
+        self.head = MoveHead(hidden_dims, activations, self.board_size*self.board_size)
         self.dropout = nn.Dropout(p=conf["dropout"])
+
+    def __setstate__(self, state):
+        _upgrade_head(self, state)
         
     def forward(self, seq):
         """
@@ -146,160 +523,16 @@ class MLP(nn.Module):
         else:
             seq=torch.flatten(seq, start_dim=0)
         x = self.lin1(seq)
-        if (self.activation_function1 != "Linear"):
-            x = self.act_function1(x)
-        x = self.lin2(x)
-    
-        if (self.hidden_dim_2 == ""):
-            outp = x
-        elif (self.hidden_dim_3 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            outp = self.lin3(x)
-        elif (self.hidden_dim_4 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            outp = self.lin4(x)
-        elif (self.hidden_dim_5 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            x = self.lin4(x)
-            if (self.activation_function4 != "Linear"):
-                x = self.act_function4(x)
-            outp = self.lin5(x)
-        else:
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            x = self.lin4(x)
-            if (self.activation_function4 != "Linear"):
-                x = self.act_function4(x)
-            x = self.lin5(x)
-            if (self.activation_function5 != "Linear"):
-                x = self.act_function5(x)
-            outp = self.lin6(x)
+        outp = self.head(x)
         
         return F.softmax(outp, dim=-1)
     
     def train_all(self, train, dev, num_epoch, device, optimizer):
-        if not os.path.exists(f"{self.path_save}"):
-            os.mkdir(f"{self.path_save}")
-        best_dev = 0.0
-        dev_epoch = 0
-        notchange=0 # to manage earlystopping
-        train_acc_list=[]
-        dev_acc_list=[]
-        torch.autograd.set_detect_anomaly(True)
-        init_time=time.time()
-        for epoch in range(1, num_epoch+1):
-            start_time=time.time()
-            loss = 0.0
-            nb_batch =  0
-            loss_batch = 0
-            for batch, labels, _ in tqdm(train):
-                outputs =self(batch.float().to(device))
-                loss = loss_fnc(outputs,labels.clone().detach().float().to(device))
-                loss.backward()
-                optimizer.step()
-                optimizer.zero_grad()
-                nb_batch += 1
-                loss_batch += loss.item()
-            print("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
-                  str(loss_batch/nb_batch))
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
-                  str(loss_batch/nb_batch))
-            f.write("\n")
-            f.close()
-            last_training=time.time()-start_time
-
-            self.eval()
-            
-            train_clas_rep=self.evalulate(train, device)
-            acc_train=train_clas_rep["weighted avg"]["recall"] # type: ignore
-            train_acc_list.append(acc_train)
-            
-            dev_clas_rep=self.evalulate(dev, device)
-            acc_dev=dev_clas_rep["weighted avg"]["recall"] # type: ignore
-            dev_acc_list.append(acc_dev)
-            
-            last_prediction=time.time()-last_training-start_time
-            
-            print(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {round(100*acc_dev,2)}% ;", # type: ignore
-                  f"Time: {round(time.time()-init_time)}",
-                  f"(last_train: {round(last_training)}sec, last_pred: {round(last_prediction)}sec)")
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {round(100*acc_dev,2)}% ;" + # type: ignore
-                  f" Time: {round(time.time()-init_time)}" +
-                  f" (last_train: {round(last_training)}sec, last_pred: {round(last_prediction)}sec)")
-            f.write("\n")
-            f.close()
-
-            if acc_dev > best_dev or best_dev == 0.0:
-                notchange=0
-                for filename in os.listdir(self.path_save):
-                    os.remove(self.path_save+'/'+filename)
-                torch.save(self, self.path_save + '/model_' + str(epoch) + '.pt')
-                best_dev = acc_dev
-                best_epoch = epoch
-            else:
-                notchange+=1
-                if notchange>self.earlyStopping:
-                    break
-                
-            self.train()
-            
-            print("*"*15,f"The best score on DEV {best_epoch}: {round(100*best_dev,3)}%") # type: ignore
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write("*"*15 + f" The best score on DEV {best_epoch}: {round(100*best_dev,3)}%") # type: ignore
-            f.write("\n")
-            f.close()
-
-        self = torch.load(self.path_save + '/model_' + str(best_epoch) + '.pt')
-        self.eval()
-        _clas_rep = self.evalulate(dev, device)
-        print(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
-        f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-        f.write(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
-        f.write("\n")
-        f.close()
-        f = open(f'{self.path_save} description.txt', 'a', encoding='utf-8')
-        f.write(f"{100*_clas_rep['weighted avg']['recall']}%")
-        f.close()
-
-        
-        return best_epoch
+        return train_model(self, train, dev, num_epoch, device, optimizer)
     
     
     def evalulate(self,test_loader, device):
-        
-        all_predicts=[]
-        all_targets=[]
-        
-        for data, target,_ in tqdm(test_loader):
-            output = self(data.float().to(device))
-            predicted=output.argmax(dim=-1).cpu().detach().numpy()
-            target=target.argmax(dim=-1).numpy()
-            for i in range(len(predicted)):
-                all_predicts.append(predicted[i])
-                all_targets.append(target[i])
-                           
-        perf_rep=classification_report(all_targets,
-                                      all_predicts,
-                                      zero_division=1,
-                                      digits=4,
-                                      output_dict=True)
-        perf_rep=classification_report(all_targets,all_predicts,zero_division=1,digits=4,output_dict=True)
-        
-        return perf_rep
+        return evaluate_model(self, test_loader, device)
     
     
 
@@ -317,94 +550,18 @@ class LSTMs(nn.Module):
         self.path_save=conf["path_save"]
         self.earlyStopping=conf["earlyStopping"]
         self.len_inpout_seq=conf["len_inpout_seq"]
-        self.hidden_dim_1=conf["LSTM_conf"]["hidden_dim_1"]
-        self.hidden_dim_2=conf["LSTM_conf"]["hidden_dim_2"]
-        self.hidden_dim_3=conf["LSTM_conf"]["hidden_dim_3"]
-        self.hidden_dim_4=conf["LSTM_conf"]["hidden_dim_4"]
-        self.hidden_dim_5=conf["LSTM_conf"]["hidden_dim_5"]
-        self.activation_function1=conf["activation_function1"]
-        self.activation_function2=conf["activation_function2"]
-        self.activation_function3=conf["activation_function3"]
-        self.activation_function4=conf["activation_function4"]
-        self.activation_function5=conf["activation_function5"]
-
-        # Define the layers of the LSTM model
-        if (self.activation_function1 == "ReLU"):
-            self.act_function1 = nn.ReLU()
-        elif (self.activation_function1 == "Sigmoid"):
-            self.act_function1 = nn.Sigmoid()
-        elif (self.activation_function1 == "Tanh"):
-            self.act_function1 = nn.Tanh()
-        elif (self.activation_function1 == "Leaky ReLU"):
-            self.act_function1 = nn.LeakyReLU()
-        if (self.activation_function2 == "ReLU"):
-            self.act_function2 = nn.ReLU()
-        elif (self.activation_function2 == "Sigmoid"):
-            self.act_function2 = nn.Sigmoid()
-        elif (self.activation_function2 == "Tanh"):
-            self.act_function2 = nn.Tanh()
-        elif (self.activation_function2 == "Leaky ReLU"):
-            self.act_function2 = nn.LeakyReLU()
-        if (self.activation_function3 == "ReLU"):
-            self.act_function3 = nn.ReLU()
-        elif (self.activation_function3 == "Sigmoid"):
-            self.act_function3 = nn.Sigmoid()
-        elif (self.activation_function3 == "Tanh"):
-            self.act_function3 = nn.Tanh()
-        elif (self.activation_function3 == "Leaky ReLU"):
-            self.act_function3 = nn.LeakyReLU()
-        if (self.activation_function4 == "ReLU"):
-            self.act_function4 = nn.ReLU()
-        elif (self.activation_function4 == "Sigmoid"):
-            self.act_function4 = nn.Sigmoid()
-        elif (self.activation_function4 == "Tanh"):
-            self.act_function4 = nn.Tanh()
-        elif (self.activation_function4 == "Leaky ReLU"):
-            self.act_function4 = nn.LeakyReLU()
-        if (self.activation_function5 == "ReLU"):
-            self.act_function5 = nn.ReLU()
-        elif (self.activation_function5 == "Sigmoid"):
-            self.act_function5 = nn.Sigmoid()
-        elif (self.activation_function5 == "Tanh"):
-            self.act_function5 = nn.Tanh()
-        elif (self.activation_function5 == "Leaky ReLU"):
-            self.act_function5 = nn.LeakyReLU()
-
-        self.hidden_dim_1 = int(self.hidden_dim_1)
-        self.lstm = nn.LSTM(self.board_size*self.board_size, self.hidden_dim_1, batch_first=True)
+        self.training_conf=conf.get("training", {})
+        hidden_dims=layer_dims(conf["LSTM_conf"])
+        activations=[conf[f"activation_function{i}"] for i in range(1, 6)]
+
+        self.lstm = nn.LSTM(self.board_size*self.board_size, hidden_dims[0], batch_first=True)
         
-        if (self.hidden_dim_2 == ""):
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.board_size*self.board_size)
-        elif (self.hidden_dim_3 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.board_size*self.board_size)
-        elif (self.hidden_dim_4 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.board_size*self.board_size)
-        elif (self.hidden_dim_5 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.hidden_dim_4 = int(self.hidden_dim_4)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.hidden_dim_4)
-            self.lin5 = nn.Linear(self.hidden_dim_4, self.board_size*self.board_size)
-        else:
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.hidden_dim_4 = int(self.hidden_dim_4)
-            self.hidden_dim_5 = int(self.hidden_dim_5)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.hidden_dim_4)
-            self.lin5 = nn.Linear(self.hidden_dim_4, self.hidden_dim_5)
-            self.lin6 = nn.Linear(self.hidden_dim_5, self.board_size*self.board_size)
+        self.head = MoveHead(hidden_dims, activations, self.board_size*self.board_size)
         self.dropout = nn.Dropout(p=conf["dropout"])
 
+    def __setstate__(self, state):
+        _upgrade_head(self, state)
+
     def forward(self, seq):
         """
         Forward pass of the LSTM model.
@@ -427,55 +584,11 @@ class LSTMs(nn.Module):
         #(lstm_out[:,-1,:] pass only last vector of output sequence)
         if len(seq.shape)>2: # to manage the batch of sample
             # Training phase where input is batch of seq
-            if (self.activation_function1 != "Linear"):
-                x = self.act_function1(x[:,-1,:])
-                x = self.lin2(x)
-            else:
-                x = self.lin2(x[:,-1,:])
+            x = x[:,-1,:]
         else:
             # Prediction phase where input is a single seq
-            if (self.activation_function1 != "Linear"):
-                x = self.act_function1(x[-1,:])
-                x = self.lin2(x)
-            else:
-                x = self.lin2(x[-1,:])
-        
-        if (self.hidden_dim_2 == ""):
-            outp = x
-        elif (self.hidden_dim_3 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            outp = self.lin3(x)
-        elif (self.hidden_dim_4 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            outp = self.lin4(x)
-        elif (self.hidden_dim_5 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            x = self.lin4(x)
-            if (self.activation_function4 != "Linear"):
-                x = self.act_function4(x)
-            outp = self.lin5(x)
-        else:
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            x = self.lin4(x)
-            if (self.activation_function4 != "Linear"):
-                x = self.act_function4(x)
-            x = self.lin5(x)
-            if (self.activation_function5 != "Linear"):
-                x = self.act_function5(x)
-            outp = self.lin6(x)
+            x = x[-1,:]
+        outp = self.head(x)
 
         if len(seq.shape)>2:
             outp = F.softmax(outp, dim=1).squeeze()
@@ -486,114 +599,11 @@ class LSTMs(nn.Module):
         return outp
     
     def train_all(self, train, dev, num_epoch, device, optimizer):
-        if not os.path.exists(f"{self.path_save}"):
-            os.mkdir(f"{self.path_save}")
-        best_dev = 0.0
-        dev_epoch = 0
-        notchange=0
-        train_acc_list=[]
-        dev_acc_list=[]
-        torch.autograd.set_detect_anomaly(True)
-        init_time=time.time()
-        for epoch in range(1, num_epoch+1):
-            start_time=time.time()
-            loss = 0.0
-            nb_batch =  0
-            loss_batch = 0
-            for batch, labels, _ in tqdm(train):
-                outputs =self(batch.float().to(device))
-                loss = loss_fnc(outputs,labels.clone().detach().float().to(device))
-                loss.backward()
-                optimizer.step()
-                optimizer.zero_grad()
-                nb_batch += 1
-                loss_batch += loss.item()
-            print("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
-                  str(loss_batch/nb_batch))
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
-                  str(loss_batch/nb_batch))
-            f.write("\n")
-            f.close()
-            last_training=time.time()-start_time
-
-            self.eval()
-            
-            train_clas_rep=self.evalulate(train, device)
-            acc_train=train_clas_rep["weighted avg"]["recall"] # type: ignore
-            train_acc_list.append(acc_train)
-            
-            dev_clas_rep=self.evalulate(dev, device)
-            acc_dev=dev_clas_rep["weighted avg"]["recall"] # type: ignore
-            dev_acc_list.append(acc_dev)
-            
-            last_prediction=time.time()-last_training-start_time
-            
-            print(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {round(100*acc_dev,2)}% ;", # type: ignore
-                  f"Time: {round(time.time()-init_time)}",
-                  f"(last_train: {round(last_training)}, last_pred: {round(last_prediction)})")
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {round(100*acc_dev,2)}% ; Time: {round(time.time()-init_time)} (last_train: {round(last_training)}, last_pred: {round(last_prediction)})") # type: ignore
-            f.write("\n")
-            f.close()
-
-            if acc_dev > best_dev or best_dev == 0.0:
-                notchange=0
-                for filename in os.listdir(self.path_save):
-                    os.remove(self.path_save+'/'+filename)
-                torch.save(self, self.path_save + '/model_' + str(epoch) + '.pt')
-                best_dev = acc_dev
-                best_epoch = epoch
-            else:
-                notchange+=1
-                if notchange>self.earlyStopping:
-                    break
-                
-            self.train()
-            
-            print("*"*15,f"The best score on DEV {best_epoch}: {round(100*best_dev,3)}%") # type: ignore
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write("*"*15 + f" The best score on DEV {best_epoch}: {round(100*best_dev,3)}%") # type: ignore
-            f.write("\n")
-            f.close()
-
-        self = torch.load(self.path_save + '/model_' + str(best_epoch) + '.pt')
-        self.eval()
-        _clas_rep = self.evalulate(dev, device)
-        print(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
-        f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-        f.write(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
-        f.write("\n")
-        f.close()
-        f = open(f'{self.path_save} description.txt', 'a', encoding='utf-8')
-        f.write(f"{100*_clas_rep['weighted avg']['recall']}%")
-        f.close()
-
-        
-        return best_epoch
+        return train_model(self, train, dev, num_epoch, device, optimizer)
     
     
     def evalulate(self,test_loader, device):
-        
-        all_predicts=[]
-        all_targets=[]
-        
-        for data, target_array,lengths in tqdm(test_loader):
-            output = self(data.float().to(device))
-            predicted=output.argmax(dim=-1).cpu().clone().detach().numpy()
-            target=target_array.argmax(dim=-1).numpy()
-            for i in range(len(predicted)):
-                all_predicts.append(predicted[i])
-                all_targets.append(target[i])
-                           
-        perf_rep=classification_report(all_targets,
-                                      all_predicts,
-                                      zero_division=1,
-                                      digits=4,
-                                      output_dict=True)
-        perf_rep=classification_report(all_targets,all_predicts,zero_division=1,digits=4,output_dict=True)
-        
-        return perf_rep
+        return evaluate_model(self, test_loader, device)
         
 class CNN(nn.Module):
     def __init__(self, conf):
@@ -607,95 +617,17 @@ class CNN(nn.Module):
         self.path_save=conf["path_save"]
         self.earlyStopping=conf["earlyStopping"]
         self.len_inpout_seq=conf["len_inpout_seq"]
-        self.hidden_dim_1=conf["CNN_conf"]["hidden_dim_1"]
-        self.hidden_dim_2=conf["CNN_conf"]["hidden_dim_2"]
-        self.hidden_dim_3=conf["CNN_conf"]["hidden_dim_3"]
-        self.hidden_dim_4=conf["CNN_conf"]["hidden_dim_4"]
-        self.hidden_dim_5=conf["CNN_conf"]["hidden_dim_5"]
-        self.activation_function1=conf["activation_function1"]
-        self.activation_function2=conf["activation_function2"]
-        self.activation_function3=conf["activation_function3"]
-        self.activation_function4=conf["activation_function4"]
-        self.activation_function5=conf["activation_function5"]
-
-
-
-        # Define the layers of the CNN
-        if (self.activation_function1 == "ReLU"):
-            self.act_function1 = nn.ReLU()
-        elif (self.activation_function1 == "Sigmoid"):
-            self.act_function1 = nn.Sigmoid()
-        elif (self.activation_function1 == "Tanh"):
-            self.act_function1 = nn.Tanh()
-        elif (self.activation_function1 == "Leaky ReLU"):
-            self.act_function1 = nn.LeakyReLU()
-        if (self.activation_function2 == "ReLU"):
-            self.act_function2 = nn.ReLU()
-        elif (self.activation_function2 == "Sigmoid"):
-            self.act_function2 = nn.Sigmoid()
-        elif (self.activation_function2 == "Tanh"):
-            self.act_function2 = nn.Tanh()
-        elif (self.activation_function2 == "Leaky ReLU"):
-            self.act_function2 = nn.LeakyReLU()
-        if (self.activation_function3 == "ReLU"):
-            self.act_function3 = nn.ReLU()
-        elif (self.activation_function3 == "Sigmoid"):
-            self.act_function3 = nn.Sigmoid()
-        elif (self.activation_function3 == "Tanh"):
-            self.act_function3 = nn.Tanh()
-        elif (self.activation_function3 == "Leaky ReLU"):
-            self.act_function3 = nn.LeakyReLU()
-        if (self.activation_function4 == "ReLU"):
-            self.act_function4 = nn.ReLU()
-        elif (self.activation_function4 == "Sigmoid"):
-            self.act_function4 = nn.Sigmoid()
-        elif (self.activation_function4 == "Tanh"):
-            self.act_function4 = nn.Tanh()
-        elif (self.activation_function4 == "Leaky ReLU"):
-            self.act_function4 = nn.LeakyReLU()
-        if (self.activation_function5 == "ReLU"):
-            self.act_function5 = nn.ReLU()
-        elif (self.activation_function5 == "Sigmoid"):
-            self.act_function5 = nn.Sigmoid()
-        elif (self.activation_function5 == "Tanh"):
-            self.act_function5 = nn.Tanh()
-        elif (self.activation_function5 == "Leaky ReLU"):
-            self.act_function5 = nn.LeakyReLU()
-
-        self.hidden_dim_1 = int(self.hidden_dim_1)
-        self.lin1 = nn.Conv2d(self.board_size*self.board_size, self.hidden_dim_1, kernel_size=3)
+        self.training_conf=conf.get("training", {})
+        hidden_dims=layer_dims(conf["CNN_conf"])
+        activations=[conf[f"activation_function{i}"] for i in range(1, 6)]
+
+        self.lin1 = nn.Conv2d(self.board_size*self.board_size, hidden_dims[0], kernel_size=3)
         self.maxpool1 = nn.MaxPool2d(kernel_size=2, stride = 2)
-        if (self.hidden_dim_2 == ""):
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.board_size*self.board_size)
-        elif (self.hidden_dim_3 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.board_size*self.board_size)
-        elif (self.hidden_dim_4 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.board_size*self.board_size)
-        elif (self.hidden_dim_5 == ""):
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.hidden_dim_4 = int(self.hidden_dim_4)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.hidden_dim_4)
-            self.lin5 = nn.Linear(self.hidden_dim_4, self.board_size*self.board_size)
-        else:
-            self.hidden_dim_2 = int(self.hidden_dim_2)
-            self.hidden_dim_3 = int(self.hidden_dim_3)
-            self.hidden_dim_4 = int(self.hidden_dim_4)
-            self.hidden_dim_5 = int(self.hidden_dim_5)
-            self.lin2 = nn.Linear(self.hidden_dim_1, self.hidden_dim_2)
-            self.lin3 = nn.Linear(self.hidden_dim_2, self.hidden_dim_3)
-            self.lin4 = nn.Linear(self.hidden_dim_3, self.hidden_dim_4)
-            self.lin5 = nn.Linear(self.hidden_dim_4, self.hidden_dim_5)
-            self.lin6 = nn.Linear(self.hidden_dim_5, self.board_size*self.board_size)
+        self.head = MoveHead(hidden_dims, activations, self.board_size*self.board_size)
         self.dropout = nn.Dropout(p=conf["dropout"])
+
+    def __setstate__(self, state):
+        _upgrade_head(self, state)
         
     def forward(self, seq):
         """
@@ -714,157 +646,129 @@ class CNN(nn.Module):
             seq=torch.flatten(seq, start_dim=0)
         x = self.lin1(seq)
         x = self.maxpool1(x)
-        if (self.activation_function1 != "Linear"):
-            x = self.act_function1(x)
-        x = self.lin2(x)
-    
-        if (self.hidden_dim_2 == ""):
-            outp = x
-        elif (self.hidden_dim_3 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            outp = self.lin3(x)
-        elif (self.hidden_dim_4 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            outp = self.lin4(x)
-        elif (self.hidden_dim_5 == ""):
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            x = self.lin4(x)
-            if (self.activation_function4 != "Linear"):
-                x = self.act_function4(x)
-            outp = self.lin5(x)
-        else:
-            if (self.activation_function2 != "Linear"):
-                x = self.act_function2(x)
-            x = self.lin3(x)
-            if (self.activation_function3 != "Linear"):
-                x = self.act_function3(x)
-            x = self.lin4(x)
-            if (self.activation_function4 != "Linear"):
-                x = self.act_function4(x)
-            x = self.lin5(x)
-            if (self.activation_function5 != "Linear"):
-                x = self.act_function5(x)
-            outp = self.lin6(x)
+        outp = self.head(x)
         
         return F.softmax(outp, dim=-1)
     
     def train_all(self, train, dev, num_epoch, device, optimizer):
-        if not os.path.exists(f"{self.path_save}"):
-            os.mkdir(f"{self.path_save}")
-        best_dev = 0.0
-        dev_epoch = 0
-        notchange=0 # to manage earlystopping
-        train_acc_list=[]
-        dev_acc_list=[]
-        torch.autograd.set_detect_anomaly(True)
-        init_time=time.time()
-        for epoch in range(1, num_epoch+1):
-            start_time=time.time()
-            loss = 0.0
-            nb_batch =  0
-            loss_batch = 0
-            for batch, labels, _ in tqdm(train):
-                outputs =self(batch.float().to(device))
-                loss = loss_fnc(outputs,labels.clone().detach().float().to(device))
-                loss.backward()
-                optimizer.step()
-                optimizer.zero_grad()
-                nb_batch += 1
-                loss_batch += loss.item()
-            print("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
-                  str(loss_batch/nb_batch))
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write("epoch: " + str(epoch) + "/" + str(num_epoch) + ' - loss = '+\
-                  str(loss_batch/nb_batch))
-            f.write("\n")
-            f.close()
-            last_training=time.time()-start_time
+        return train_model(self, train, dev, num_epoch, device, optimizer)
+    
+    
+    def evalulate(self,test_loader, device):
+        return evaluate_model(self, test_loader, device)
 
-            self.eval()
-            
-            train_clas_rep=self.evalulate(train, device)
-            acc_train=train_clas_rep["weighted avg"]["recall"] # type: ignore
-            train_acc_list.append(acc_train)
-            
-            dev_clas_rep=self.evalulate(dev, device)
-            acc_dev=dev_clas_rep["weighted avg"]["recall"] # type: ignore
-            dev_acc_list.append(acc_dev)
-            
-            last_prediction=time.time()-last_training-start_time
-            
-            print(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {round(100*acc_dev,2)}% ;", # type: ignore
-                  f"Time: {round(time.time()-init_time)}",
-                  f"(last_train: {round(last_training)}sec, last_pred: {round(last_prediction)}sec)")
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write(f"Accuracy Train: {round(100*acc_train,2)}%, Dev: {round(100*acc_dev,2)}% ;" + # type: ignore
-                  f" Time: {round(time.time()-init_time)}" +
-                  f" (last_train: {round(last_training)}sec, last_pred: {round(last_prediction)}sec)")
-            f.write("\n")
-            f.close()
 
-            if acc_dev > best_dev or best_dev == 0.0:
-                notchange=0
-                for filename in os.listdir(self.path_save):
-                    os.remove(self.path_save+'/'+filename)
-                torch.save(self, self.path_save + '/model_' + str(epoch) + '.pt')
-                best_dev = acc_dev
-                best_epoch = epoch
-            else:
-                notchange+=1
-                if notchange>self.earlyStopping:
-                    break
-                
-            self.train()
-            
-            print("*"*15,f"The best score on DEV {best_epoch}: {round(100*best_dev,3)}%") # type: ignore
-            f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-            f.write("*"*15 + f" The best score on DEV {best_epoch}: {round(100*best_dev,3)}%") # type: ignore
-            f.write("\n")
-            f.close()
-
-        self = torch.load(self.path_save + '/model_' + str(best_epoch) + '.pt')
-        self.eval()
-        _clas_rep = self.evalulate(dev, device)
-        print(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
-        f = open(f'{self.path_save} logs.txt', 'a', encoding='utf-8')
-        f.write(f"Recalculing the best DEV: WAcc: {100*_clas_rep['weighted avg']['recall']}%")
-        f.write("\n")
-        f.close()
-        f = open(f'{self.path_save} description.txt', 'a', encoding='utf-8')
-        f.write(f"{100*_clas_rep['weighted avg']['recall']}%")
-        f.close()
+# (row, column) steps of the 8 directions a move can flip along
+DIRECTIONS=[(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def _shift(planes, d_row, d_col):
+    # shifted[..., r, c] = planes[..., r-d_row, c-d_col], 0 off the board
+    padded=F.pad(planes, (1, 1, 1, 1))
+    return padded[..., 1-d_row:9-d_row, 1-d_col:9-d_col]
+
+
+def board_planes(seq):
+    """
+    Encodes board sequences as stacked 8x8 planes.
+
+    The model inputs are seen by the side to move (1 its discs, -1 the
+    opponent's), every board of the sequence gives 4 planes: own discs,
+    opponent discs, empty squares and the legal moves of the own side on
+    that board.
+
+    Parameters:
+    - seq (torch.Tensor): Board sequences, shape (N, L, 8, 8).
+
+    Returns:
+    - torch.Tensor: float planes of shape (N, 4*L, 8, 8).
+    """
+    seq=seq.float()
+    own=(seq == 1).float()
+    opponent=(seq == -1).float()
+    empty=1-own-opponent
+    legal=torch.zeros_like(seq)
+    for d_row, d_col in DIRECTIONS:
+        # Runs of opponent discs starting next to an own disc
+        run=_shift(own, d_row, d_col)*opponent
+        for _ in range(5):
+            run=torch.maximum(run, _shift(run, d_row, d_col)*opponent)
+        legal=torch.maximum(legal, _shift(run, d_row, d_col)*empty)
+    planes=torch.stack([own, opponent, empty, legal], dim=2)
+    return planes.flatten(start_dim=1, end_dim=2)
+
+
+# Convolutions of BoardCNN when the conf has no BoardCNN_conf: a 1x1 layer
+# mixes the planes of the history into 8 channels, three 3x3 layers of 8
+# channels follow. About 0.24 MFLOPs per move with 5 boards of history, less
+# than CNN and the LSTM of Hard (see bench_flops.py)
+BOARD_CNN_DEFAULTS={"hidden_dim_1": 8, "hidden_dim_2": 8, "hidden_dim_3": 8, "hidden_dim_4": 8, "hidden_dim_5": "",
+                    "first_kernel_size": 1}
+
+
+class BoardCNN(nn.Module):
+    def __init__(self, conf):
+        """
+        Convolutional model on the 8x8 board planes for the Othello game.
+
+        The input sequence is encoded by board_planes (4 planes per board),
+        followed by padded 3x3 convolutions of hidden_dim_1.. channels (the
+        board stays 8x8) and a 1x1 convolution giving the score of every square.
+        The first convolution is first_kernel_size wide (3 when the conf does
+        not say): 1 mixes the planes of the history square by square, at a
+        fraction of the cost of a 3x3 layer.
+
+        Parameters:
+        - conf (dict): Configuration dictionary containing model parameters,
+          the channels of the convolutions in conf["BoardCNN_conf"]
+          (BOARD_CNN_DEFAULTS when it is missing).
+        """
+        super(BoardCNN, self).__init__()
+
+        self.board_size=conf["board_size"]
+        self.path_save=conf["path_save"]
+        self.earlyStopping=conf["earlyStopping"]
+        self.len_inpout_seq=conf["len_inpout_seq"]
+        self.training_conf=conf.get("training", {})
+        layer_conf=conf.get("BoardCNN_conf", BOARD_CNN_DEFAULTS)
+        channels=layer_dims(layer_conf)
+        activations=[conf[f"activation_function{i}"] for i in range(1, 6)]
+
+        layers=[]
+        in_channels=4*self.len_inpout_seq
+        for i, out_channels in enumerate(channels):
+            kernel_size=layer_conf.get("first_kernel_size", 3) if i == 0 else 3
+            layers.append(nn.Conv2d(in_channels, out_channels, kernel_size=kernel_size, padding=kernel_size//2))
+            if activations[i] != "Linear":
+                if activations[i] not in ACTIVATIONS:
+                    raise ValueError(f"Unknown activation function {activations[i]!r} (layer {i+1})")
+                layers.append(ACTIVATIONS[activations[i]]())
+            in_channels=out_channels
+        self.convs=nn.Sequential(*layers)
+        self.policy=nn.Conv2d(in_channels, 1, kernel_size=1)
+
+    def forward(self, seq):
+        """
+        Forward pass of the board CNN.
+
+        Parameters:
+        - seq (torch.Tensor): A series of board states (history), shape (L, 8, 8),
+          or a batch of them, shape (N, L, 8, 8).
+
+        Returns:
+        - torch.Tensor: Output probabilities after applying softmax, shape (64,)
+          or (N, 64).
+        """
+        single=seq.dim() == 3
+        if single:
+            seq=seq.unsqueeze(0)
+        x = self.convs(board_planes(seq))
+        outp = F.softmax(self.policy(x).flatten(start_dim=1), dim=-1)
+        return outp[0] if single else outp
+
+    def train_all(self, train, dev, num_epoch, device, optimizer):
+        return train_model(self, train, dev, num_epoch, device, optimizer)
+
 
-        
-        return best_epoch
-    
-    
     def evalulate(self,test_loader, device):
-        
-        all_predicts=[]
-        all_targets=[]
-        
-        for data, target,_ in tqdm(test_loader):
-            output = self(data.float().to(device))
-            predicted=output.argmax(dim=-1).cpu().detach().numpy()
-            target=target.argmax(dim=-1).numpy()
-            for i in range(len(predicted)):
-                all_predicts.append(predicted[i])
-                all_targets.append(target[i])
-                           
-        perf_rep=classification_report(all_targets,
-                                      all_predicts,
-                                      zero_division=1,
-                                      digits=4,
-                                      output_dict=True)
-        perf_rep=classification_report(all_targets,all_predicts,zero_division=1,digits=4,output_dict=True)
-        
-        return perf_rep
\ No newline at end of file
+        return evaluate_model(self, test_loader, device)
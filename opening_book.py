@@ -0,0 +1,337 @@
+import argparse
+import os
+import struct
+import threading
+
+import numpy as np
+
+from bitboard import GATHER_INDEX, SQUARE_MAPS, legal_moves_mask, masks_to_array, popcount
+from game_log import read_games, read_text_logs, replay
+
+# The book is looked up next to the models unless REVERSI_OPENING_BOOK says otherwise
+OPENING_BOOK=os.environ.get("REVERSI_OPENING_BOOK",
+                            os.path.join(os.environ.get("REVERSI_MODEL_DIR", os.path.dirname(os.path.abspath(__file__))),
+                                         "opening_book.bin"))
+
+MAGIC=b'RVOB'
+VERSION=1
+HEADER_SIZE=64
+# magic, version, max depth, number of slots, number of entries, min games
+HEADER_FORMAT='<4sHHIII'
+# One slot of the hash table, key 0 marks an empty slot. Positions are
+# stored in their canonical orientation (see canonical_positions), score is
+# the mean result of the move for the side to move (1 win, 0.5 draw, 0 loss)
+SLOT_DTYPE=np.dtype([('key', '<u8'),
+                     ('black', '<u8'),
+                     ('white', '<u8'),
+                     ('side', 'i1'),
+                     ('move', 'u1'),
+                     ('depth', 'u1'),
+                     ('games', '<u4'),
+                     ('score', '<f4')])
+
+# Moves into the game (discs on the board minus 4) up to which every
+# difficulty plays from the book: one depth for all ("12") or a list such as
+# "Hard:16,Medium:8,Easy:0", the difficulties it does not name use the whole book
+BOOK_DEPTH=os.environ.get("REVERSI_BOOK_DEPTH", "")
+
+
+def parse_depths(spec):
+    ''' Method: parse_depths
+        Parameters: spec (str), value of REVERSI_BOOK_DEPTH
+        Returns: dict of the depth of every named difficulty ('*' for all)
+    '''
+    depths={}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        player, _, depth=item.rpartition(':')
+        depths[player or '*']=int(depth)
+    return depths
+
+
+def _mix(x):
+    # splitmix64 finalizer, on numpy.uint64 arrays
+    with np.errstate(over='ignore'):
+        x=(x ^ (x >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        x=(x ^ (x >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def position_keys(black, white, side):
+    ''' Method: position_keys
+        Parameters: black, white (numpy.ndarray of numpy.uint64), side (numpy.ndarray, -1 or 1)
+        Returns: numpy.ndarray of non-zero numpy.uint64 hash keys
+    '''
+    with np.errstate(over='ignore'):
+        keys=_mix(black ^ _mix(white+np.uint64(0x9E3779B97F4A7C15)) ^ np.where(side == -1, np.uint64(0x5851F42D4C957F2D), np.uint64(0)))
+    return np.where(keys == 0, np.uint64(1), keys)
+
+
+def transformed_bitboards(masks):
+    ''' Method: transformed_bitboards
+        Parameters: masks (numpy.ndarray of N numpy.uint64 bitboards)
+        Returns: numpy.ndarray of shape (N, 8), the bitboards under the 8 symmetries
+    '''
+    flat=masks_to_array(masks).reshape(-1, 64)
+    images=flat[:, GATHER_INDEX]
+    return np.packbits(images, axis=-1, bitorder='little').view('<u8')[..., 0]
+
+
+def canonical_positions(black, white):
+    """
+    Canonical orientation of positions: among the 8 symmetric images of a
+    position, the one with the smallest black bitboard, then the smallest
+    white bitboard.
+
+    Parameters:
+    - black (numpy.ndarray): numpy.uint64 bitboards of Black.
+    - white (numpy.ndarray): numpy.uint64 bitboards of White.
+
+    Returns:
+    - tuple: (canonical black, canonical white, symmetry bringing every position to it).
+    """
+    blacks=transformed_bitboards(black)
+    whites=transformed_bitboards(white)
+    candidates=blacks == blacks.min(axis=1, keepdims=True)
+    symmetries=np.where(candidates, whites, np.uint64(0xFFFFFFFFFFFFFFFF)).argmin(axis=1)
+    rows=np.arange(len(symmetries))
+    return blacks[rows, symmetries], whites[rows, symmetries], symmetries
+
+
+def _popcounts(masks):
+    # popcount of every numpy.uint64 bitboard of an array
+    return masks_to_array(masks.reshape(-1)).sum(axis=(1, 2)).reshape(masks.shape)
+
+
+def build_book(moves, nb_moves, output, max_depth=20, min_games=4, players=None):
+    """
+    Mines games into an opening book file.
+
+    Every position of the first max_depth moves of the games is reduced to
+    its canonical orientation, so that rotated and reflected games add up.
+    The book keeps, for every position, the move with the best mean result
+    for the side to move among the moves played in at least min_games games.
+    The entries are written to an open-addressing hash table (linear
+    probing, at most half full) that OpeningBook maps into memory.
+
+    Parameters:
+    - moves (numpy.ndarray): Squares played, shape (N, MAX_MOVES) (see game_log).
+    - nb_moves (numpy.ndarray): Number of moves of every game.
+    - output (str): Path of the book file.
+    - max_depth (int): Moves into the game kept in the book.
+    - min_games (int): Games a move needs to be played in to enter the book.
+    - players (numpy.ndarray): Side (-1 Black, 1 White, 0 neither) whose moves
+      are mined in every game, both sides by default.
+
+    Returns:
+    - int: Number of positions in the book.
+    """
+    replayed=replay(moves, nb_moves)
+    black, white=replayed["black"], replayed["white"]
+    sides, squares=replayed["players"], replayed["moves"]
+    depth=_popcounts(black | white)-4
+    kept=(squares >= 0) & (depth < max_depth)
+    if players is not None:
+        kept&=sides == np.asarray(players)[:, None]
+    games, plies=np.nonzero(kept)
+    black, white, side=black[games, plies], white[games, plies], sides[games, plies].astype(np.int8)
+    black, white, symmetries=canonical_positions(black, white)
+    move=SQUARE_MAPS[symmetries, squares[games, plies]].astype(np.uint8)
+    results=np.sign(replayed["results"][games])*side*-1
+    points=(results+1)/2
+
+    moves_played=np.zeros(len(move), dtype=[('black', '<u8'), ('white', '<u8'), ('side', 'i1'), ('move', 'u1')])
+    moves_played['black'], moves_played['white'], moves_played['side'], moves_played['move']=black, white, side, move
+    unique, inverse, counts=np.unique(moves_played, return_inverse=True, return_counts=True)
+    scores=np.bincount(inverse.reshape(-1), weights=points, minlength=len(unique))/counts
+    enough=counts >= min_games
+    unique, counts, scores=unique[enough], counts[enough], scores[enough]
+    # Best move of every position: the last of its moves sorted by score, then games
+    order=np.lexsort((counts, scores, unique['side'], unique['white'], unique['black']))
+    unique, counts, scores=unique[order], counts[order], scores[order]
+    last=np.ones(len(unique), dtype=bool)
+    last[:-1]=(unique['black'][1:] != unique['black'][:-1]) | (unique['white'][1:] != unique['white'][:-1]) \
+        | (unique['side'][1:] != unique['side'][:-1])
+    entries, counts, scores=unique[last], counts[last], scores[last]
+
+    nb_slots=1 << max(int(np.ceil(np.log2(max(2*len(entries), 1)))), 4)
+    slots=np.zeros(nb_slots, dtype=SLOT_DTYPE)
+    keys=position_keys(entries['black'], entries['white'], entries['side'])
+    entry_depth=_popcounts(entries['black'] | entries['white'])-4
+    for i, key in enumerate(keys):
+        slot=int(key) & (nb_slots-1)
+        while slots['key'][slot] != 0:
+            slot=(slot+1) & (nb_slots-1)
+        slots[slot]=(key, entries['black'][i], entries['white'][i], entries['side'][i], entries['move'][i],
+                     entry_depth[i], counts[i], scores[i])
+    with open(output, 'wb') as f:
+        header=struct.pack(HEADER_FORMAT, MAGIC, VERSION, max_depth, nb_slots, len(entries), min_games)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(slots.tobytes())
+    return len(entries)
+
+
+def read_book_header(path):
+    ''' Method: read_book_header
+        Parameters: path (str)
+        Returns: dict of the header fields
+        Does: Reads and checks the header of an opening book.
+    '''
+    with open(path, 'rb') as f:
+        magic, version, max_depth, nb_slots, nb_entries, min_games=struct.unpack_from(HEADER_FORMAT, f.read(HEADER_SIZE))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} opening book")
+    return {"max_depth": max_depth, "nb_slots": nb_slots, "nb_entries": nb_entries, "min_games": min_games}
+
+
+class OpeningBook:
+    """
+    Memory-mapped opening book of build_book.
+
+    A lookup brings the position to its canonical orientation, probes the
+    hash table and maps the book move back to the orientation of the game:
+    a handful of numpy operations, without the models. Every difficulty
+    plays from the book up to its depth (REVERSI_BOOK_DEPTH) and has its
+    own hit and miss counters.
+    """
+
+    def __init__(self, path=OPENING_BOOK, depths=None):
+        self.path=path
+        self.header=read_book_header(path)
+        self.slots=np.memmap(path, dtype=SLOT_DTYPE, mode='r', offset=HEADER_SIZE, shape=(self.header["nb_slots"],))
+        self.depths=parse_depths(BOOK_DEPTH) if depths is None else depths
+        self.stats={}
+        self.lock=threading.Lock()
+
+    def depth_of(self, player):
+        return self.depths.get(player, self.depths.get('*', self.header["max_depth"]))
+
+    def probe(self, black, white, side):
+        ''' Method: probe
+            Parameters: black, white (int bitboards), side (int, -1 Black, 1 White)
+            Returns: numpy record of SLOT_DTYPE with the move in the orientation
+                     of the query, or None when the position is not in the book
+        '''
+        canonical_black, canonical_white, symmetries=canonical_positions(np.array([black], dtype=np.uint64),
+                                                                         np.array([white], dtype=np.uint64))
+        key=int(position_keys(canonical_black, canonical_white, np.array([side]))[0])
+        mask=self.header["nb_slots"]-1
+        slot=key & mask
+        while True:
+            entry=self.slots[slot]
+            if entry['key'] == 0:
+                return None
+            if entry['key'] == key and entry['black'] == canonical_black[0] and entry['white'] == canonical_white[0] \
+                    and entry['side'] == side:
+                entry=entry.copy()
+                entry['move']=GATHER_INDEX[symmetries[0], entry['move']]
+                return entry
+            slot=(slot+1) & mask
+
+    def lookup(self, player, black, white, side):
+        """
+        Book move of a difficulty in a position.
+
+        Parameters:
+        - player (str): Difficulty.
+        - black (int): Bitboard of Black.
+        - white (int): Bitboard of White.
+        - side (int): Side to move (-1 Black, 1 White).
+
+        Returns:
+        - int: Square of the book move, None when the position is deeper than the
+          difficulty's depth or not in the book (the caller asks the model).
+          Only the positions within the depth count as hits or misses.
+        """
+        if popcount(black | white)-4 >= self.depth_of(player):
+            return None
+        entry=self.probe(black, white, side)
+        own, opp=(black, white) if side == -1 else (white, black)
+        move=None
+        if entry is not None and legal_moves_mask(own, opp) >> int(entry['move']) & 1:
+            move=int(entry['move'])
+        with self.lock:
+            stats=self.stats.setdefault(player, {"hits": 0, "misses": 0})
+            stats["hits" if move is not None else "misses"]+=1
+        return move
+
+    def metrics(self):
+        """
+        Returns the counters of every difficulty.
+
+        Returns:
+        - dict: For each difficulty, hits, misses, hit rate and book depth.
+        """
+        with self.lock:
+            report={}
+            for player, stats in self.stats.items():
+                lookups=stats["hits"]+stats["misses"]
+                report[player]=dict(stats,
+                                    hit_rate=stats["hits"]/lookups if lookups else 0.0,
+                                    depth=self.depth_of(player))
+            return report
+
+
+def load_opening_book(path=OPENING_BOOK):
+    ''' Method: load_opening_book
+        Parameters: path (str)
+        Returns: OpeningBook, None when there is no book at path
+    '''
+    if not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def load_games(paths, player=None):
+    ''' Method: load_games
+        Parameters: paths (list of binary logs and moves.txt text logs), player (str,
+                    mines only the moves of this player, binary logs only)
+        Returns: tuple (moves, nb_moves, sides mined in every game or None)
+    '''
+    moves, nb_moves, sides=[], [], []
+    for path in paths:
+        try:
+            names, records=read_games(path)
+        except (ValueError, struct.error):
+            if player is not None:
+                raise ValueError(f"{path} is a text log, without player names")
+            text_moves, text_nb_moves=read_text_logs([path])
+            moves.append(text_moves)
+            nb_moves.append(text_nb_moves)
+            continue
+        moves.append(np.asarray(records['moves']))
+        nb_moves.append(np.asarray(records['nb_moves'], dtype=np.int64))
+        if player is not None:
+            player_id=names.index(player) if player in names else -1
+            sides.append(np.where(records['black'] == player_id, -1, np.where(records['white'] == player_id, 1, 0)))
+    return np.concatenate(moves), np.concatenate(nb_moves), np.concatenate(sides) if player is not None else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Opening books mined from game logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a book from binary game logs or moves.txt text logs")
+    build.add_argument("logs", nargs="+")
+    build.add_argument("-o", "--output", default=OPENING_BOOK)
+    build.add_argument("--depth", type=int, default=20, help="Moves into the game kept in the book")
+    build.add_argument("--min-games", type=int, default=4, help="Games a move needs to enter the book")
+    build.add_argument("--player", help="Only mine the moves of this player")
+    info = commands.add_parser("info", help="Summarize a book")
+    info.add_argument("book", nargs="?", default=OPENING_BOOK)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        moves, nb_moves, sides = load_games(args.logs, args.player)
+        nb_entries = build_book(moves, nb_moves, args.output, args.depth, args.min_games, sides)
+        print(f"{nb_entries} positions from {len(moves)} games written to {args.output} "
+              f"({os.path.getsize(args.output)/1024:.0f} KB)")
+    else:
+        header = read_book_header(args.book)
+        slots = np.memmap(args.book, dtype=SLOT_DTYPE, mode='r', offset=HEADER_SIZE, shape=(header["nb_slots"],))
+        used = slots[slots['key'] != 0]
+        print(f"{header['nb_entries']} positions in {header['nb_slots']} slots, depth {header['max_depth']}, "
+              f"at least {header['min_games']} games per move")
+        for depth in range(header["max_depth"]):
+            at_depth = used[used['depth'] == depth]
+            if len(at_depth):
+                print(f"  move {depth+1:2d}: {len(at_depth):7d} positions, {int(at_depth['games'].sum()):8d} games, "
+                      f"mean score {at_depth['score'].mean():.3f}")
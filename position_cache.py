@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from bitboard import INVERSE
+from symmetry import transform
+from zobrist import window_keys
+
+# Entries kept per difficulty (0 disables the cache)
+DEFAULT_CACHE_SIZE=int(os.environ.get("REVERSI_POSITION_CACHE_SIZE", 50000))
+# "0" keys the cache on the exact input sequence instead of its canonical form
+DEFAULT_USE_SYMMETRIES=os.environ.get("REVERSI_CACHE_SYMMETRIES", "1") != "0"
+
+
+class PositionCache:
+    """
+    LRU cache of model outputs, keyed by the Zobrist key of the input sequence.
+
+    With symmetries, the key of a sequence is the smallest of its keys under
+    the 8 symmetries of the board, and the output is stored transformed to
+    that canonical orientation: a rotated or reflected opening hits the entry
+    of the first one, and gets its output transformed back. The models are not
+    trained to be exactly symmetric, so a hit can differ slightly from what a
+    forward pass on this orientation would give.
+
+    Every difficulty has its own namespace of at most max_entries entries,
+    and its own hit and miss counters.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, use_symmetries=DEFAULT_USE_SYMMETRIES):
+        self.max_entries=max_entries
+        self.use_symmetries=use_symmetries
+        self.namespaces={}
+        self.stats={}
+        self.lock=threading.Lock()
+
+    def key(self, hashes, side):
+        """
+        Computes the cache key of a model input.
+
+        Parameters:
+        - hashes (numpy.ndarray): Board hashes of the input sequence (see BoardHistory.hash_window).
+        - side (int): Side to move (-1 Black, 1 White).
+
+        Returns:
+        - tuple: (key, symmetry bringing the input to its canonical orientation).
+        """
+        keys=window_keys(hashes, side)
+        if not self.use_symmetries:
+            return int(keys[0]), 0
+        symmetry=int(np.argmin(keys))
+        return int(keys[symmetry]), symmetry
+
+    def get(self, player, key, symmetry):
+        ''' Method: get
+            Parameters: player (str), key and symmetry (from PositionCache.key)
+            Returns: torch.Tensor of the 64 move probabilities in the orientation
+                     of the query, or None on a miss
+            Does: Looks a model input up and counts the hit or the miss.
+        '''
+        with self.lock:
+            entries=self.namespaces.setdefault(player, OrderedDict())
+            stats=self.stats.setdefault(player, {"hits": 0, "misses": 0})
+            move_prob=entries.get(key)
+            if move_prob is None:
+                stats["misses"]+=1
+                return None
+            entries.move_to_end(key)
+            stats["hits"]+=1
+        return transform(move_prob, INVERSE[symmetry])
+
+    def put(self, player, key, symmetry, move_prob):
+        ''' Method: put
+            Parameters: player (str), key and symmetry (from PositionCache.key),
+                        move_prob (torch.Tensor of 64 probabilities)
+            Returns: None
+            Does: Stores a model output, evicting the least recently used
+                  entries of the namespace.
+        '''
+        if self.max_entries <= 0:
+            return
+        canonical=transform(move_prob.reshape(64), symmetry)
+        with self.lock:
+            entries=self.namespaces.setdefault(player, OrderedDict())
+            entries[key]=canonical
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self, player=None):
+        with self.lock:
+            for name in [player] if player is not None else list(self.namespaces):
+                self.namespaces.pop(name, None)
+
+    def metrics(self):
+        """
+        Returns the counters of every difficulty.
+
+        Returns:
+        - dict: For each difficulty, hits, misses, hit rate and number of entries.
+        """
+        with self.lock:
+            report={}
+            for player, stats in self.stats.items():
+                lookups=stats["hits"]+stats["misses"]
+                report[player]=dict(stats,
+                                    hit_rate=stats["hits"]/lookups if lookups else 0.0,
+                                    entries=len(self.namespaces.get(player, ())))
+            return report
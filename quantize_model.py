@@ -0,0 +1,83 @@
+import argparse
+import os
+import tempfile
+import warnings
+
+import torch
+
+from bench_precision import forward_latency, held_out_positions, move_choices
+from export_models import export_model
+from model_registry import load_model, scripted_path
+
+
+def quantize_model(checkpoint, output=None, quantize_lstm=False, nb_positions=5000, log_path=None,
+                   batch_sizes=(1, 32)):
+    """
+    Builds the dynamic int8 serving artifact of a checkpoint and compares it
+    with the fp32 artifact.
+
+    The nn.Linear layers (lin2.. of the three model classes) are quantized to
+    int8 weights, activations are quantized on the fly. The artifact is the
+    TorchScript file model_registry serves for the difficulties set to int8
+    in REVERSI_PRECISION (Hard.int8.ts next to Hard.pt).
+
+    Parameters:
+    - checkpoint (str): Path of the .pt checkpoint.
+    - output (str): Path of the artifact (model_registry.scripted_path by default).
+    - quantize_lstm (bool): Also quantizes the nn.LSTM layers.
+    - nb_positions (int): Size of the held-out position set.
+    - log_path (str): Binary game log the positions are drawn from (random games by default).
+    - batch_sizes (tuple): Batch sizes of the latency measures.
+
+    Returns:
+    - dict: Path and size of both artifacts, move agreement on the held-out
+      positions and latencies (ms per forward pass) of both artifacts.
+    """
+    quantized_modules = (torch.nn.Linear, torch.nn.LSTM) if quantize_lstm else (torch.nn.Linear,)
+    with tempfile.TemporaryDirectory() as tmp_dir, warnings.catch_warnings():
+        # torch.jit and torch.ao.quantization deprecation notices
+        warnings.simplefilter("ignore")
+        reference_path = export_model(checkpoint, os.path.join(tmp_dir, os.path.basename(scripted_path(checkpoint))))
+        output = export_model(checkpoint, output, precision='int8', quantized_modules=quantized_modules)
+
+        device = torch.device('cpu')
+        reference = load_model(reference_path, device)
+        quantized = load_model(output, device, 'int8')
+        positions = held_out_positions(reference.len_inpout_seq, nb_positions, log_path)
+        expected = move_choices(reference, positions["inputs"], positions["legal"])
+        agreement = float((move_choices(quantized, positions["inputs"], positions["legal"]) == expected).mean())
+        report = {"checkpoint": checkpoint,
+                  "artifact": output,
+                  "fp32_bytes": os.path.getsize(reference_path),
+                  "int8_bytes": os.path.getsize(output),
+                  "positions": len(expected),
+                  "agreement": agreement}
+        for batch_size in batch_sizes:
+            report[f"fp32_ms@{batch_size}"] = forward_latency(reference, positions["inputs"], batch_size)
+            report[f"int8_ms@{batch_size}"] = forward_latency(quantized, positions["inputs"], batch_size)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dynamic int8 quantization of checkpoints into serving artifacts")
+    parser.add_argument("checkpoints", nargs="+")
+    parser.add_argument("--out-dir", help="Directory of the artifacts (next to each checkpoint by default)")
+    parser.add_argument("--lstm", action="store_true", help="Also quantize the LSTM layers")
+    parser.add_argument("--positions", type=int, default=5000)
+    parser.add_argument("--log", help="Binary game log to draw the held-out positions from")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    for checkpoint in args.checkpoints:
+        output = None
+        if args.out_dir:
+            output = os.path.join(args.out_dir, os.path.basename(scripted_path(checkpoint, 'int8')))
+        report = quantize_model(checkpoint, output, args.lstm, args.positions, args.log)
+        print(f"{checkpoint} -> {report['artifact']}")
+        print(f"  size: {report['fp32_bytes']/1024:.0f} KB -> {report['int8_bytes']/1024:.0f} KB "
+              f"({100*(1-report['int8_bytes']/report['fp32_bytes']):.1f}% smaller)")
+        for batch_size in (1, 32):
+            fp32, int8 = report[f"fp32_ms@{batch_size}"], report[f"int8_ms@{batch_size}"]
+            print(f"  latency @{batch_size}: {fp32:.3f} ms -> {int8:.3f} ms ({fp32/int8:.2f}x)")
+        print(f"  top-1 agreement on {report['positions']} held-out positions: {100*report['agreement']:.2f}%")
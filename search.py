@@ -0,0 +1,253 @@
+import math
+import os
+import time
+
+import numpy as np
+import torch
+
+from bitboard import FULL_MASK, legal_moves_mask, flip_mask, mask_to_array, popcount
+from difficulties import SEARCH_PLAYERS
+from model_registry import get_checkpoint_model, input_dtype
+
+# Thinking time per move
+DEFAULT_TIME_BUDGET_MS=float(os.environ.get("REVERSI_SEARCH_TIME_MS", 500))
+# Leaves evaluated per forward pass of the network
+DEFAULT_SEARCH_BATCH=int(os.environ.get("REVERSI_SEARCH_BATCH", 16))
+# Positions kept in the transposition table of one search
+DEFAULT_MAX_NODES=int(os.environ.get("REVERSI_SEARCH_MAX_NODES", 200000))
+
+PASS=64
+CORNERS=0x8100000000000081
+C_PUCT=1.5
+# A path being evaluated counts as a lost visit, so that the other
+# simulations of the batch spread over other moves
+VIRTUAL_LOSS=1.0
+
+
+def heuristic_value(own, opp, own_legal):
+    ''' Method: heuristic_value
+        Parameters: own, opp (int bitboards), own_legal (int, legal moves of own)
+        Returns: float in (-1, 1), value of a position for the side to move
+        Does: Scores a leaf from its corners and mobility (the policy
+              networks have no value head).
+    '''
+    own_moves=popcount(own_legal)
+    opp_moves=popcount(legal_moves_mask(opp, own))
+    corners=popcount(own & CORNERS)-popcount(opp & CORNERS)
+    mobility=(own_moves-opp_moves)/(own_moves+opp_moves+1)
+    return math.tanh(0.5*corners+mobility)
+
+
+class Node:
+    """
+    Position of the search tree, shared by every path reaching it through
+    the transposition table.
+
+    visits and values are the statistics of the moves of the node (values
+    from the point of view of its side to move), priors the network's move
+    probabilities, None until the node is evaluated.
+    """
+
+    __slots__=("black", "white", "side", "moves", "children", "priors", "visits", "values", "value", "board")
+
+    def __init__(self, black, white, side):
+        self.black=black
+        self.white=white
+        self.side=side
+        own, opp=(black, white) if side == -1 else (white, black)
+        legal=legal_moves_mask(own, opp)
+        moves=[]
+        mask=legal
+        while mask:
+            lowest=mask & -mask
+            moves.append(lowest.bit_length()-1)
+            mask^=lowest
+        self.board=None
+        self.priors=None
+        if moves:
+            self.value=heuristic_value(own, opp, legal)
+        elif legal_moves_mask(opp, own):
+            # Forced pass, nothing for the network to choose
+            moves=[PASS]
+            self.priors=np.ones(1)
+            self.value=-heuristic_value(opp, own, legal_moves_mask(opp, own))
+        else:
+            # End of the game: the exact result
+            diff=popcount(own)-popcount(opp)
+            self.value=float((diff > 0)-(diff < 0))
+        self.moves=moves
+        self.children=[None]*len(moves)
+        self.visits=np.zeros(len(moves))
+        self.values=np.zeros(len(moves))
+
+    @property
+    def terminal(self):
+        return not self.moves
+
+    def board_array(self):
+        # int8 board as in the model inputs (-1 Black, 1 White)
+        if self.board is None:
+            self.board=mask_to_array(self.white).astype(np.int8)-mask_to_array(self.black).astype(np.int8)
+        return self.board
+
+    def child_key(self, index):
+        square=self.moves[index]
+        if square == PASS:
+            return (self.black, self.white, -self.side)
+        own, opp=(self.black, self.white) if self.side == -1 else (self.white, self.black)
+        flips=flip_mask(own, opp, square)
+        own, opp=own | (1 << square) | flips, opp & ~flips & FULL_MASK
+        black, white=(own, opp) if self.side == -1 else (opp, own)
+        return (black, white, -self.side)
+
+    def select(self, c_puct):
+        ''' Method: select
+            Parameters: c_puct (float)
+            Returns: int, index of the move maximizing Q + U (PUCT)
+        '''
+        total=self.visits.sum()
+        q=np.divide(self.values, self.visits, out=np.zeros_like(self.values), where=self.visits > 0)
+        u=c_puct*self.priors*math.sqrt(total+1)/(1+self.visits)
+        return int(np.argmax(q+u))
+
+
+class Search:
+    """
+    Monte Carlo tree search guided by a policy network (PUCT, as in AlphaZero).
+
+    The network's move probabilities are the priors of the tree policy, the
+    leaves are scored with heuristic_value (corners and mobility) and end
+    positions with their exact result. Simulations are run in batches: every
+    simulation of a batch adds a virtual loss along its path, and the new
+    leaves of the batch are evaluated in one forward pass. Positions reached
+    by several move orders share one node of the transposition table, keyed
+    by the bitboards and the side to move.
+
+    The search is anytime: it runs until its time budget (or node limit) is
+    spent and plays the most visited move.
+    """
+
+    def __init__(self, model, time_budget_ms=DEFAULT_TIME_BUDGET_MS, batch_size=DEFAULT_SEARCH_BATCH,
+                 max_nodes=DEFAULT_MAX_NODES, c_puct=C_PUCT, device=None):
+        self.model=model
+        self.time_budget=time_budget_ms/1000
+        self.batch_size=batch_size
+        self.max_nodes=max_nodes
+        self.c_puct=c_puct
+        self.device=device if device is not None else torch.device("cpu")
+        self.table={}
+
+    def node(self, key):
+        node=self.table.get(key)
+        if node is None:
+            node=Node(*key)
+            self.table[key]=node
+        return node
+
+    def run(self, black, white, side, history):
+        """
+        Searches the best move of a position.
+
+        Parameters:
+        - black (int): Bitboard of Black.
+        - white (int): Bitboard of White.
+        - side (int): Side to move (-1 Black, 1 White).
+        - history (numpy.ndarray): Last boards of the game, current position
+          last (see BoardHistory.window), at least len_inpout_seq of them.
+
+        Returns:
+        - dict: "move" (square of the most visited move, None without legal
+          move), "visits" of the root moves, "simulations", "nodes", "depth"
+          (longest path), "seconds" and "nodes_per_sec".
+        """
+        start=time.perf_counter()
+        self.table={}
+        self.history=np.asarray(history, dtype=np.int8)
+        root=self.node((black, white, side))
+        if root.terminal or root.moves == [PASS]:
+            return {"move": None, "visits": {}, "simulations": 0, "nodes": len(self.table), "depth": 0,
+                    "seconds": 0.0, "nodes_per_sec": 0.0}
+        self._evaluate([(root, [])])
+        simulations=0
+        depth=0
+        while time.perf_counter()-start < self.time_budget and len(self.table) < self.max_nodes:
+            leaves=[]
+            for _ in range(self.batch_size):
+                path, leaf=self._descend(root)
+                depth=max(depth, len(path))
+                if leaf.terminal:
+                    self._backup(path, leaf.value, leaf.side)
+                else:
+                    leaves.append((leaf, path))
+                simulations+=1
+            self._evaluate(leaves)
+            for leaf, path in leaves:
+                self._backup(path, leaf.value, leaf.side)
+        seconds=time.perf_counter()-start
+        best=int(np.argmax(root.visits))
+        return {"move": root.moves[best],
+                "visits": {square: int(visits) for square, visits in zip(root.moves, root.visits)},
+                "simulations": simulations,
+                "nodes": len(self.table),
+                "depth": depth,
+                "seconds": seconds,
+                "nodes_per_sec": len(self.table)/seconds if seconds > 0 else 0.0}
+
+    def _descend(self, node):
+        # Follows the tree policy to a leaf, adding virtual losses on the way
+        path=[]
+        while not node.terminal and node.priors is not None:
+            index=node.select(self.c_puct)
+            node.visits[index]+=1
+            node.values[index]-=VIRTUAL_LOSS
+            path.append((node, index))
+            child=node.children[index]
+            if child is None:
+                child=self.node(node.child_key(index))
+                node.children[index]=child
+            node=child
+        return path, node
+
+    def _backup(self, path, value, side):
+        # value is seen by `side`, the visits were counted on the way down
+        for node, index in path:
+            node.values[index]+=VIRTUAL_LOSS+(value if node.side == side else -value)
+
+    def _window(self, path, leaf):
+        # Model input of a leaf: the game history followed by the boards of the path
+        length=self.model.len_inpout_seq
+        boards=[node.children[index].board_array() for node, index in path[-length:]]
+        missing=length-len(boards)
+        if missing:
+            boards=list(self.history[len(self.history)-missing:])+boards
+        window=np.stack(boards)
+        return -window if leaf.side == -1 else window
+
+    def _evaluate(self, leaves):
+        # Priors of the new leaves, one forward pass for all of them
+        unique={}
+        for leaf, path in leaves:
+            if leaf.priors is None and id(leaf) not in unique:
+                unique[id(leaf)]=(leaf, path)
+        if not unique:
+            return
+        inputs=torch.from_numpy(np.stack([self._window(path, leaf) for leaf, path in unique.values()]))
+        with torch.no_grad():
+            move_prob=self.model(inputs.to(self.device, input_dtype(self.model))).reshape(len(unique), -1).float().cpu().numpy()
+        for (leaf, _), prob in zip(unique.values(), move_prob):
+            priors=prob[leaf.moves]+1e-6
+            leaf.priors=priors/priors.sum()
+
+
+def search_move(player, black, white, side, history, time_budget_ms=None, device=None):
+    ''' Method: search_move
+        Parameters: player (str, a difficulty of SEARCH_PLAYERS), black, white (int bitboards),
+                    side (int), history (numpy.ndarray, see Search.run),
+                    time_budget_ms (float, REVERSI_SEARCH_TIME_MS by default), device (torch.device)
+        Returns: dict of Search.run
+        Does: Runs the search of a search difficulty with its network.
+    '''
+    if time_budget_ms is None:
+        time_budget_ms=DEFAULT_TIME_BUDGET_MS
+    model=get_checkpoint_model(SEARCH_PLAYERS[player], device)
+    return Search(model, time_budget_ms, device=device).run(black, white, side, history)
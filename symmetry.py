@@ -0,0 +1,74 @@
+import torch
+
+from bitboard import BOARD_SIZE, NB_SYMMETRIES, GATHER_INDEX
+
+
+def transform(squares, symmetry):
+    ''' Method: transform
+        Parameters: squares (numpy.ndarray or torch.Tensor, last dimension of 64 squares
+                    or last two dimensions of 8x8), symmetry (int)
+        Returns: the same array with every board transformed by the symmetry
+        Does: Applies one of the 8 symmetries to boards, probabilities or targets.
+    '''
+    shape=squares.shape
+    flat=squares.reshape(shape[:-2]+(64,)) if shape[-2:] == (BOARD_SIZE, BOARD_SIZE) else squares
+    if isinstance(flat, torch.Tensor):
+        index=torch.as_tensor(GATHER_INDEX[symmetry], device=flat.device)
+        return flat[..., index].reshape(shape)
+    return flat[..., GATHER_INDEX[symmetry]].reshape(shape)
+
+
+def random_symmetries(batch, labels, generator=None):
+    """
+    Applies a random symmetry to every sample of a batch, the same one to its
+    whole input sequence and to its target.
+
+    Everything is one gather on the device of the batch.
+
+    Parameters:
+    - batch (torch.Tensor): Input sequences, shape (B, L, 8, 8), (B, 8, 8) or (B, L, 64).
+    - labels (torch.Tensor): Targets over the 64 squares, shape (B, 64) or (B, 8, 8).
+    - generator (torch.Generator): Random generator on the device of the batch.
+
+    Returns:
+    - tuple: (transformed batch, transformed labels, symmetry index of every sample).
+    """
+    device=batch.device
+    gather_index=torch.as_tensor(GATHER_INDEX, device=device)
+    symmetries=torch.randint(NB_SYMMETRIES, (batch.shape[0],), device=device, generator=generator)
+    index=gather_index[symmetries]
+
+    flat=batch.reshape(batch.shape[0], -1, 64)
+    flat=flat.gather(2, index[:, None, :].expand(flat.shape))
+    flat_labels=labels.reshape(labels.shape[0], 64).gather(1, index.to(labels.device))
+    return flat.reshape(batch.shape), flat_labels.reshape(labels.shape), symmetries
+
+
+class SymmetryAugmentation:
+    """
+    Wraps a DataLoader of (batch, labels, lengths) triples and applies
+    random_symmetries to every batch, so that train_all sees a random
+    rotation or reflection of every position: eight times the positions for
+    the storage and loading cost of one.
+
+    Batches are moved to `device` first, so the transforms run there.
+    """
+
+    def __init__(self, loader, device=None, seed=None):
+        self.loader=loader
+        self.device=device
+        self.generator=None
+        if seed is not None:
+            self.generator=torch.Generator(device=device if device is not None else 'cpu')
+            self.generator.manual_seed(seed)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for batch, labels, lengths in self.loader:
+            if self.device is not None:
+                batch=batch.to(self.device, non_blocking=True)
+                labels=labels.to(self.device, non_blocking=True)
+            batch, labels, _=random_symmetries(batch, labels, self.generator)
+            yield batch, labels, lengths
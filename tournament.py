@@ -0,0 +1,286 @@
+import argparse
+import csv
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from bitboard import FULL_MASK, INITIAL_BLACK, INITIAL_WHITE, legal_moves_mask, flip_mask_batch, masks_to_array
+from endgame import solve_position
+from game_log import MAX_MOVES, NO_MOVE, GameLogWriter
+from inference import legal_mask_tensor, masked_argmax
+from model_registry import get_checkpoint_model, input_dtype
+from utile import initialze_board
+
+BOARD_SIZE=8
+# Board states recorded per game: at most 60 moves, each pass followed by a
+# move, and the final double pass
+MAX_PLIES=128
+
+
+def count_discs(masks):
+    return masks_to_array(masks).sum(axis=(1, 2))
+
+
+def play_match(black, white, nb_games, seed=0, random_plies=4, device=None, record_moves=False, endgame_empties=0):
+    """
+    Plays nb_games games between two checkpoints, all of them in lockstep.
+
+    At every half-move the games are grouped by the side to move, legal moves
+    are generated for the whole group on numpy.uint64 bitboards and the model
+    of that side picks the moves of the group in one forward pass. The first
+    `random_plies` moves of every game are random legal moves, so that the
+    games of a match differ from each other.
+
+    Board histories follow launch_game: the board is recorded before every
+    move or pass, and padded with the initial board for the input sequences.
+
+    With endgame_empties, both sides play the moves of the exact endgame
+    solver once that few squares are empty (see endgame.py), the move of
+    the model when a solve runs out of time; the model only runs on the
+    games the solver did not answer. It is off by default: the solver
+    costs far more than the forward passes, and with it on the ratings
+    partly measure the solver rather than the networks.
+
+    Parameters:
+    - black (str): Difficulty or checkpoint path playing Black.
+    - white (str): Difficulty or checkpoint path playing White.
+    - nb_games (int): Number of games.
+    - seed (int): Seed of the random opening moves.
+    - random_plies (int): Number of random moves at the start of every game.
+    - device (torch.device): Device of the forward passes (CPU by default).
+    - record_moves (bool): Also returns the moves of every game, in the
+      format of game_log.GameLogWriter.write_batch.
+    - endgame_empties (int): Empty squares from which the endgame is solved (0 never).
+
+    Returns:
+    - dict: Players, wins of each side, draws and the final disc difference
+      (Black minus White) of every game, plus "moves" and "nb_moves" when
+      record_moves is set.
+    """
+    if device is None:
+        device = torch.device("cpu")
+    rng = np.random.default_rng(seed)
+    models = {-1: get_checkpoint_model(black, device), 1: get_checkpoint_model(white, device)}
+    pad = max(model.len_inpout_seq for model in models.values())-1
+
+    bitboards = {-1: np.full(nb_games, INITIAL_BLACK, dtype=np.uint64),
+                 1: np.full(nb_games, INITIAL_WHITE, dtype=np.uint64)}
+    to_move = np.full(nb_games, -1, dtype=np.int8)
+    passes = np.zeros(nb_games, dtype=np.int8)
+    active = np.ones(nb_games, dtype=bool)
+    history = np.empty((nb_games, pad+MAX_PLIES, BOARD_SIZE, BOARD_SIZE), dtype=np.int8)
+    history[:, :pad] = initialze_board()
+    nb_boards = 0
+    moves = np.full((nb_games, MAX_MOVES), NO_MOVE, dtype=np.uint8)
+    nb_moves = np.zeros(nb_games, dtype=np.int64)
+
+    while active.any() and nb_boards < MAX_PLIES:
+        games = np.flatnonzero(active)
+        history[games, pad+nb_boards] = (masks_to_array(bitboards[1][games]).astype(np.int8)
+                                         - masks_to_array(bitboards[-1][games]).astype(np.int8))
+        nb_boards += 1
+
+        groups = {color: games[to_move[games] == color] for color in (-1, 1)}
+        for color, group in groups.items():
+            if len(group) == 0:
+                continue
+            own, opp = bitboards[color][group], bitboards[-color][group]
+            legal = legal_moves_mask(own, opp)
+            has_move = legal != 0
+            passes[group[~has_move]] += 1
+            passes[group[has_move]] = 0
+            to_move[group] = -color
+            group, own, opp, legal = group[has_move], own[has_move], opp[has_move], legal[has_move]
+            if len(group) == 0:
+                continue
+
+            legal_mask = legal_mask_tensor(legal, device)
+            if nb_boards <= random_plies:
+                scores = torch.from_numpy(rng.random(legal_mask.shape)).to(device)
+                squares = masked_argmax(scores, legal_mask).cpu().numpy()
+            else:
+                # Solved rows first, the model only runs on the others
+                squares = np.full(len(group), -1, dtype=np.int64)
+                if endgame_empties:
+                    empties = 64-count_discs(own | opp)
+                    for i in np.flatnonzero(empties <= endgame_empties):
+                        solved = solve_position(int(own[i]), int(opp[i]), endgame_empties)
+                        if solved is not None:
+                            squares[i] = solved["move"]
+                rows = np.flatnonzero(squares < 0)
+                if len(rows):
+                    model = models[color]
+                    window = pad+nb_boards-model.len_inpout_seq+np.arange(model.len_inpout_seq)
+                    model_input = torch.from_numpy(history[group[rows, None], window])
+                    #if black is the current player the board should be multiplay by -1
+                    if color == -1:
+                        model_input = -model_input
+                    with torch.no_grad():
+                        move_prob = model(model_input.to(device, input_dtype(model))).reshape(len(rows), -1).float()
+                    squares[rows] = masked_argmax(move_prob, legal_mask[torch.from_numpy(rows).to(device)]).cpu().numpy()
+
+            moves[group, nb_moves[group]] = squares
+            nb_moves[group] += 1
+            move = np.left_shift(np.uint64(1), squares.astype(np.uint64))
+            flips = flip_mask_batch(own, opp, move)
+            bitboards[color][group] = own | move | flips
+            bitboards[-color][group] = opp & ~flips
+
+        full = (bitboards[-1] | bitboards[1]) == np.uint64(FULL_MASK)
+        active &= ~(full | (passes >= 2))
+
+    disc_diff = count_discs(bitboards[-1])-count_discs(bitboards[1])
+    result = {"black": black, "white": white,
+              "black_wins": int((disc_diff > 0).sum()),
+              "white_wins": int((disc_diff < 0).sum()),
+              "draws": int((disc_diff == 0).sum()),
+              "disc_diff": disc_diff.tolist()}
+    if record_moves:
+        result["moves"] = moves
+        result["nb_moves"] = nb_moves
+    return result
+
+
+def elo_ratings(players, results, prior_games=1.0):
+    """
+    Fits Elo ratings to match results (Bradley-Terry model, draws count half).
+
+    Parameters:
+    - players (list): Player names.
+    - results (list): Outputs of play_match.
+    - prior_games (float): Virtual drawn games added between every pair, so
+      that unbeaten or winless players keep finite ratings.
+
+    Returns:
+    - dict: Elo rating of every player, centered on 1500.
+    """
+    index = {player: i for i, player in enumerate(players)}
+    n = len(players)
+    points = np.full((n, n), prior_games/2)
+    games = np.full((n, n), prior_games)
+    np.fill_diagonal(points, 0)
+    np.fill_diagonal(games, 0)
+    for result in results:
+        b, w = index[result["black"]], index[result["white"]]
+        nb = result["black_wins"]+result["white_wins"]+result["draws"]
+        points[b, w] += result["black_wins"]+result["draws"]/2
+        points[w, b] += result["white_wins"]+result["draws"]/2
+        games[b, w] += nb
+        games[w, b] += nb
+
+    # Minorization-maximization updates of the Bradley-Terry strengths
+    strength = np.ones(n)
+    for _ in range(1000):
+        denominator = (games/(strength[:, None]+strength[None, :])).sum(axis=1)
+        new_strength = points.sum(axis=1)/denominator
+        new_strength /= math.exp(np.log(new_strength).mean())
+        if np.allclose(new_strength, strength, rtol=1e-9):
+            break
+        strength = new_strength
+    return {player: 1500+400*math.log10(strength[index[player]]) for player in players}
+
+
+def _init_worker():
+    # One thread per process, the pool provides the parallelism
+    torch.set_num_threads(1)
+
+
+def run_tournament(players, games_per_pair, workers=None, chunk_size=256, random_plies=4, seed=0, log_path=None,
+                   endgame_empties=0):
+    """
+    Plays every ordered pair of players (each side plays Black and White).
+
+    Parameters:
+    - players (list): Difficulties or checkpoint paths.
+    - games_per_pair (int): Games per ordered pair of players.
+    - workers (int): Size of the process pool (os.cpu_count() by default, 1 runs in process).
+    - chunk_size (int): Games played in lockstep by one task.
+    - random_plies (int): Number of random moves at the start of every game.
+    - seed (int): Base seed of the random opening moves.
+    - log_path (str): Binary game log (see game_log) every game is appended to.
+    - endgame_empties (int): Empty squares from which the endgame is solved (see play_match).
+
+    Returns:
+    - list: Outputs of play_match, one per task, without the moves.
+    """
+    tasks = []
+    for black in players:
+        for white in players:
+            if black == white:
+                continue
+            for start in range(0, games_per_pair, chunk_size):
+                tasks.append((black, white, min(chunk_size, games_per_pair-start), seed+len(tasks), random_plies,
+                              None, log_path is not None, endgame_empties))
+
+    game_log = GameLogWriter(log_path) if log_path is not None else None
+    try:
+        if workers == 1:
+            _init_worker()
+            return [_log_games(game_log, play_match(*task)) for task in tasks]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(play_match, *task) for task in tasks]
+            return [_log_games(game_log, future.result()) for future in futures]
+    finally:
+        if game_log is not None:
+            game_log.close()
+
+
+def _log_games(game_log, result):
+    # The games are written by the parent process only, as the tasks complete
+    if game_log is not None:
+        game_log.write_batch(result["black"], result["white"], result.pop("moves"),
+                             result.pop("nb_moves"), result["disc_diff"])
+    return result
+
+
+def results_table(players, results):
+    """
+    Aggregates the results of every player.
+
+    Returns:
+    - list: One dict per player (games, wins, losses, draws, win rate, Elo), best Elo first.
+    """
+    ratings = elo_ratings(players, results)
+    table = {player: {"player": player, "games": 0, "wins": 0, "losses": 0, "draws": 0} for player in players}
+    for result in results:
+        for side, other in (("black", "white"), ("white", "black")):
+            row = table[result[side]]
+            row["wins"] += result[f"{side}_wins"]
+            row["losses"] += result[f"{other}_wins"]
+            row["draws"] += result["draws"]
+            row["games"] += result["black_wins"]+result["white_wins"]+result["draws"]
+    for player, row in table.items():
+        row["win_rate"] = (row["wins"]+row["draws"]/2)/row["games"] if row["games"] else 0.0
+        row["elo"] = ratings[player]
+    return sorted(table.values(), key=lambda row: -row["elo"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Self-play tournament between checkpoints")
+    parser.add_argument("players", nargs="+", help="Difficulties or checkpoint paths")
+    parser.add_argument("--games", type=int, default=1000, help="Games per ordered pair of players")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--random-plies", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="Write the results table to this file")
+    parser.add_argument("--log", help="Append every game to this binary game log")
+    parser.add_argument("--endgame", type=int, default=0,
+                        help="Solve the endgame exactly from this many empty squares (0 never, the default for ratings)")
+    args = parser.parse_args()
+
+    results = run_tournament(args.players, args.games, args.workers, args.chunk_size, args.random_plies, args.seed,
+                             args.log, args.endgame)
+    table = results_table(args.players, results)
+    print(f"{'player':40s} {'games':>6s} {'wins':>6s} {'losses':>6s} {'draws':>6s} {'win%':>6s} {'elo':>7s}")
+    for row in table:
+        print(f"{os.path.basename(row['player']):40s} {row['games']:6d} {row['wins']:6d} {row['losses']:6d} "
+              f"{row['draws']:6d} {100*row['win_rate']:6.1f} {row['elo']:7.1f}")
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(table[0]))
+            writer.writeheader()
+            writer.writerows(table)
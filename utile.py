@@ -1,5 +1,7 @@
 import numpy as np
 
+from bitboard import board_to_bitboards, legal_moves_mask, mask_to_moves
+
 BOARD_SIZE=8
 
 def initialze_board():
@@ -14,6 +16,11 @@ def initialze_board():
     
     return board_stat_init
 
+# Shared read-only initial board, used to pad input sequences without
+# allocating a new board every time
+INITIAL_BOARD = initialze_board().astype(np.int8)
+INITIAL_BOARD.flags.writeable = False
+
 
 def is_legal_move(move,board_stat,NgBlackPsWhith):
     ''' Method: is_legal_move
@@ -41,13 +48,8 @@ def get_legal_moves(board_stat,NgBlackPsWhith):
         Does: Finds all the legal moves the current player can make.
               Every move is a tuple of coordinates (row, col).
     '''
-    moves = []
-    for row in range(len(board_stat)):
-        for col in range(len(board_stat)):
-            move = (row, col)
-            if is_legal_move(move,board_stat,NgBlackPsWhith):
-                moves.append(move)
-    return moves
+    own, opp = board_to_bitboards(board_stat, NgBlackPsWhith)
+    return mask_to_moves(legal_moves_mask(own, opp))
 
 def is_valid_coord(row, col,board_size=8):
     ''' Method: is_valid_coord
@@ -0,0 +1,67 @@
+import numpy as np
+
+from bitboard import NB_SYMMETRIES, SQUARE_MAPS, mask_to_array
+
+# Longest board sequence window_keys combines
+MAX_WINDOW=64
+
+_rng=np.random.default_rng(0x5EED)
+# Random key of a black and of a white disc on every square
+_DISC_KEYS=_rng.integers(0, 1 << 63, size=(2, 64), dtype=np.uint64) << np.uint64(1) | np.uint64(1)
+
+# HASH_TABLE[square, value+1, k]: key of a disc of value -1 (Black) or 1 (White)
+# on square in the board transformed by symmetry k, 0 for an empty square
+HASH_TABLE=np.zeros((64, 3, NB_SYMMETRIES), dtype=np.uint64)
+HASH_TABLE[:, 0]=_DISC_KEYS[0][SQUARE_MAPS].T
+HASH_TABLE[:, 2]=_DISC_KEYS[1][SQUARE_MAPS].T
+# Change of the hashes when the disc of a square changes color
+FLIP_TABLE=HASH_TABLE[:, 0] ^ HASH_TABLE[:, 2]
+
+# Odd multipliers of the boards of a sequence by position, and keys of the
+# side to move (the model input of Black is the negated board)
+_POSITION_KEYS=_rng.integers(0, 1 << 63, size=MAX_WINDOW, dtype=np.uint64) << np.uint64(1) | np.uint64(1)
+_SIDE_KEYS={-1: _rng.integers(0, 1 << 63, dtype=np.uint64), 1: np.uint64(0)}
+
+
+def board_hashes(boards):
+    """
+    Zobrist hashes of boards under the 8 symmetries.
+
+    Parameters:
+    - boards (numpy.ndarray): One board (8, 8) or N boards (N, 8, 8), -1 Black, 1 White, 0 empty.
+
+    Returns:
+    - numpy.ndarray: numpy.uint64 hashes of shape (8,) or (N, 8), one per symmetry
+      (see bitboard.SQUARE_MAPS).
+    """
+    boards=np.asarray(boards)
+    flat=boards.reshape(-1, 64).astype(np.intp)+1
+    hashes=np.bitwise_xor.reduce(HASH_TABLE[np.arange(64), flat], axis=1)
+    return hashes[0] if boards.ndim == 2 else hashes
+
+
+def update_hashes(hashes, color, square, flips):
+    ''' Method: update_hashes
+        Parameters: hashes (numpy.ndarray of 8 numpy.uint64), color (int, -1 or 1),
+                    square (int), flips (int bitboard)
+        Returns: numpy.ndarray, hashes of the board after the move
+        Does: Updates the hashes of a board incrementally with a move and its flips.
+    '''
+    flipped=np.flatnonzero(mask_to_array(flips))
+    return hashes ^ HASH_TABLE[square, color+1] ^ np.bitwise_xor.reduce(FLIP_TABLE[flipped], axis=0)
+
+
+def window_keys(hashes, side):
+    """
+    Keys of a model input, a board sequence seen by the side to move, under
+    the 8 symmetries.
+
+    Parameters:
+    - hashes (numpy.ndarray): Board hashes of the sequence, shape (L, 8), oldest first.
+    - side (int): Side to move (-1 Black, 1 White).
+
+    Returns:
+    - numpy.ndarray: numpy.uint64 keys of shape (8,).
+    """
+    length=len(hashes)
+    return np.bitwise_xor.reduce(hashes*_POSITION_KEYS[:length, None], axis=0) ^ _SIDE_KEYS[side]